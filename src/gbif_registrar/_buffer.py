@@ -0,0 +1,107 @@
+"""Buffered registrations file updates, for internal use only."""
+
+import atexit
+import threading
+import time
+from gbif_registrar.registry import _as_registry
+
+
+class _StatusBuffer:
+    """Collects synchronization status updates in memory and writes them to
+    the registrations file in batches.
+
+    Writing each status as it changes rewrites the registrations file once
+    per dataset, which grows quadratically over a large batch. The buffer
+    instead writes pending statuses in a single merge when `flush_size`
+    statuses are pending, when the oldest pending status is `flush_interval`
+    seconds old, when the buffer is closed, and at interpreter exit. A timer
+    thread flushes on the interval, so a status is written on time even if no
+    other status is buffered after it, e.g. during a long upload.
+
+    Statuses not yet flushed are lost if the process crashes. Batch jobs
+    record each status to their journal before it is buffered, so resuming
+    the job restores them.
+
+    Statuses are applied to the Registry immediately, so lookups through it
+    see them before they are flushed.
+
+    Parameters
+    ----------
+    registrations_file : str, pathlike object, or Registry
+        Path of the registrations file, or a Registry of it.
+    flush_size : int, optional
+        Number of pending statuses that triggers a flush.
+    flush_interval : float, optional
+        Age, in seconds, of the oldest pending status that triggers a flush.
+    """
+
+    def __init__(self, registrations_file, flush_size=100, flush_interval=60.0):
+        self.registry = _as_registry(registrations_file)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = set()
+        self._oldest = None
+        self._timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def mark_synchronized(self, local_dataset_id):
+        """Buffers a True synchronization status for a dataset.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The identifier of a dataset in the EDI repository.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self.registry.update(local_dataset_id, synchronized=True)
+            self._pending.add(local_dataset_id)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            due = len(self._pending) >= self.flush_size or (
+                time.monotonic() - self._oldest >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes all pending statuses to the registrations file.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return None
+            self.registry.save()
+            self._pending = set()
+            self._oldest = None
+        return None
+
+    def close(self):
+        """Flushes pending statuses and stops flushing on the interval and at
+        interpreter exit.
+
+        Returns
+        -------
+        None
+        """
+        self.flush()
+        atexit.unregister(self.flush)
@@ -0,0 +1,102 @@
+"""Caches of metadata documents and URL checks, for internal use only."""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class _MetadataCache:
+    """Metadata documents, keyed by PASTA environment and local_dataset_id.
+
+    When the documents held exceed `max_bytes`, the least recently used are
+    evicted, so memory stays bounded however many datasets are read.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Maximum total size, in bytes of UTF-8, of the documents held. If not
+        provided, the cache is unbounded.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._documents
+
+    def __len__(self):
+        with self._lock:
+            return len(self._documents)
+
+    def get(self, key):
+        """Returns a document, or None if it isn't held."""
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is None:
+                return None
+            self._documents.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, document):
+        """Holds a document, evicting the least recently used past the
+        budget. A document larger than the budget isn't held."""
+        size = len(document.encode("utf-8"))
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._documents[key] = (document, size)
+            self.size += size
+            while self.max_bytes is not None and self.size > self.max_bytes:
+                self._pop(next(iter(self._documents)))
+
+    def discard(self, key):
+        """Stops holding a document, e.g. once it is no longer needed."""
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        entry = self._documents.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class _TTLCache:
+    """Values that expire `ttl` seconds after they are put, e.g. the results
+    of checking whether URLs are reachable.
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds a value is held.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns a value, or None if it isn't held or has expired."""
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[1]:
+                del self._values[key]
+                return None
+            return entry[0]
+
+    def put(self, key, value):
+        """Holds a value for `ttl` seconds."""
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + self.ttl)
+
+    def clear(self):
+        """Stops holding all values."""
+        with self._lock:
+            self._values = {}
@@ -0,0 +1,731 @@
+"""HTTP request handling for internal use only.
+
+All requests made to the GBIF and PASTA APIs by the `_utilities` module pass
+through the `_request` function of this module, which applies the rate
+limits shared by the registrar's threads and processes, retries transient
+failures, fails fast while a host is down, and coalesces identical reads in
+flight at the same time.
+"""
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import json
+from os import environ
+import os.path
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from gbif_registrar._locking import _file_lock
+from gbif_registrar.configure import _OPTIONAL_KEYS
+from gbif_registrar.metrics import _increment, _observe
+from gbif_registrar.transport import get_transport
+
+# Request budgets, in requests per second, are applied to each host. Set
+# them with the optional RATE_LIMIT_READ and RATE_LIMIT_WRITE configuration
+# keys.
+
+# Methods that only read from a server. All others are counted against the
+# write budget.
+_READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Number of times a throttled (HTTP 429) request is sent before the throttled
+# response is returned to the caller.
+_MAX_THROTTLED_ATTEMPTS = 5
+
+# Seconds to wait after a throttled response that lacks a Retry-After header.
+_DEFAULT_RETRY_AFTER = 1.0
+
+# The retry policy is set with the optional RETRY_ATTEMPTS and RETRY_BACKOFF
+# configuration keys. Backoff doubles with each attempt, up to _MAX_BACKOFF
+# seconds.
+_MAX_BACKOFF = 30.0
+
+# Methods that can be safely resent, because repeating them has the same
+# effect as sending them once. POST requests are only resent when the server
+# is known not to have processed them.
+_IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+# Response status codes of transient server failures.
+_RETRY_STATUSES = (500, 502, 503, 504)
+
+# Response status codes that guarantee the server did not process a request.
+_UNPROCESSED_STATUSES = (503,)
+
+# The circuit breaker is set with the optional CIRCUIT_BREAKER_THRESHOLD and
+# CIRCUIT_BREAKER_TIMEOUT configuration keys.
+
+
+class _CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised when a request is not sent because its host is failing."""
+
+
+class _TokenBucket:
+    """A thread-safe token bucket.
+
+    Tokens are added to the bucket at `rate` tokens per second, up to
+    `capacity`. Each request takes one token, and waits for one to become
+    available if the bucket is empty.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added to the bucket per second.
+    capacity : float, optional
+        Maximum number of tokens the bucket can hold, i.e. the largest burst of
+        requests allowed. Defaults to `rate`, or 1, whichever is larger.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(self.rate, 1.0))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token from the bucket, waiting until one is available.
+
+        Returns
+        -------
+        None
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                wait = _token_wait(self._tokens, self.rate, self._blocked_until - now)
+                if wait <= 0:
+                    self._tokens -= 1
+                    return None
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Stops tokens from being taken for a number of seconds.
+
+        Parameters
+        ----------
+        seconds : float
+            Seconds from now during which `acquire` waits.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class _FileTokenBucket:
+    """A token bucket whose state is shared across processes through a file.
+
+    This is the cross-process counterpart of `_TokenBucket`, for running
+    several registrar processes on one node against a shared budget. The
+    bucket state is kept in a small JSON file that is read and written under
+    an exclusive file lock.
+
+    Parameters
+    ----------
+    state_file : str or pathlike object
+        Path of the file holding the bucket state.
+    rate : float
+        Tokens added to the bucket per second.
+    capacity : float, optional
+        Maximum number of tokens the bucket can hold. Defaults to `rate`, or 1,
+        whichever is larger.
+    """
+
+    def __init__(self, state_file, rate, capacity=None):
+        self.state_file = os.fspath(state_file)
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(self.rate, 1.0))
+
+    def acquire(self):
+        """Takes a token from the bucket, waiting until one is available.
+
+        Returns
+        -------
+        None
+        """
+        while True:
+            with _file_lock(self.state_file + ".lock"):
+                state = self._read_state()
+                now = time.time()
+                tokens = min(
+                    self.capacity,
+                    state["tokens"] + (now - state["updated"]) * self.rate,
+                )
+                wait = _token_wait(tokens, self.rate, state["blocked_until"] - now)
+                if wait <= 0:
+                    tokens -= 1
+                self._write_state(tokens, now, state["blocked_until"])
+                if wait <= 0:
+                    return None
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Stops tokens from being taken, by any process, for a number of
+        seconds.
+
+        Parameters
+        ----------
+        seconds : float
+            Seconds from now during which `acquire` waits.
+
+        Returns
+        -------
+        None
+        """
+        with _file_lock(self.state_file + ".lock"):
+            state = self._read_state()
+            blocked_until = max(state["blocked_until"], time.time() + seconds)
+            self._write_state(state["tokens"], state["updated"], blocked_until)
+
+    def _read_state(self):
+        """Returns the bucket state, or a full bucket if there is none."""
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as state:
+                return json.load(state)
+        except (FileNotFoundError, ValueError):
+            return {"tokens": self.capacity, "updated": time.time(), "blocked_until": 0}
+
+    def _write_state(self, tokens, updated, blocked_until):
+        """Writes the bucket state."""
+        with open(self.state_file, "w", encoding="utf-8") as state:
+            json.dump(
+                {"tokens": tokens, "updated": updated, "blocked_until": blocked_until},
+                state,
+            )
+
+
+class _RateLimiter:
+    """Read and write request budgets for each host.
+
+    Buckets are created on first use, for each host and the rate limit
+    settings of the configuration sending to it. They are shared by all
+    threads of the process, and by all processes configured with the same
+    RATE_LIMIT_DIR.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, kind, config=None):
+        """Waits until a request of `kind` ("read" or "write") can be sent to
+        `host` under the rate limits of `config`.
+
+        Returns
+        -------
+        None
+        """
+        self._bucket(host, kind, config).acquire()
+
+    def block(self, host, seconds, config=None):
+        """Stops all requests to `host` for a number of seconds, whatever
+        their configuration.
+
+        Returns
+        -------
+        None
+        """
+        for kind in ("read", "write"):
+            self._bucket(host, kind, config)
+        with self._lock:
+            buckets = [
+                bucket for key, bucket in self._buckets.items() if key[0] == host
+            ]
+        for bucket in buckets:
+            bucket.block(seconds)
+
+    def reset(self):
+        """Discards all buckets so they are recreated from the current
+        configuration.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._buckets = {}
+
+    def _bucket(self, host, kind, config=None):
+        """Returns the bucket of `host`, `kind`, and the rate limit settings of
+        `config`, creating it if needed."""
+        rate = float(_setting("RATE_LIMIT_" + kind.upper(), config))
+        state_dir = _setting("RATE_LIMIT_DIR", config)
+        key = (host, kind, rate, state_dir)
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = _new_bucket(host, kind, rate, state_dir)
+            return self._buckets[key]
+
+
+def _new_bucket(host, kind, rate, state_dir=None):
+    """Returns a new token bucket.
+
+    Parameters
+    ----------
+    host : str
+        Host name (and port) the bucket applies to.
+    kind : str
+        The budget, either "read" or "write".
+    rate : float
+        Requests per second allowed by the bucket.
+    state_dir : str, optional
+        The RATE_LIMIT_DIR configuration key, i.e. the directory in which to
+        share the bucket across processes.
+
+    Returns
+    -------
+    _TokenBucket or _FileTokenBucket
+        A `_FileTokenBucket` if `state_dir` is set, otherwise a `_TokenBucket`.
+    """
+    if state_dir:
+        file_name = host.replace(":", "_") + "." + kind + ".json"
+        return _FileTokenBucket(os.path.join(state_dir, file_name), rate)
+    return _TokenBucket(rate)
+
+
+def _token_wait(tokens, rate, blocked_for):
+    """Returns the seconds to wait before a token can be taken.
+
+    Parameters
+    ----------
+    tokens : float
+        Tokens currently in the bucket.
+    rate : float
+        Tokens added to the bucket per second.
+    blocked_for : float
+        Seconds remaining on a block set by a Retry-After response.
+
+    Returns
+    -------
+    float
+        Zero or less if a token can be taken now.
+    """
+    if blocked_for > 0:
+        return blocked_for
+    if tokens >= 1:
+        return 0.0
+    return (1 - tokens) / rate
+
+
+_rate_limiter = _RateLimiter()
+
+
+class _CircuitBreaker:
+    """Tracks consecutive failures of each host, and stops requests to hosts
+    that appear to be down.
+
+    After `threshold` consecutive failures the circuit of a host opens, and
+    requests to it raise `_CircuitOpenError` without being sent. Once `timeout`
+    seconds have passed a single trial request is let through. The circuit
+    closes if the trial succeeds, and reopens if it fails.
+    """
+
+    def __init__(self):
+        self._failures = {}
+        self._opened_at = {}
+        self._trial = set()
+        self._lock = threading.Lock()
+
+    def check(self, host, config=None):
+        """Raises `_CircuitOpenError` if requests to `host` should not be sent,
+        given the CIRCUIT_BREAKER_TIMEOUT of `config`.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            if host not in self._opened_at:
+                return None
+            elapsed = time.monotonic() - self._opened_at[host]
+            if (
+                elapsed >= float(_setting("CIRCUIT_BREAKER_TIMEOUT", config))
+                and host not in self._trial
+            ):
+                self._trial.add(host)
+                return None
+        raise _CircuitOpenError(
+            f"Requests to {host} are suspended after repeated failures."
+        )
+
+    def record_success(self, host):
+        """Closes the circuit of `host`.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trial.discard(host)
+
+    def record_failure(self, host, config=None):
+        """Counts a failure of `host`, opening its circuit at the
+        CIRCUIT_BREAKER_THRESHOLD of `config`.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+            threshold = float(_setting("CIRCUIT_BREAKER_THRESHOLD", config))
+            if self._failures[host] >= threshold or host in self._trial:
+                self._opened_at[host] = time.monotonic()
+                self._trial.discard(host)
+
+    def reset(self):
+        """Closes all circuits.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._failures = {}
+            self._opened_at = {}
+            self._trial = set()
+
+
+_circuit_breaker = _CircuitBreaker()
+
+
+def _setting(key, config=None):
+    """Returns a setting of the request pipeline.
+
+    Parameters
+    ----------
+    key : str
+        One of the optional configuration keys that tune requests, e.g.
+        RETRY_ATTEMPTS or RATE_LIMIT_READ.
+    config : Config, optional
+        The configuration to read the setting from. Defaults to the
+        environment variables set by the load_configuration function.
+
+    Returns
+    -------
+    str or None
+        The value of the optional configuration key, or its default.
+    """
+    if config is None:
+        return environ.get(key, _OPTIONAL_KEYS[key])
+    return config.option(key)
+
+
+def _backoff(attempt, config=None):
+    """Returns the seconds to wait before resending a failed request.
+
+    Parameters
+    ----------
+    attempt : int
+        The number of attempts made so far.
+    config : Config, optional
+        The configuration whose RETRY_BACKOFF applies.
+
+    Returns
+    -------
+    float
+        An exponentially increasing delay, with random jitter so that
+        concurrent workers don't retry in lockstep.
+    """
+    backoff = float(_setting("RETRY_BACKOFF", config))
+    delay = min(_MAX_BACKOFF, backoff * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _retry_after(response):
+    """Returns the delay requested by a response's Retry-After header.
+
+    Parameters
+    ----------
+    response : requests.Response
+        The response of a throttled request.
+
+    Returns
+    -------
+    float or None
+        Seconds to wait, or None if the header is missing or unparseable. Both
+        the delay-seconds and HTTP-date forms of the header are supported.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class _SingleFlight:
+    """Coalesces identical calls made at the same time.
+
+    The first caller of a key runs the call. Callers of the same key that
+    arrive while it is in flight wait for it, and share its result (or
+    error), rather than running the call again. Once the call returns, the
+    next caller of the key runs it anew, so results are never served stale.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """Runs a call, or waits for an identical call in flight.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the call.
+        function : callable
+            The call, taking no arguments.
+
+        Returns
+        -------
+        object
+            The return value of the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = function()
+        except BaseException as error:
+            call["error"] = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+        return call["result"]
+
+
+_single_flight = _SingleFlight()
+
+
+def _flight_key(method, url, kwargs):
+    """Returns the key under which identical requests are coalesced, or None
+    if the request can't be coalesced.
+
+    Parameters
+    ----------
+    method : str
+        The HTTP method.
+    url : str
+        The URL of the request.
+    kwargs : dict
+        Keyword arguments of the request.
+
+    Returns
+    -------
+    str or None
+        None for requests that write, and streamed requests, whose response
+        can only be read once.
+    """
+    if method.upper() not in _READ_METHODS or kwargs.get("stream"):
+        return None
+    try:
+        return json.dumps([method.upper(), url, kwargs], sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+def _json(response):
+    """Returns the parsed JSON body of a response.
+
+    The body is parsed once and kept on the response, so callers sharing a
+    coalesced response share the parsed result too. Treat it as read-only.
+
+    Parameters
+    ----------
+    response : requests.Response
+        A response with a JSON body.
+
+    Returns
+    -------
+    object
+        The parsed body.
+    """
+    if "_parsed_json" not in response.__dict__:
+        response.__dict__["_parsed_json"] = json.loads(response.text)
+    return response.__dict__["_parsed_json"]
+
+
+def _request(method, url, idempotent=None, config=None, **kwargs):
+    """Sends an HTTP request within the rate limits of the target host.
+
+    Requests that are throttled by the server (HTTP 429) are resent once the
+    server's Retry-After delay has passed. The delay is applied to all
+    requests to the host, across threads and (if configured) processes.
+
+    Requests that fail transiently (connection errors, timeouts, and HTTP
+    5xx responses) are resent with exponential backoff, if resending them is
+    safe. Repeated failures open the circuit of the host, after which
+    requests to it fail fast until it recovers.
+
+    Identical reads (the same method, URL, and arguments) made by several
+    threads at the same time are sent once, and all of them receive the same
+    response.
+
+    Parameters
+    ----------
+    method : str
+        The HTTP method, e.g. "GET".
+    url : str
+        The URL to send the request to.
+    idempotent : bool, optional
+        Whether the request can be safely resent after a failure that may
+        have reached the server. Defaults to True for GET, HEAD, OPTIONS, PUT,
+        and DELETE requests, and False for POST requests.
+    config : Config, optional
+        The configuration whose rate limit, retry, and circuit breaker
+        settings apply. Defaults to the environment variables set by the
+        load_configuration function.
+    **kwargs
+        Keyword arguments passed on to `requests` (e.g. `data`, `auth`,
+        `headers`, `timeout`).
+
+    Returns
+    -------
+    requests.Response
+        The response to the request. A response with a failure status is
+        returned once retries are exhausted.
+
+    Raises
+    ------
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout
+        If the request can't be completed once retries are exhausted.
+    _CircuitOpenError
+        If the circuit of the host is open.
+    """
+    key = _flight_key(method, url, kwargs)
+    if key is None:
+        return _request_with_retries(method, url, idempotent, config, **kwargs)
+    return _single_flight.do(
+        key, lambda: _request_with_retries(method, url, idempotent, config, **kwargs)
+    )
+
+
+def _request_with_retries(method, url, idempotent=None, config=None, **kwargs):
+    """Sends an HTTP request, retrying it as described in `_request`.
+
+    Parameters
+    ----------
+    method : str
+        The HTTP method, e.g. "GET".
+    url : str
+        The URL to send the request to.
+    idempotent : bool, optional
+        Whether the request can be safely resent. See `_request`.
+    config : Config, optional
+        The configuration whose request settings apply. See `_request`.
+    **kwargs
+        Keyword arguments passed on to `requests`.
+
+    Returns
+    -------
+    requests.Response
+        The response to the request.
+    """
+    host = urlsplit(url).netloc
+    kind = "read" if method.upper() in _READ_METHODS else "write"
+    if idempotent is None:
+        idempotent = method.upper() in _IDEMPOTENT_METHODS
+    max_attempts = int(float(_setting("RETRY_ATTEMPTS", config)))
+    attempts = 0
+    throttled = 0
+    while True:
+        _circuit_breaker.check(host, config)
+        _rate_limiter.acquire(host, kind, config)
+        start = time.monotonic()
+        try:
+            resp = _send(method, url, **kwargs)
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as exc:
+            _record_request(host, method, "error", start)
+            _circuit_breaker.record_failure(host, config)
+            attempts += 1
+            unsent = isinstance(exc, requests.exceptions.ConnectTimeout)
+            if attempts >= max_attempts or not (idempotent or unsent):
+                raise
+            time.sleep(_backoff(attempts, config))
+            continue
+        _record_request(host, method, resp.status_code, start)
+        if resp.status_code == 429:
+            throttled += 1
+            if throttled >= _MAX_THROTTLED_ATTEMPTS:
+                return resp
+            delay = _retry_after(resp)
+            delay = _DEFAULT_RETRY_AFTER if delay is None else delay
+            _rate_limiter.block(host, delay, config)
+            continue
+        if resp.status_code in _RETRY_STATUSES:
+            _circuit_breaker.record_failure(host, config)
+            attempts += 1
+            unsent = resp.status_code in _UNPROCESSED_STATUSES
+            if attempts >= max_attempts or not (idempotent or unsent):
+                return resp
+            delay = _retry_after(resp) if resp.status_code == 503 else None
+            time.sleep(_backoff(attempts, config) if delay is None else delay)
+            continue
+        _circuit_breaker.record_success(host)
+        return resp
+
+
+def _record_request(host, method, status, start):
+    """Counts a request, and records its latency, in the metrics."""
+    _increment(
+        "gbif_registrar_http_requests_total",
+        host=host,
+        method=method.upper(),
+        status=status,
+    )
+    _observe(
+        "gbif_registrar_http_request_duration_seconds",
+        time.monotonic() - start,
+        host=host,
+    )
+
+
+def _send(method, url, **kwargs):
+    """Sends an HTTP request with the current transport.
+
+    Parameters
+    ----------
+    method : str
+        The HTTP method, e.g. "GET".
+    url : str
+        The URL to send the request to.
+    **kwargs
+        Keyword arguments passed on to the transport (see the transport
+        module).
+
+    Returns
+    -------
+    requests.Response
+        The response to the request.
+    """
+    return get_transport().send(method, url, **kwargs)
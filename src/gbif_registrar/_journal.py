@@ -0,0 +1,113 @@
+"""A durable record of batch job progress, for internal use only."""
+
+import json
+import os
+import threading
+import time
+
+
+class _Journal:
+    """An append-only journal of the stages completed for each dataset in a
+    batch job.
+
+    Each entry is written as a line of JSON and flushed to disk with `fsync`
+    before the call returns, so the journal reflects every stage completed
+    before a crash. A partially written last line (from a crash mid-write) is
+    truncated from the file when the journal is read back, so the entries
+    appended after it start on a line of their own.
+
+    Parameters
+    ----------
+    journal_file : str or pathlike object
+        Path of the journal file.
+    resume : bool, optional
+        If True, the stages recorded in an existing journal are loaded so the
+        job can continue where it left off. If False (the default), any
+        existing journal is cleared to start a new job.
+    """
+
+    def __init__(self, journal_file, resume=False):
+        self.journal_file = os.fspath(journal_file)
+        self._stages = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(self.journal_file):
+            self._load()
+        else:
+            with open(self.journal_file, "w", encoding="utf-8"):
+                pass
+
+    def record(self, local_dataset_id, stage):
+        """Records the completion of a stage.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The identifier of the dataset in the EDI repository.
+        stage : str
+            Name of the completed stage, e.g. "endpoint_posted".
+
+        Returns
+        -------
+        None
+        """
+        entry = {"local_dataset_id": local_dataset_id, "stage": stage}
+        entry["time"] = time.time()
+        with self._lock:
+            with open(self.journal_file, "a", encoding="utf-8") as journal:
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._stages.setdefault(local_dataset_id, set()).add(stage)
+
+    def completed(self, local_dataset_id, stage):
+        """Returns True if a stage has been completed for a dataset.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The identifier of the dataset in the EDI repository.
+        stage : str
+            Name of the stage.
+
+        Returns
+        -------
+        bool
+        """
+        with self._lock:
+            return stage in self._stages.get(local_dataset_id, set())
+
+    def stages(self, local_dataset_id):
+        """Returns the stages completed for a dataset.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The identifier of the dataset in the EDI repository.
+
+        Returns
+        -------
+        set
+            Names of the completed stages.
+        """
+        with self._lock:
+            return set(self._stages.get(local_dataset_id, set()))
+
+    def _load(self):
+        """Reads the stages recorded in the journal file, and truncates an
+        incomplete last line."""
+        with open(self.journal_file, "rb+") as journal:
+            content = journal.read()
+            end = content.rfind(b"\n") + 1
+            if end < len(content):
+                # Incomplete entry written during a crash
+                journal.truncate(end)
+                journal.flush()
+                os.fsync(journal.fileno())
+        for line in content[:end].decode("utf-8", errors="replace").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._stages.setdefault(entry["local_dataset_id"], set()).add(
+                entry["stage"]
+            )
@@ -0,0 +1,61 @@
+"""Cross-process file locking for internal use only."""
+
+from contextlib import contextmanager
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def _file_lock(lock_file):
+    """Holds an exclusive advisory lock on a file for the duration of a
+    `with` block.
+
+    The lock is shared by all threads and processes on a node that lock the
+    same path, which makes it suitable for coordinating access to state that
+    lives on disk (e.g. the registrations file).
+
+    Parameters
+    ----------
+    lock_file : str or pathlike object
+        Path of the lock file. It is created if it doesn't exist, and is left
+        in place on release so other processes can continue to lock it.
+
+    Yields
+    ------
+    None
+    """
+    with open(lock_file, "a+b") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        else:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lock_path(file_path):
+    """Returns the path of the lock file guarding `file_path`.
+
+    Parameters
+    ----------
+    file_path : str or pathlike object
+        Path of the file to be guarded.
+
+    Returns
+    -------
+    str
+        The lock file path, i.e. `file_path` with a `.lock` suffix.
+    """
+    return os.fspath(file_path) + ".lock"
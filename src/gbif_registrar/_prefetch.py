@@ -0,0 +1,72 @@
+"""Background reads of the metadata of upcoming uploads, for internal use
+only."""
+
+from concurrent.futures import ThreadPoolExecutor
+from gbif_registrar._utilities import _read_local_dataset_metadata
+from gbif_registrar.configure import _resolve_config
+
+
+class _Prefetcher:
+    """Reads the metadata documents of the next datasets of a batch in the
+    background, into the metadata cache.
+
+    An upload spends most of its time waiting for GBIF to crawl the dataset.
+    Reading the metadata of the datasets queued after it meanwhile overlaps
+    their latency with that wait, so each upload starts with its metadata
+    document at hand.
+
+    Use within `_cache_local_dataset_metadata`, whose byte budget bounds the
+    memory used by the documents read ahead.
+
+    Parameters
+    ----------
+    local_dataset_ids : list of str
+        The datasets of the batch, in the order they are uploaded.
+    depth : int
+        The number of datasets read ahead of the one being uploaded.
+    cache : _MetadataCache
+        The metadata cache, from which documents of uploaded datasets are
+        dropped.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+    """
+
+    def __init__(self, local_dataset_ids, depth, cache, config=None):
+        self.local_dataset_ids = list(local_dataset_ids)
+        self.depth = depth
+        self.cache = cache
+        self.config = _resolve_config(config)
+        self._submitted = set()
+        self._executor = ThreadPoolExecutor(max_workers=depth)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def advance(self, position):
+        """Reads ahead of the dataset at `position`, and drops the metadata
+        of the dataset before it, which has been uploaded."""
+        if position > 0:
+            previous = self.local_dataset_ids[position - 1]
+            self.cache.discard((self.config.pasta_environment, previous))
+        for local_dataset_id in self.local_dataset_ids[
+            position + 1 : position + 1 + self.depth
+        ]:
+            if local_dataset_id not in self._submitted:
+                self._submitted.add(local_dataset_id)
+                self._executor.submit(self._read, local_dataset_id)
+
+    def close(self):
+        """Cancels the reads that haven't started."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _read(self, local_dataset_id):
+        """Reads a metadata document into the cache. Failures are left to be
+        reported when the upload reads it."""
+        try:
+            _read_local_dataset_metadata(local_dataset_id, self.config)
+        except Exception:  # pylint: disable=broad-exception-caught
+            pass
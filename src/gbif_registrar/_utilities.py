@@ -1,16 +1,75 @@
 """Utility functions for internal use only."""
 
-from os import environ
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+import hashlib
+import os
 import json
-from json import loads
+import re
+import shutil
+import tempfile
 import warnings
 import pandas as pd
 from lxml import etree
 import requests
-from requests import post, get, delete
+from gbif_registrar._cache import _MetadataCache, _TTLCache
+from gbif_registrar._http import _json, _request
+from gbif_registrar._locking import _file_lock, _lock_path
+from gbif_registrar.configure import _resolve_config
+from gbif_registrar.profiling import _profiled
 
+# Metadata documents read by _read_local_dataset_metadata, while caching is
+# enabled by _cache_local_dataset_metadata.
+_local_metadata_cache = None
 
-def _check_completeness(registrations):
+# The data package ID format of the Environmental Data Initiative (EDI), i.e.
+# `scope.identifier.revision`.
+_LOCAL_DATASET_ID_PATTERN = r"^(?P<scope>.+)\.(?P<identifier>\d+)\.(?P<revision>\d+)$"
+_local_dataset_id_regex = re.compile(_LOCAL_DATASET_ID_PATTERN)
+
+# The manifest of a partitioned registrations directory.
+_MANIFEST = "manifest.json"
+
+# Seconds for which the reachability of a URL, checked by
+# _check_remote_urls, is reused.
+_REACHABILITY_TTL = 600.0
+_reachability_cache = _TTLCache(_REACHABILITY_TTL)
+
+
+@contextmanager
+def _cache_local_dataset_metadata(max_bytes=None):
+    """Caches the metadata documents of local datasets within a block.
+
+    A revision of a dataset in the EDI repository never changes, so its
+    metadata document can be read once and reused, e.g. by both the metadata
+    post and each synchronization check of an upload.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Maximum total size of the documents cached. The least recently used
+        documents are evicted past it. If not provided, the cache is
+        unbounded. Ignored within the block of another cache.
+
+    Yields
+    ------
+    _MetadataCache
+        The cache.
+    """
+    global _local_metadata_cache  # pylint: disable=global-statement
+    outermost = _local_metadata_cache is None
+    if outermost:
+        _local_metadata_cache = _MetadataCache(max_bytes)
+    try:
+        yield _local_metadata_cache
+    finally:
+        if outermost:
+            _local_metadata_cache = None
+
+
+@_profiled
+def _check_completeness(registrations, sink=None):
     """Checks registrations for completeness.
 
     A complete registration has values for all fields except (perhaps)
@@ -19,8 +78,10 @@ def _check_completeness(registrations):
     Parameters
     ----------
     registrations : pandas.DataFrame
-        A dataframe of the registrations file. Use`_read_registrations_file` to
+        A dataframe of the registrations file. Use `_read_registrations_file` to
         create this.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -35,11 +96,11 @@ def _check_completeness(registrations):
     registrations = registrations[registrations.isna().any(axis=1)]
     if len(registrations) > 0:
         rows = registrations.index.to_series() + 1
-        rows = rows.astype("string")
-        warnings.warn("Incomplete registrations in rows: " + ", ".join(rows))
+        _report("completeness", "Incomplete registrations in rows", rows, sink)
 
 
-def _check_group_registrations(registrations):
+@_profiled
+def _check_group_registrations(registrations, sink=None):
     """Checks uniqueness of dataset group registrations.
 
     Registrations can be part of a group, the most recent of which is
@@ -48,8 +109,10 @@ def _check_group_registrations(registrations):
     Parameters
     ----------
     registrations : pandas.DataFrame
-        A dataframe of the registrations file. Use`_read_registrations_file` to
+        A dataframe of the registrations file. Use `_read_registrations_file` to
         create this.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -61,11 +124,84 @@ def _check_group_registrations(registrations):
         cardinality.
     """
     _check_one_to_one_cardinality(
-        data=registrations, col1="local_dataset_group_id", col2="gbif_dataset_uuid"
+        data=registrations,
+        col1="local_dataset_group_id",
+        col2="gbif_dataset_uuid",
+        rule="group_registrations",
+        sink=sink,
     )
 
 
-def _check_synchronized(registrations):
+@_profiled
+def _check_remote_urls(
+    registrations, config=None, max_workers=8, sink=None, parsed_ids=None
+):
+    """Checks that the endpoints and metadata documents of registrations can
+    be reached.
+
+    Each distinct URL is requested once, with a HEAD request (or a GET of its
+    first byte, if the server doesn't support HEAD), by a pool of threads
+    within the rate limits of each host. Results are reused for
+    `_REACHABILITY_TTL` seconds.
+
+    Parameters
+    ----------
+    registrations : pandas.DataFrame
+        A dataframe of the registrations file. Only the `local_dataset_id`
+        and `local_dataset_endpoint` columns are used.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+    max_workers : int, optional
+        The number of requests sent at a time.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
+    parsed_ids : pandas.DataFrame, optional
+        The `local_dataset_id` column parsed by `_parse_local_dataset_ids`,
+        e.g. `Registry.parsed_ids`. Parsed here if not provided.
+
+    Returns
+    -------
+    None
+
+    Warns
+    -----
+    UserWarning
+        If `local_dataset_endpoint` URLs, or the metadata documents of
+        `local_dataset_id` values, can't be reached.
+    """
+    config = _resolve_config(config)
+    endpoints = registrations["local_dataset_endpoint"]
+    if parsed_ids is None:
+        parsed_ids = _parse_local_dataset_ids(registrations["local_dataset_id"])
+    # Built as _get_local_dataset_metadata_url does, and missing for invalid
+    # local_dataset_id values.
+    metadata_urls = (
+        config.pasta_environment
+        + "/package/metadata/eml/"
+        + parsed_ids["scope"]
+        + "/"
+        + parsed_ids["identifier"]
+        + "/"
+        + parsed_ids["revision"]
+    )
+    urls = pd.concat([endpoints, metadata_urls]).dropna().unique().tolist()
+    with ThreadPoolExecutor(max_workers) as executor:
+        reachable = dict(
+            zip(urls, executor.map(_is_reachable, urls, repeat(config, len(urls))))
+        )
+    for rule, message, column in (
+        ("endpoint_reachable", "Unreachable local_dataset_endpoint in rows", endpoints),
+        ("metadata_reachable", "Unreachable metadata documents in rows", metadata_urls),
+    ):
+        failed = column.map(lambda url: not pd.isna(url) and not reachable[url])
+        if failed.any():
+            rows = failed.index.to_series()[failed.astype(bool)] + 1
+            _report(rule, message, rows, sink)
+
+
+@_profiled
+def _check_synchronized(registrations, sink=None):
     """Checks if registrations have been synchronized.
 
     Registrations contain all the information needed for GBIF to successfully
@@ -76,8 +212,10 @@ def _check_synchronized(registrations):
     Parameters
     ----------
     registrations : pandas.DataFrame
-        A dataframe of the registrations file. Use`_read_registrations_file` to
+        A dataframe of the registrations file. Use `_read_registrations_file` to
         create this.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -87,18 +225,25 @@ def _check_synchronized(registrations):
     -----
     If a registration has not yet been crawled.
     """
-    if not registrations["synchronized"].all():
-        rows = registrations["synchronized"].index.to_series() + 1
-        rows = rows[~registrations["synchronized"]].astype("string")
-        warnings.warn("Unsynchronized registrations in rows: " + ", ".join(rows))
+    synchronized = registrations["synchronized"].fillna(False).astype(bool)
+    if not synchronized.all():
+        rows = synchronized.index.to_series() + 1
+        rows = rows[~synchronized]
+        _report("synchronized", "Unsynchronized registrations in rows", rows, sink)
 
 
-def _check_local_dataset_group_id_format(registrations):
+@_profiled
+def _check_local_dataset_group_id_format(registrations, parsed_ids=None, sink=None):
     """Checks the format of the local_dataset_group_id.
 
     registrations : pandas.DataFrame
-        A dataframe of the registrations file. Use`_read_registrations_file` to
+        A dataframe of the registrations file. Use `_read_registrations_file` to
         create this.
+    parsed_ids : pandas.DataFrame, optional
+        The `local_dataset_id` column parsed by `_parse_local_dataset_ids`,
+        e.g. `Registry.parsed_ids`. Parsed here if not provided.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -110,19 +255,23 @@ def _check_local_dataset_group_id_format(registrations):
     format used by the Environmental Data Initiative (EDI), i.e.
     `scope.identifier`.
     """
-    ids = registrations["local_dataset_id"]
-    expected_groups = ids.str.extract(r"(\D+\d+)")[0]
-    actual_groups = registrations["local_dataset_group_id"]
+    if parsed_ids is None:
+        parsed_ids = _parse_local_dataset_ids(registrations["local_dataset_id"])
+    expected_groups = parsed_ids["group"]
+    actual_groups = registrations["local_dataset_group_id"].astype("string")
     res = expected_groups.compare(actual_groups)
     if len(res) > 0:
         rows = res.index.to_series() + 1
-        warnings.warn(
-            "Invalid local_dataset_group_id values in rows: "
-            + ", ".join(rows.astype("string"))
+        _report(
+            "local_dataset_group_id_format",
+            "Invalid local_dataset_group_id values in rows",
+            rows,
+            sink,
         )
 
 
-def _check_local_dataset_id(registrations):
+@_profiled
+def _check_local_dataset_id(registrations, sink=None):
     """Checks registrations for unique local_dataset_id.
 
     Each registration is represented by a unique primary key, i.e. the
@@ -131,8 +280,10 @@ def _check_local_dataset_id(registrations):
     Parameters
     ----------
     registrations : pandas.DataFrame
-        A dataframe of the registrations file. Use`_read_registrations_file` to
+        A dataframe of the registrations file. Use `_read_registrations_file` to
         create this.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -146,11 +297,13 @@ def _check_local_dataset_id(registrations):
     dupes = registrations["local_dataset_id"].duplicated()
     if any(dupes):
         dupes = dupes.index.to_series() + 1
-        dupes = dupes.astype("string")
-        warnings.warn("Duplicate local_dataset_id values in rows: " + ", ".join(dupes))
+        _report(
+            "local_dataset_id", "Duplicate local_dataset_id values in rows", dupes, sink
+        )
 
 
-def _check_local_dataset_id_format(registrations):
+@_profiled
+def _check_local_dataset_id_format(registrations, parsed_ids=None, sink=None):
     """Checks the format of the local_dataset_id.
 
     Parameters
@@ -158,6 +311,11 @@ def _check_local_dataset_id_format(registrations):
     registrations : pandas.DataFrame
         A dataframe of the registrations file. Use`read_registrations_file` to
         create this.
+    parsed_ids : pandas.DataFrame, optional
+        The `local_dataset_id` column parsed by `_parse_local_dataset_ids`,
+        e.g. `Registry.parsed_ids`. Parsed here if not provided.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -173,17 +331,21 @@ def _check_local_dataset_id_format(registrations):
     >>> registrations = _read_registrations_file('tests/registrations.csv')
     >>> _check_local_dataset_id_format(registrations)
     """
-    ids = registrations["local_dataset_id"]
-    bad_ids = ~ids.str.contains(r"^.+\.\d+\.\d+$")
+    if parsed_ids is None:
+        parsed_ids = _parse_local_dataset_ids(registrations["local_dataset_id"])
+    bad_ids = ~parsed_ids["valid"]
     if any(bad_ids):
-        rows = ids[bad_ids].index.to_series() + 1
-        warnings.warn(
-            "Invalid local_dataset_id values in rows: "
-            + ", ".join(rows.astype("string"))
+        rows = parsed_ids[bad_ids].index.to_series() + 1
+        _report(
+            "local_dataset_id_format",
+            "Invalid local_dataset_id values in rows",
+            rows,
+            sink,
         )
 
 
-def _check_local_endpoints(registrations):
+@_profiled
+def _check_local_endpoints(registrations, sink=None):
     """Checks uniqueness of local dataset endpoints.
 
     Registrations each have a unique endpoint, which is crawled by GBIF and
@@ -192,8 +354,10 @@ def _check_local_endpoints(registrations):
     Parameters
     ----------
     registrations : pandas.DataFrame
-        A dataframe of the registrations file. Use`_read_registrations_file` to
+        A dataframe of the registrations file. Use `_read_registrations_file` to
         create this.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -205,11 +369,18 @@ def _check_local_endpoints(registrations):
         cardinality.
     """
     _check_one_to_one_cardinality(
-        data=registrations, col1="local_dataset_id", col2="local_dataset_endpoint"
+        data=registrations,
+        col1="local_dataset_id",
+        col2="local_dataset_endpoint",
+        rule="local_endpoints",
+        sink=sink,
     )
 
 
-def _check_one_to_one_cardinality(data, col1, col2):
+@_profiled
+def _check_one_to_one_cardinality(
+    data, col1, col2, rule="one_to_one_cardinality", sink=None
+):
     """Checks for one-to-one cardinality between two columns of a dataframe.
 
     This is a helper function used in a couple registration checks.
@@ -221,6 +392,10 @@ def _check_one_to_one_cardinality(data, col1, col2):
         Column name
     col2 : str
         Column name
+    rule : str, optional
+        Name of the check, reported to `sink`.
+    sink : callable, optional
+        Receives the failures instead of a warning. See `_report`.
 
     Returns
     -------
@@ -239,19 +414,55 @@ def _check_one_to_one_cardinality(data, col1, col2):
             + " and "
             + col2
             + " should have 1-to-1 cardinality. "
-            + "However, > 1 corresponding element was found for: "
-            + ", ".join(group_counts[replicates].index.to_list())
+            + "However, > 1 corresponding element was found for"
         )
-        warnings.warn(msg)
+        values = group_counts[replicates].index.to_series()
+        _report(rule, msg, values, sink, key="value")
+
 
+def _delete_gbif_dataset(gbif_dataset_uuid, config=None):
+    """Deletes a dataset from GBIF.
+
+    Parameters
+    ----------
+    gbif_dataset_uuid : str
+        The registration identifier assigned by GBIF to the dataset.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+
+    Returns
+    -------
+    None
+        Will raise an exception if the DELETE fails.
 
-def _delete_local_dataset_endpoints(gbif_dataset_uuid):
+    Notes
+    -----
+    This function requires authentication with GBIF. Use the load_configuration
+    function from the authenticate module to do this.
+    """
+    config = _resolve_config(config)
+    resp = _request(
+        "DELETE",
+        config.gbif_api + "/" + gbif_dataset_uuid,
+        auth=(config.user_name, config.password),
+        headers={"Content-Type": "application/json"},
+        timeout=60,
+        config=config,
+    )
+    resp.raise_for_status()
+
+
+def _delete_local_dataset_endpoints(gbif_dataset_uuid, config=None):
     """Deletes all local dataset endpoints from a GBIF dataset.
 
     Parameters
     ----------
     gbif_dataset_uuid : str
         The registration identifier assigned by GBIF to the local dataset.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
 
     Returns
     -------
@@ -263,24 +474,29 @@ def _delete_local_dataset_endpoints(gbif_dataset_uuid):
     This function requires authentication with GBIF. Use the load_configuration
     function from the authenticate module to do this.
     """
+    config = _resolve_config(config)
     # Get the list of existing endpoints to delete
-    endpoints = get(
-        environ["GBIF_API"] + "/" + gbif_dataset_uuid + "/endpoint",
-        auth=(environ["USER_NAME"], environ["PASSWORD"]),
+    endpoints = _request(
+        "GET",
+        config.gbif_api + "/" + gbif_dataset_uuid + "/endpoint",
+        auth=(config.user_name, config.password),
         headers={"Content-Type": "application/json"},
         timeout=60,
+        config=config,
     )
     endpoints.raise_for_status()
 
     # Delete each endpoint
-    if len(endpoints.json()) != 0:
-        for item in endpoints.json():
+    if len(_json(endpoints)) != 0:
+        for item in _json(endpoints):
             key = item.get("key")
-            resp = delete(
-                environ["GBIF_API"] + "/" + gbif_dataset_uuid + "/endpoint/" + str(key),
-                auth=(environ["USER_NAME"], environ["PASSWORD"]),
+            resp = _request(
+                "DELETE",
+                config.gbif_api + "/" + gbif_dataset_uuid + "/endpoint/" + str(key),
+                auth=(config.user_name, config.password),
                 headers={"Content-Type": "application/json"},
                 timeout=60,
+                config=config,
             )
             resp.raise_for_status()
 
@@ -303,17 +519,71 @@ def _expected_cols():
     return cols
 
 
-def _get_gbif_dataset_uuid(local_dataset_group_id, registrations):
+def _get_changed_local_datasets(scope, from_date, config=None):
+    """Returns the datasets created or revised in the EDI repository since a
+    date.
+
+    Parameters
+    ----------
+    scope : str
+        The scope of the datasets, e.g. "edi".
+    from_date : str
+        The date and time, in ISO 8601 format and the time zone of PASTA
+        (e.g. "2023-06-01T00:00:00"), from which changes are listed.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+
+    Returns
+    -------
+    list of tuple
+        The `local_dataset_id` and date of change of each created or revised
+        dataset, in order of change. Deleted datasets are not listed.
+
+    Raises
+    ------
+    requests.HTTPError
+        If the changes can't be listed, once retries are exhausted.
+    """
+    config = _resolve_config(config)
+    resp = _request(
+        "GET",
+        config.pasta_environment + "/package/changes/eml",
+        params={"fromDate": from_date, "scope": scope},
+        timeout=60,
+        config=config,
+    )
+    resp.raise_for_status()
+    changes = []
+    for data_package in etree.fromstring(resp.content).iterfind("dataPackage"):
+        if data_package.findtext("action") == "deleteDataPackage":
+            continue
+        changes.append(
+            (data_package.findtext("packageId"), data_package.findtext("date"))
+        )
+    changes.sort(key=lambda change: change[1])
+    return changes
+
+
+def _get_gbif_dataset_uuid(
+    local_dataset_group_id, registrations, config=None, uuid_pool=None
+):
     """Returns the gbif_dataset_uuid value.
 
     Parameters
     ----------
     local_dataset_group_id : str
         The dataset group identifier in the EDI repository.
-    registrations : pandas dataframe
+    registrations : pandas dataframe or Registry
         The registrations file as a dataframe. Use the _read_registrations_file
-        function to create this.
-
+        function to create this. A Registry of the registrations file may be
+        used instead, which looks up the group in constant time.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+    uuid_pool : UuidPool, optional
+        A pool of GBIF dataset UUIDs reserved in advance. A new value is taken
+        from the pool if it has one, rather than requested from GBIF.
 
     Returns
     -------
@@ -323,6 +593,11 @@ def _get_gbif_dataset_uuid(local_dataset_group_id, registrations):
         gbif_dataset_uuid value doesn't already exist for a
         local_dataset_group_id in the registrations file.
     """
+    if not isinstance(registrations, pd.DataFrame):
+        gbif_dataset_uuid = registrations.gbif_dataset_uuid_of(local_dataset_group_id)
+        if gbif_dataset_uuid is None:
+            gbif_dataset_uuid = _new_gbif_dataset_uuid(config, uuid_pool)
+        return gbif_dataset_uuid
     # Look in the registrations dataframe to see if there is a matching
     # local_data_set_group_id value, and if it has a non-empty
     # gbif_dataset_uuid value. If so, get the gbif_dataset_uuid value.
@@ -347,17 +622,20 @@ def _get_gbif_dataset_uuid(local_dataset_group_id, registrations):
     # gbif_dataset_uuid value, then call the register_dataset function to
     # register the dataset with GBIF and get the gbif_dataset_uuid value.
     else:
-        gbif_dataset_uuid = _request_gbif_dataset_uuid()
+        gbif_dataset_uuid = _new_gbif_dataset_uuid(config, uuid_pool)
     return gbif_dataset_uuid
 
 
-def _get_local_dataset_endpoint(local_dataset_id):
+def _get_local_dataset_endpoint(local_dataset_id, config=None):
     """Returns the local_dataset_endpoint value.
 
     Parameters
     ----------
     local_dataset_id : str
         The dataset identifier in the EDI repository.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
 
     Returns
     -------
@@ -370,11 +648,10 @@ def _get_local_dataset_endpoint(local_dataset_id):
     This function requires authentication with GBIF. Use the load_configuration
     function from the authenticate module to do this.
     """
-    scope = local_dataset_id.split(".")[0]
-    identifier = local_dataset_id.split(".")[1]
-    revision = local_dataset_id.split(".")[2]
+    config = _resolve_config(config)
+    scope, identifier, revision = _parse_local_dataset_id(local_dataset_id)
     local_dataset_id = (
-        environ["PASTA_ENVIRONMENT"]
+        config.pasta_environment
         + "/package/download/eml/"
         + scope
         + "/"
@@ -385,6 +662,35 @@ def _get_local_dataset_endpoint(local_dataset_id):
     return local_dataset_id
 
 
+def _get_local_dataset_metadata_url(local_dataset_id, config=None):
+    """Returns the URL of the metadata document of a local dataset.
+
+    Parameters
+    ----------
+    local_dataset_id : str
+        The dataset identifier in the EDI repository.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+
+    Returns
+    -------
+    str
+        The URL of the metadata document in the PASTA environment.
+    """
+    config = _resolve_config(config)
+    scope, identifier, revision = _parse_local_dataset_id(local_dataset_id)
+    return (
+        config.pasta_environment
+        + "/package/metadata/eml/"
+        + scope
+        + "/"
+        + identifier
+        + "/"
+        + revision
+    )
+
+
 def _get_local_dataset_group_id(local_dataset_id):
     """Returns the local_dataset_group_id value.
 
@@ -400,19 +706,45 @@ def _get_local_dataset_group_id(local_dataset_id):
     """
     # The local_dataset_group_id value is derived by dropping the last period
     # and everything after it from the local_dataset_id value.
-    local_dataset_group_id = local_dataset_id.rsplit(".", 1)[0]
-    return local_dataset_group_id
+    match = _local_dataset_id_regex.match(local_dataset_id)
+    if match is None:
+        return local_dataset_id.rsplit(".", 1)[0]
+    return match["scope"] + "." + match["identifier"]
+
+
+def _group_bucket(local_dataset_group_id, num_buckets):
+    """Returns the bucket of a dataset group.
+
+    Parameters
+    ----------
+    local_dataset_group_id : str
+        The dataset group identifier in the EDI repository.
+    num_buckets : int
+        The number of buckets.
+
+    Returns
+    -------
+    int
+        A stable hash of the group identifier, modulo `num_buckets`. It is
+        the same on every host.
+    """
+    digest = hashlib.sha1(local_dataset_group_id.encode("utf-8")).hexdigest()
+    return int(digest, 16) % num_buckets
 
 
-def _is_synchronized(local_dataset_id, registrations_file):
+def _is_synchronized(local_dataset_id, registrations_file, config=None):
     """Checks if a local dataset is synchronized with the GBIF registry.
 
     Parameters
     ----------
     local_dataset_id : str
         The identifier of the dataset in the EDI repository.
-    registrations_file : str
-        Path of the registrations file.
+    registrations_file : str, pathlike object, or Registry
+        Path of the registrations file, or a Registry of it. Pass a Registry
+        when checking repeatedly, to avoid reading the file for each check.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
 
     Returns
     -------
@@ -425,22 +757,30 @@ def _is_synchronized(local_dataset_id, registrations_file):
     (listed in the EML) and the local dataset endpoint match those of the
     GBIF instance.
     """
+    config = _resolve_config(config)
     # Get the gbif_dataset_uuid to use in the GBIF API call.
-    registrations = _read_registrations_file(registrations_file)
-    gbif_dataset_uuid = registrations.loc[
-        registrations["local_dataset_id"] == local_dataset_id, "gbif_dataset_uuid"
-    ].values[0]
+    if isinstance(registrations_file, (str, os.PathLike)):
+        registrations = _read_registrations_file(
+            registrations_file, usecols=["local_dataset_id", "gbif_dataset_uuid"]
+        )
+        gbif_dataset_uuid = registrations.loc[
+            registrations["local_dataset_id"] == local_dataset_id, "gbif_dataset_uuid"
+        ].values[0]
+    else:
+        gbif_dataset_uuid = registrations_file.get(local_dataset_id)[
+            "gbif_dataset_uuid"
+        ]
 
     # Read the local dataset metadata to get the dataset publication date and
     # endpoint for comparison with the GBIF instance.
-    local_metadata = _read_local_dataset_metadata(local_dataset_id)
+    local_metadata = _read_local_dataset_metadata(local_dataset_id, config)
     local_metadata = etree.fromstring(local_metadata.encode("utf-8"))
     local_pubdate = local_metadata.find("dataset/pubDate").text
-    local_endpoint = _get_local_dataset_endpoint(local_dataset_id)
+    local_endpoint = _get_local_dataset_endpoint(local_dataset_id, config)
 
     # Read the GBIF dataset metadata to get the dataset publication date and
     # endpoint for comparison with the local instance.
-    gbif_metadata = _read_gbif_dataset_metadata(gbif_dataset_uuid)
+    gbif_metadata = _read_gbif_dataset_metadata(gbif_dataset_uuid, config)
     gbif_pubdate = gbif_metadata.get("pubDate")
     gbif_pubdate = gbif_pubdate.split("T")[0]  # PASTA only uses date
     gbif_endpoint = gbif_metadata.get("endpoints")[0].get("url")
@@ -452,7 +792,278 @@ def _is_synchronized(local_dataset_id, registrations_file):
     return pubdate_matches and endpoint_matches
 
 
-def _post_local_dataset_endpoint(local_dataset_endpoint, gbif_dataset_uuid):
+def _is_reachable(url, config=None):
+    """Returns whether a URL responds successfully, reusing the result of a
+    recent check.
+
+    Parameters
+    ----------
+    url : str
+        The URL.
+    config : Config, optional
+        The configuration whose request settings apply. Defaults to the
+        environment variables set by the load_configuration function.
+
+    Returns
+    -------
+    bool
+        True if the URL responds with a status below 400, False if it fails
+        or can't be connected to.
+    """
+    reachable = _reachability_cache.get(url)
+    if reachable is not None:
+        return reachable
+    try:
+        resp = _request("HEAD", url, allow_redirects=True, timeout=30, config=config)
+        if resp.status_code in (405, 501):
+            # The server doesn't support HEAD, so only the first byte is read.
+            resp = _request(
+                "GET",
+                url,
+                headers={"Range": "bytes=0-0"},
+                stream=True,
+                timeout=30,
+                config=config,
+            )
+            resp.close()
+        reachable = resp.status_code < 400
+    except requests.exceptions.RequestException:
+        reachable = False
+    _reachability_cache.put(url, reachable)
+    return reachable
+
+
+def _latest_revisions(registrations, parsed_ids=None):
+    """Identifies the most recent revision of each dataset group.
+
+    The most recent revision in a group is the authoritative version of the
+    series, and the only one that needs to be hosted on GBIF.
+
+    Parameters
+    ----------
+    registrations : pandas.DataFrame
+        A dataframe of the registrations file. Use `_read_registrations_file` to
+        create this.
+    parsed_ids : pandas.DataFrame, optional
+        The `local_dataset_id` column parsed by `_parse_local_dataset_ids`,
+        e.g. `Registry.parsed_ids`. Parsed here if not provided.
+
+    Returns
+    -------
+    pandas.Series
+        Boolean values, aligned with `registrations`, that are True for the
+        registration with the highest revision number in its group. Revisions
+        are compared as numbers (e.g. revision 10 is newer than revision 9).
+        Registrations with an invalid `local_dataset_id` are False.
+    """
+    if parsed_ids is None:
+        parsed_ids = _parse_local_dataset_ids(registrations["local_dataset_id"])
+    revision = pd.to_numeric(parsed_ids["revision"], errors="coerce")
+    group = _local_dataset_group_ids(registrations, parsed_ids)
+    latest_revision = revision.groupby(group).transform("max")
+    return (revision == latest_revision).fillna(False).astype(bool)
+
+
+def _local_dataset_group_ids(registrations, parsed_ids=None):
+    """Returns the local_dataset_group_id of each registration.
+
+    Parameters
+    ----------
+    registrations : pandas.DataFrame
+        A dataframe of the registrations file.
+    parsed_ids : pandas.DataFrame, optional
+        The `local_dataset_id` column parsed by `_parse_local_dataset_ids`,
+        e.g. `Registry.parsed_ids`. Parsed here if not provided.
+
+    Returns
+    -------
+    pandas.Series
+        The `local_dataset_group_id` of each registration, derived from the
+        `local_dataset_id` of registrations that don't have one, as
+        `_get_local_dataset_group_id` does.
+    """
+    if parsed_ids is None:
+        parsed_ids = _parse_local_dataset_ids(registrations["local_dataset_id"])
+    ids = registrations["local_dataset_id"].astype("string")
+    return (
+        registrations["local_dataset_group_id"]
+        .astype("string")
+        .fillna(parsed_ids["group"])
+        .fillna(ids.str.rsplit(".", n=1).str[0])
+    )
+
+
+def _merge_registration_records(registrations, records):
+    """Merges registration records into a dataframe of registrations.
+
+    Parameters
+    ----------
+    registrations : pandas.DataFrame
+        A dataframe of the registrations file.
+    records : pandas.DataFrame
+        The registration records to merge. See `_update_registrations_file`.
+
+    Returns
+    -------
+    tuple
+        The merged registrations, and the number of records appended to them.
+    """
+    cols = [col for col in records.columns if col != "local_dataset_id"]
+    record_ids = records["local_dataset_id"]
+    # The position of the last record of each dataset, looked up once for all
+    # registrations, rather than comparing each record with every row.
+    positions = pd.Series(range(len(records)), index=record_ids.to_numpy())
+    positions = positions[positions.index.notna()]
+    positions = positions[~positions.index.duplicated(keep="last")]
+    rows = registrations["local_dataset_id"].map(positions)
+    matched = rows.notna().to_numpy()
+    if matched.any():
+        rows = rows[matched].astype(int).to_numpy()
+        for col in cols:
+            registrations.loc[matched, col] = records[col].to_numpy()[rows]
+    new_records = records[
+        record_ids.isna() | ~record_ids.isin(registrations["local_dataset_id"])
+    ]
+    if len(new_records):
+        registrations = pd.concat([registrations, new_records], ignore_index=True)
+    return registrations, len(new_records)
+
+
+def _new_gbif_dataset_uuid(config=None, uuid_pool=None):
+    """Returns a GBIF dataset UUID for a new dataset group.
+
+    Parameters
+    ----------
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+    uuid_pool : UuidPool, optional
+        A pool of reserved GBIF dataset UUIDs to take the value from. If the
+        pool is empty, or not provided, the value is requested from GBIF.
+
+    Returns
+    -------
+    str
+        The GBIF dataset UUID value.
+    """
+    if uuid_pool is not None:
+        gbif_dataset_uuid = uuid_pool.take()
+        if gbif_dataset_uuid is not None:
+            return gbif_dataset_uuid
+    return _request_gbif_dataset_uuid(config)
+
+
+def _parse_local_dataset_id(local_dataset_id):
+    """Splits a local_dataset_id into its parts.
+
+    Parameters
+    ----------
+    local_dataset_id : str
+        The dataset identifier in the EDI repository.
+
+    Returns
+    -------
+    tuple of str
+        The scope, identifier, and revision of the dataset.
+
+    Raises
+    ------
+    ValueError
+        If `local_dataset_id` doesn't have the `scope.identifier.revision`
+        format.
+    """
+    match = _local_dataset_id_regex.match(local_dataset_id)
+    if match is None:
+        raise ValueError(f"Invalid local_dataset_id: {local_dataset_id}")
+    return match["scope"], match["identifier"], match["revision"]
+
+
+def _parse_local_dataset_ids(local_dataset_ids):
+    """Splits a column of local_dataset_id values into their parts.
+
+    The column is parsed by a single vectorized regex, so parse it once and
+    pass the result to the functions that need it (see
+    `Registry.parsed_ids`), rather than parsing each value as needed.
+
+    Parameters
+    ----------
+    local_dataset_ids : pandas.Series
+        The `local_dataset_id` column of the registrations.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A dataframe aligned with `local_dataset_ids`, of the string columns
+        "scope", "identifier", "revision", and "group" (i.e.
+        `scope.identifier`), which are missing for invalid values, and the
+        boolean column "valid", which is False for values that don't have the
+        `scope.identifier.revision` format.
+    """
+    parsed_ids = (
+        local_dataset_ids.astype("string")
+        .str.extract(_LOCAL_DATASET_ID_PATTERN)
+        .astype("string")
+    )
+    parsed_ids["group"] = parsed_ids["scope"] + "." + parsed_ids["identifier"]
+    parsed_ids["valid"] = parsed_ids["revision"].notna().astype(bool)
+    return parsed_ids
+
+
+def _partition_key(local_dataset_id, manifest):
+    """Returns the partition of a registration in a partitioned registrations
+    directory.
+
+    Parameters
+    ----------
+    local_dataset_id : str
+        The dataset identifier in the EDI repository.
+    manifest : dict
+        The manifest of the directory. See `_read_manifest`.
+
+    Returns
+    -------
+    str
+        The scope of the dataset (with characters that aren't safe in file
+        names replaced by "_"), or its group's bucket, zero-padded, depending
+        on how the directory is partitioned.
+    """
+    if pd.isna(local_dataset_id):
+        return "_"
+    if manifest["partition_by"] == "bucket":
+        group_id = _get_local_dataset_group_id(local_dataset_id)
+        width = len(str(manifest["buckets"] - 1))
+        return str(_group_bucket(group_id, manifest["buckets"])).zfill(width)
+    match = _local_dataset_id_regex.match(local_dataset_id)
+    scope = match["scope"] if match else local_dataset_id.split(".", 1)[0]
+    return re.sub(r"[^\w.-]", "_", scope).lstrip(".") or "_"
+
+
+def _partition_positions(manifest):
+    """Returns the row of each registration of each partition in the
+    registrations file the directory represents.
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest of a partitioned registrations directory.
+
+    Returns
+    -------
+    dict
+        The row numbers (starting at 0), in order, of the registrations of
+        each partition, by partition.
+    """
+    positions = {}
+    position = 0
+    for key, count in manifest["order"]:
+        positions.setdefault(key, []).extend(range(position, position + count))
+        position += count
+    return positions
+
+
+def _post_local_dataset_endpoint(
+    local_dataset_endpoint, gbif_dataset_uuid, config=None
+):
     """Posts a local dataset endpoint to GBIF.
 
     Parameters
@@ -464,6 +1075,9 @@ def _post_local_dataset_endpoint(local_dataset_endpoint, gbif_dataset_uuid):
     gbif_dataset_uuid : str
         The registration identifier assigned by GBIF to the local dataset
         group.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
 
     Returns
     -------
@@ -475,18 +1089,21 @@ def _post_local_dataset_endpoint(local_dataset_endpoint, gbif_dataset_uuid):
     This function requires authentication with GBIF. Use the load_configuration
     function from the authenticate module to do this.
     """
+    config = _resolve_config(config)
     my_endpoint = {"url": local_dataset_endpoint, "type": "DWC_ARCHIVE"}
-    resp = post(
-        environ["GBIF_API"] + "/" + gbif_dataset_uuid + "/endpoint",
+    resp = _request(
+        "POST",
+        config.gbif_api + "/" + gbif_dataset_uuid + "/endpoint",
         data=json.dumps(my_endpoint),
-        auth=(environ["USER_NAME"], environ["PASSWORD"]),
+        auth=(config.user_name, config.password),
         headers={"Content-Type": "application/json"},
         timeout=60,
+        config=config,
     )
     resp.raise_for_status()
 
 
-def _post_new_metadata_document(local_dataset_id, gbif_dataset_uuid):
+def _post_new_metadata_document(local_dataset_id, gbif_dataset_uuid, config=None):
     """Posts a new metadata document to GBIF.
 
     Parameters
@@ -496,6 +1113,9 @@ def _post_new_metadata_document(local_dataset_id, gbif_dataset_uuid):
     gbif_dataset_uuid : str
         The registration identifier assigned by GBIF to the local dataset
         group.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
 
     Returns
     -------
@@ -507,30 +1127,44 @@ def _post_new_metadata_document(local_dataset_id, gbif_dataset_uuid):
     This function requires authentication with GBIF. Use the load_configuration
     function from the authenticate module to do this.
     """
-    metadata = _read_local_dataset_metadata(local_dataset_id)
-    resp = post(
-        environ["GBIF_API"] + "/" + gbif_dataset_uuid + "/document",
+    config = _resolve_config(config)
+    metadata = _read_local_dataset_metadata(local_dataset_id, config)
+    # Posting a metadata document replaces the current one, so it is safe to
+    # resend on failure.
+    resp = _request(
+        "POST",
+        config.gbif_api + "/" + gbif_dataset_uuid + "/document",
+        idempotent=True,
         data=metadata,
-        auth=(environ["USER_NAME"], environ["PASSWORD"]),
+        auth=(config.user_name, config.password),
         headers={"Content-Type": "application/xml"},
         timeout=60,
+        config=config,
     )
     resp.raise_for_status()
 
 
-def _read_gbif_dataset_metadata(gbif_dataset_uuid):
+def _read_gbif_dataset_metadata(gbif_dataset_uuid, config=None):
     """Reads the metadata of a GBIF dataset.
 
     Parameters
     ----------
     gbif_dataset_uuid : str
         The registration identifier assigned by GBIF to the local dataset.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
 
     Returns
     -------
     dict
         A dictionary containing the metadata of the GBIF dataset.
 
+    Raises
+    ------
+    requests.HTTPError
+        If GBIF doesn't return the metadata, once retries are exhausted.
+
     Notes
     -----
     This is high-level metadata, not the full EML document.
@@ -538,108 +1172,431 @@ def _read_gbif_dataset_metadata(gbif_dataset_uuid):
     This function requires authentication with GBIF. Use the load_configuration
     function from the authenticate module to do this.
     """
-    resp = requests.get(url=environ["GBIF_API"] + "/" + gbif_dataset_uuid, timeout=60)
+    config = _resolve_config(config)
+    resp = _request(
+        "GET", config.gbif_api + "/" + gbif_dataset_uuid, timeout=60, config=config
+    )
     if resp.status_code != 200:
-        print("HTTP request failed with status code: " + str(resp.status_code))
-        print(resp.reason)
-        return None
-    return loads(resp.text)
+        raise requests.HTTPError(
+            f"GBIF didn't return metadata for {gbif_dataset_uuid}: "
+            f"{resp.status_code} {resp.reason}",
+            response=resp,
+        )
+    return _json(resp)
 
 
-def _read_local_dataset_metadata(local_dataset_id):
+def _read_local_dataset_metadata(local_dataset_id, config=None):
     """Reads the metadata document for a local dataset.
 
     Parameters
     ----------
     local_dataset_id : str
         The identifier of the dataset in the EDI repository.
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
 
     Returns
     -------
     str
         The metadata document for the local dataset in XML format.
 
+    Raises
+    ------
+    requests.HTTPError
+        If the local repository doesn't return the metadata document, once
+        retries are exhausted.
+
     Notes
     -----
     This function requires authentication with GBIF. Use the load_configuration
     function from the authenticate module to do this.
     """
-    # Build URL for metadata document to be read
-    metadata_url = (
-        environ["PASTA_ENVIRONMENT"]
-        + "/package/metadata/eml/"
-        + local_dataset_id.split(".")[0]
-        + "/"
-        + local_dataset_id.split(".")[1]
-        + "/"
-        + local_dataset_id.split(".")[2]
-    )
-    resp = requests.get(metadata_url, timeout=60)
+    config = _resolve_config(config)
+    cache = _local_metadata_cache
+    cache_key = (config.pasta_environment, local_dataset_id)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    metadata_url = _get_local_dataset_metadata_url(local_dataset_id, config)
+    resp = _request("GET", metadata_url, timeout=60, config=config)
     if resp.status_code != 200:
-        print("HTTP request failed with status code: " + str(resp.status_code))
-        print(resp.reason)
-        return None
+        raise requests.HTTPError(
+            f"Couldn't read metadata for {local_dataset_id}: "
+            f"{resp.status_code} {resp.reason}",
+            response=resp,
+        )
+    if cache is not None:
+        cache.put(cache_key, resp.text)
     return resp.text
 
 
-def _read_registrations_file(registrations_file):
+def _read_manifest(directory):
+    """Returns the manifest of a partitioned registrations directory.
+
+    Parameters
+    ----------
+    directory : str or pathlike object
+        Path of the directory.
+
+    Returns
+    -------
+    dict
+        The manifest. It has the keys "partition_by" ("scope" or "bucket"),
+        "buckets" (the number of buckets, or None), "partitions" (the file
+        name of each partition, by partition), and "order" (a list of
+        [partition, count] runs giving the partition of each row of the
+        registrations file the directory represents, in order).
+
+    Raises
+    ------
+    ValueError
+        If the directory has no manifest.
+    """
+    manifest_file = os.path.join(directory, _MANIFEST)
+    if not os.path.exists(manifest_file):
+        raise ValueError(f"{directory} is not a partitioned registrations directory.")
+    with open(manifest_file, "r", encoding="utf-8") as manifest:
+        return json.load(manifest)
+
+
+def _read_partitions(
+    directory, usecols=None, engine=None, partitions=None, max_workers=None
+):
+    """Reads the partitions of a partitioned registrations directory.
+
+    Parameters
+    ----------
+    directory : str or pathlike object
+        Path of the directory.
+    usecols : list of str, optional
+        The columns to read. See `_read_registrations_file`.
+    engine : str, optional
+        The parser engine. See `_read_registrations_file`.
+    partitions : list of str, optional
+        The partitions to read. Defaults to all partitions.
+    max_workers : int, optional
+        If provided, partitions are read in parallel by this many threads.
+
+    Returns
+    -------
+    dict
+        A dataframe of each partition read, by partition, in the order of the
+        manifest. Each is indexed by the row numbers (starting at 0) of its
+        registrations in the registrations file the directory represents.
+    """
+    manifest = _read_manifest(directory)
+    positions = _partition_positions(manifest)
+    end = sum(count for _, count in manifest["order"])
+    keys = [
+        key for key in manifest["partitions"] if partitions is None or key in partitions
+    ]
+    files = [os.path.join(directory, manifest["partitions"][key]) for key in keys]
+
+    def read(file):
+        return _read_registrations_file(file, usecols, engine)
+
+    if max_workers is None:
+        read_frames = [read(file) for file in files]
+    else:
+        with ThreadPoolExecutor(max_workers) as executor:
+            read_frames = list(executor.map(read, files))
+    frames = {}
+    for key, frame in zip(keys, read_frames):
+        rows = positions.get(key, [])[: len(frame)]
+        # Rows written to the partition after the manifest was read follow
+        # all others.
+        extra = len(frame) - len(rows)
+        frame.index = pd.Index(rows + list(range(end, end + extra)))
+        end += extra
+        frames[key] = frame
+    return frames
+
+
+def _read_registrations_file(
+    registrations_file, usecols=None, engine=None, partitions=None
+):
     """Returns the registrations file as a Pandas dataframe.
 
     Parameters
     ----------
     registrations_file : str
-        Path of the registrations file.
+        Path of the registrations file, or of a partitioned registrations
+        directory.
+    usecols : list of str, optional
+        The columns to read. Operations that only need a few columns should
+        list them, to parse less and use less memory. Defaults to all columns.
+    engine : str, optional
+        The parser engine of `pandas.read_csv`. "pyarrow" parses large files
+        with several threads, if the optional pyarrow package is installed.
+        Defaults to the C engine of pandas.
+    partitions : list of str, optional
+        The partitions to read, if `registrations_file` is a partitioned
+        registrations directory. Defaults to all partitions.
 
     Returns
     -------
     DataFrame
-        The registrations file as a Pandas dataframe.
+        The registrations file as a Pandas dataframe. The registrations of a
+        partitioned directory are in the order of the registrations file it
+        was partitioned from, with later additions at the end.
     """
+    if os.path.isdir(registrations_file):
+        frames = _read_partitions(registrations_file, usecols, engine, partitions)
+        if frames:
+            return pd.concat(frames.values()).sort_index().reset_index(drop=True)
+        cols = _expected_cols() if usecols is None else usecols
+        return pd.DataFrame(columns=cols).astype(_registrations_dtype(cols))
     registrations = pd.read_csv(
         registrations_file,
         delimiter=",",
-        dtype={
-            "local_dataset_id": "string",
-            "local_dataset_group_id": "string",
-            "local_dataset_endpoint": "string",
-            "gbif_dataset_uuid": "string",
-            "is_synchronized": "boolean",
-        },
+        usecols=usecols,
+        dtype=_registrations_dtype(usecols),
+        engine=engine,
     )
     return registrations
 
 
-def _request_gbif_dataset_uuid():
+def _registrations_dtype(usecols=None):
+    """Returns the dtype of each column of the registrations file.
+
+    Parameters
+    ----------
+    usecols : list of str, optional
+        The columns to return. Defaults to all columns.
+
+    Returns
+    -------
+    dict
+        The dtype of each column, by column name.
+    """
+    dtype = {
+        "local_dataset_id": "string",
+        "local_dataset_group_id": "string",
+        "local_dataset_endpoint": "string",
+        "gbif_dataset_uuid": "string",
+        "synchronized": "boolean",
+    }
+    if usecols is not None:
+        dtype = {col: dtype[col] for col in usecols}
+    return dtype
+
+
+def _report(rule, message, items, sink=None, key="row"):
+    """Reports the rows or values that fail a registration check.
+
+    Parameters
+    ----------
+    rule : str
+        Name of the check, e.g. "local_dataset_id_format".
+    message : str
+        Description of the failure, e.g. "Invalid local_dataset_id values in
+        rows".
+    items : pandas.Series
+        The row numbers (starting at 1), or values, that fail the check.
+    sink : callable, optional
+        Called as `sink(rule, message, items, key)` to report the failures,
+        e.g. to stream them to a file. If not provided, a warning listing all
+        of them is issued.
+    key : str, optional
+        What the items are, "row" or "value".
+
+    Returns
+    -------
+    None
+
+    Warns
+    -----
+    UserWarning
+        If `sink` isn't provided.
+    """
+    if sink is None:
+        warnings.warn(message + ": " + ", ".join(items.astype("string")))
+    else:
+        sink(rule, message, items, key)
+
+
+def _request_gbif_dataset_uuid(config=None):
     """Requests a GBIF dataset UUID value from GBIF.
 
+    Parameters
+    ----------
+    config : Config, optional
+        The configuration to use. Defaults to the environment variables set by
+        the load_configuration function.
+
     Returns
     -------
     str
         The GBIF dataset UUID value. This is the UUID assigned by GBIF to the
         local dataset group.
 
+    Raises
+    ------
+    requests.HTTPError
+        If GBIF doesn't create the dataset, once retries are exhausted.
+
     Notes
     -----
     This function requires authentication with GBIF. Use the load_configuration
     function from the authenticate module to do this.
     """
+    config = _resolve_config(config)
     title = "Placeholder title, to be written over by EML metadata from EDI"
     data = {
-        "installationKey": environ["INSTALLATION"],
-        "publishingOrganizationKey": environ["ORGANIZATION"],
+        "installationKey": config.installation,
+        "publishingOrganizationKey": config.organization,
         "type": "SAMPLING_EVENT",
         "title": title,
     }
     headers = {"Content-Type": "application/json"}
-    resp = requests.post(
-        url=environ["GBIF_API"],
+    resp = _request(
+        "POST",
+        config.gbif_api,
         data=json.dumps(data),
-        auth=(environ["USER_NAME"], environ["PASSWORD"]),
+        auth=(config.user_name, config.password),
         headers=headers,
         timeout=60,
+        config=config,
     )
     if resp.status_code != 201:
-        print("HTTP request failed with status code: " + str(resp.status_code))
-        print(resp.reason)
-        return None
+        raise requests.HTTPError(
+            f"GBIF didn't create a dataset: {resp.status_code} {resp.reason}",
+            response=resp,
+        )
     return resp.json()
+
+
+def _update_registrations_file(registrations_file, records):
+    """Merges registration records into the registrations file.
+
+    The registrations file is locked, re-read, updated row by row, and then
+    atomically replaced, so concurrent updates of different rows by several
+    processes are all preserved.
+
+    Parameters
+    ----------
+    registrations_file : str or pathlike object
+        Path of the registrations file, or of a partitioned registrations
+        directory.
+    records : pandas.DataFrame
+        The registration records to merge. Must have a `local_dataset_id`
+        column, and may have any of the other registrations file columns.
+        Records matching an existing `local_dataset_id` replace the values of
+        the listed columns in that row. Other records are appended.
+
+    Returns
+    -------
+    None
+        The registrations file written back to itself as a .csv.
+    """
+    if os.path.isdir(registrations_file):
+        _update_partitions(registrations_file, records)
+        return None
+    with _file_lock(_lock_path(registrations_file)):
+        registrations = _read_registrations_file(registrations_file)
+        registrations, _ = _merge_registration_records(registrations, records)
+        _write_registrations_file(registrations, registrations_file)
+    return None
+
+
+def _update_partitions(directory, records):
+    """Merges registration records into a partitioned registrations
+    directory.
+
+    Only the partitions of the records are rewritten, each under its own
+    lock, so processes updating different partitions don't wait on each
+    other. The manifest is updated, under its lock, when records are
+    appended.
+
+    Parameters
+    ----------
+    directory : str or pathlike object
+        Path of the directory.
+    records : pandas.DataFrame
+        The registration records to merge. See `_update_registrations_file`.
+
+    Returns
+    -------
+    None
+    """
+    manifest = _read_manifest(directory)
+    keys = records["local_dataset_id"].map(lambda i: _partition_key(i, manifest))
+    for key, partition_records in records.groupby(keys, sort=False):
+        file_name = manifest["partitions"].get(key, key + ".csv")
+        partition_file = os.path.join(directory, file_name)
+        with _file_lock(_lock_path(partition_file)):
+            if os.path.exists(partition_file):
+                registrations = _read_registrations_file(partition_file)
+            else:
+                registrations = _read_registrations_file(directory, partitions=[])
+            registrations, added = _merge_registration_records(
+                registrations, partition_records
+            )
+            _write_registrations_file(registrations, partition_file)
+            if added:
+                with _file_lock(_lock_path(os.path.join(directory, _MANIFEST))):
+                    manifest = _read_manifest(directory)
+                    manifest["partitions"].setdefault(key, file_name)
+                    if manifest["order"] and manifest["order"][-1][0] == key:
+                        manifest["order"][-1][1] += added
+                    else:
+                        manifest["order"].append([key, added])
+                    _write_manifest(directory, manifest)
+    return None
+
+
+def _write_registrations_file(registrations, registrations_file):
+    """Atomically writes the registrations file.
+
+    The registrations are written to a temporary file in the same directory,
+    which then replaces the registrations file. Readers therefore see either
+    the old or the new file, never a partially written one.
+
+    Parameters
+    ----------
+    registrations : pandas.DataFrame
+        A dataframe of the registrations file.
+    registrations_file : str or pathlike object
+        Path of the registrations file.
+
+    Returns
+    -------
+    None
+        The registrations file written to disk as a .csv.
+    """
+    directory = os.path.dirname(os.path.abspath(registrations_file))
+    with tempfile.NamedTemporaryFile(
+        mode="w", suffix=".csv", dir=directory, delete=False, encoding="utf-8"
+    ) as temp_file:
+        registrations.to_csv(temp_file, index=False, lineterminator="\n")
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    if os.path.exists(registrations_file):
+        shutil.copymode(registrations_file, temp_file.name)
+    os.replace(temp_file.name, registrations_file)
+
+
+def _write_manifest(directory, manifest):
+    """Atomically writes the manifest of a partitioned registrations
+    directory.
+
+    Parameters
+    ----------
+    directory : str or pathlike object
+        Path of the directory.
+    manifest : dict
+        The manifest. See `_read_manifest`.
+
+    Returns
+    -------
+    None
+    """
+    with tempfile.NamedTemporaryFile(
+        mode="w", suffix=".tmp", dir=directory, delete=False, encoding="utf-8"
+    ) as temp_file:
+        json.dump(manifest, temp_file, indent=4)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_file.name, os.path.join(directory, _MANIFEST))
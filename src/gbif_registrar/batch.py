@@ -0,0 +1,487 @@
+"""Upload batches of datasets to GBIF."""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+import multiprocessing
+import os.path
+import tempfile
+import pandas as pd
+from gbif_registrar._buffer import _StatusBuffer
+from gbif_registrar._journal import _Journal
+from gbif_registrar._prefetch import _Prefetcher
+from gbif_registrar._utilities import (
+    _cache_local_dataset_metadata,
+    _get_local_dataset_group_id,
+    _group_bucket,
+    _latest_revisions,
+    _local_dataset_group_ids,
+    _read_registrations_file,
+    _write_registrations_file,
+)
+from gbif_registrar.registry import Registry, _as_registry
+from gbif_registrar.snapshot import (
+    RegistrySnapshot,
+    apply_status_changes,
+    publish_snapshot,
+)
+from gbif_registrar.upload import upload_dataset
+
+
+def upload_datasets(
+    local_dataset_ids,
+    registrations_file,
+    journal_file=None,
+    resume=False,
+    flush_size=100,
+    flush_interval=60.0,
+    latest_only=False,
+    prefetch=0,
+    prefetch_bytes=64 * 2**20,
+    config=None,
+):
+    """Uploads a batch of datasets to GBIF.
+
+    Parameters
+    ----------
+    local_dataset_ids : list of str
+        The identifiers of datasets in the EDI repository, in the order they
+        are to be uploaded. Each must be registered in the registrations file.
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it.
+    journal_file : str, optional
+        Path of a journal file in which the completed stages of each upload
+        are durably recorded as they happen. Required for resuming.
+    resume : bool, optional
+        If True, continue an interrupted batch from the journal: datasets
+        whose upload completed are skipped, and the remaining stages of
+        partially uploaded datasets are run (e.g. posting the endpoint of a
+        dataset whose endpoints were deleted). If False (the default), the
+        journal is cleared and the batch starts over.
+    flush_size : int, optional
+        Synchronization statuses are written to the registrations file in
+        batches of this many datasets, rather than one at a time.
+    flush_interval : float, optional
+        Maximum seconds a synchronization status waits to be written to the
+        registrations file. Pending statuses are also written when the batch
+        ends, or fails.
+    latest_only : bool, optional
+        If True, only the most recent revision of each dataset group is
+        uploaded. Datasets superseded by a newer revision in the registrations
+        file are replaced in the batch by that revision, without contacting
+        GBIF, because uploading them would only be overwritten by the newer
+        revision. Their `synchronized` status is left as is, since they
+        weren't posted to GBIF. If False (the default), every dataset is
+        uploaded in turn.
+    prefetch : int, optional
+        The number of upcoming datasets whose metadata is read from the EDI
+        repository in the background, while the current dataset waits for
+        GBIF to synchronize it. If 0 (the default), metadata is read when
+        each upload needs it.
+    prefetch_bytes : int, optional
+        Maximum size, in bytes, of the metadata held in memory for
+        prefetching. The least recently used documents are dropped past it.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+
+    Returns
+    -------
+    None
+        The registrations file written back to itself as a .csv.
+
+    Raises
+    ------
+    ValueError
+        If `resume` is True but there is no `journal_file`.
+
+    Notes
+    -----
+    This function requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> upload_datasets(["edi.1.1", "edi.2.1"], "registrations.csv", "job.jsonl")
+    >>> # After an interruption, continue where the batch left off.
+    >>> upload_datasets(
+    ...     ["edi.1.1", "edi.2.1"], "registrations.csv", "job.jsonl", resume=True
+    ... )
+    >>> # Upload a backlog of revisions with one GBIF crawl per dataset group.
+    >>> upload_datasets(
+    ...     ["edi.1.1", "edi.1.2", "edi.1.3"], "registrations.csv", latest_only=True
+    ... )
+    """
+    if resume and journal_file is None:
+        raise ValueError("A journal_file is required to resume a batch.")
+    journal = _Journal(journal_file, resume) if journal_file is not None else None
+    registry = _as_registry(registrations_file)
+    with ExitStack() as stack:
+        buffer = stack.enter_context(
+            _StatusBuffer(registry, flush_size, flush_interval)
+        )
+        if latest_only:
+            local_dataset_ids, superseded = _plan_latest(local_dataset_ids, registry)
+            for local_dataset_id, latest_id in superseded.items():
+                print(f"Skipping {local_dataset_id}, superseded by {latest_id}.")
+        prefetcher = None
+        if prefetch > 0:
+            cache = stack.enter_context(_cache_local_dataset_metadata(prefetch_bytes))
+            prefetcher = stack.enter_context(
+                _Prefetcher(local_dataset_ids, prefetch, cache, config)
+            )
+        for position, local_dataset_id in enumerate(local_dataset_ids):
+            if prefetcher is not None:
+                prefetcher.advance(position)
+            if journal is not None and journal.completed(
+                local_dataset_id, "synchronized"
+            ):
+                # The status may not have been written before the previous
+                # run was interrupted, so it is written again.
+                buffer.mark_synchronized(local_dataset_id)
+                print(f"Skipping {local_dataset_id}, uploaded in a previous run.")
+                continue
+            upload_dataset(
+                local_dataset_id,
+                registry,
+                journal=journal,
+                status_buffer=buffer,
+                config=config,
+            )
+    return None
+
+
+def upload_datasets_in_processes(
+    local_dataset_ids,
+    registrations_file,
+    max_workers=4,
+    snapshot_file=None,
+    mp_context=None,
+    config=None,
+):
+    """Uploads a batch of datasets to GBIF with a pool of worker processes.
+
+    The datasets of each dataset group are uploaded in order by one worker,
+    and different groups are uploaded in parallel. The registrations are
+    published once as a snapshot (see the snapshot module) that the workers
+    memory-map, so workers don't read the registrations file, and their
+    startup time and memory don't grow with it. Synchronization statuses are
+    sent back to this process, which writes them to the registrations file
+    as workers report them.
+
+    Parameters
+    ----------
+    local_dataset_ids : list of str
+        The identifiers of datasets in the EDI repository, in the order they
+        are to be uploaded within their group. Each must be registered in the
+        registrations file.
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it.
+    max_workers : int, optional
+        The number of worker processes.
+    snapshot_file : str, optional
+        Path of the snapshot file. If not provided, a temporary file is used
+        and deleted at the end of the batch.
+    mp_context : multiprocessing context, optional
+        The context used to start the workers, e.g.
+        `multiprocessing.get_context("spawn")`. Defaults to the default
+        context of the platform.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function, which workers inherit.
+
+    Returns
+    -------
+    None
+        The registrations file written back to itself as a .csv.
+
+    Notes
+    -----
+    This function requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> upload_datasets_in_processes(
+    ...     ["edi.1.1", "edi.2.1", "edi.3.1"], "registrations.csv", max_workers=3
+    ... )
+    """
+    registry = _as_registry(registrations_file)
+    chains = {}
+    for local_dataset_id in local_dataset_ids:
+        group_id = _get_local_dataset_group_id(local_dataset_id)
+        chains.setdefault(group_id, []).append(local_dataset_id)
+    mp_context = mp_context or multiprocessing.get_context()
+    status_queue = mp_context.Queue()
+    try:
+        with ExitStack() as stack:
+            if snapshot_file is None:
+                directory = stack.enter_context(tempfile.TemporaryDirectory())
+                snapshot_file = os.path.join(directory, "registrations.snapshot")
+            publish_snapshot(registry, snapshot_file)
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers,
+                    mp_context=mp_context,
+                    initializer=_attach_snapshot,
+                    initargs=(snapshot_file, status_queue, config),
+                )
+            )
+            futures = [
+                executor.submit(_upload_chain, chain) for chain in chains.values()
+            ]
+            for future in as_completed(futures):
+                apply_status_changes(status_queue, registry)
+                future.result()
+    finally:
+        # The workers have exited, so all their statuses are on the queue.
+        apply_status_changes(status_queue, registry)
+        status_queue.close()
+    return None
+
+
+# The snapshot and configuration of a worker process of
+# upload_datasets_in_processes.
+_worker_snapshot = None
+_worker_config = None
+
+
+def _attach_snapshot(snapshot_file, status_queue, config):
+    """Opens the registry snapshot once in a worker process."""
+    global _worker_snapshot, _worker_config  # pylint: disable=global-statement
+    _worker_snapshot = RegistrySnapshot(snapshot_file, status_queue)
+    _worker_config = config
+
+
+def _upload_chain(local_dataset_ids):
+    """Uploads the datasets of a group in order, in a worker process."""
+    for local_dataset_id in local_dataset_ids:
+        upload_dataset(local_dataset_id, _worker_snapshot, config=_worker_config)
+
+
+def upload_shard(
+    registrations_file,
+    shard,
+    num_shards,
+    result_file,
+    journal_file=None,
+    resume=False,
+    latest_only=False,
+    prefetch=0,
+    prefetch_bytes=64 * 2**20,
+    config=None,
+):
+    """Uploads the unsynchronized datasets of one shard of the registrations.
+
+    Registrations are partitioned into `num_shards` shards by a hash of their
+    `local_dataset_group_id`, so all datasets of a group (and therefore each
+    GBIF dataset) belong to the same shard. Each of several workers can then
+    upload one shard without touching the GBIF datasets of another.
+
+    Parameters
+    ----------
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it. It is only read.
+    shard : int
+        The shard to upload, from 0 to `num_shards` - 1.
+    num_shards : int
+        The number of shards the registrations are partitioned into.
+    result_file : str
+        Path of the shard's result file. This is a registrations file
+        containing only the registrations of the shard, to which the upload
+        results are written. Fold it back into the registrations file with
+        `merge_shard_results`.
+    journal_file : str, optional
+        Path of a journal file for the shard. See `upload_datasets`.
+    resume : bool, optional
+        If True, continue an interrupted shard upload from its journal and
+        existing result file. See `upload_datasets`.
+    latest_only : bool, optional
+        If True, only the most recent revision of each dataset group is
+        uploaded. See `upload_datasets`.
+    prefetch : int, optional
+        The number of upcoming datasets whose metadata is read in the
+        background. See `upload_datasets`.
+    prefetch_bytes : int, optional
+        Maximum size, in bytes, of the metadata held for prefetching.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+
+    Returns
+    -------
+    None
+        The shard's result file written to disk as a .csv.
+
+    Raises
+    ------
+    ValueError
+        If `shard` is not between 0 and `num_shards` - 1.
+
+    Notes
+    -----
+    This function requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> # On the first of three workers
+    >>> upload_shard("registrations.csv", 0, 3, "shard_0.csv", "shard_0.jsonl")
+    """
+    if not 0 <= shard < num_shards:
+        raise ValueError("shard must be between 0 and num_shards - 1.")
+    if not (resume and os.path.exists(result_file)):
+        registry = _as_registry(registrations_file)
+        registrations = registry.data
+        in_shard = _shard_of(registrations, num_shards, registry.parsed_ids) == shard
+        _write_registrations_file(registrations[in_shard], result_file)
+    results = Registry.load(result_file)
+    synchronized = results.data["synchronized"].fillna(False).astype(bool)
+    pending = results.data.loc[~synchronized, "local_dataset_id"]
+    upload_datasets(
+        pending.tolist(),
+        results,
+        journal_file,
+        resume,
+        latest_only=latest_only,
+        prefetch=prefetch,
+        prefetch_bytes=prefetch_bytes,
+        config=config,
+    )
+    return None
+
+
+def merge_shard_results(registrations_file, result_files):
+    """Folds shard result files back into the registrations file.
+
+    Parameters
+    ----------
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it.
+    result_files : list of str
+        Paths of the result files written by `upload_shard`. They are merged
+        in sorted order, so the outcome doesn't depend on the order they are
+        listed in.
+
+    Returns
+    -------
+    None
+        The registrations file written back to itself as a .csv.
+
+    Raises
+    ------
+    ValueError
+        If a registration appears in more than one result file, which means
+        the result files are not from the same partitioning.
+
+    Examples
+    --------
+    >>> merge_shard_results(
+    ...     "registrations.csv", ["shard_0.csv", "shard_1.csv", "shard_2.csv"]
+    ... )
+    """
+    results = [_read_registrations_file(file) for file in sorted(result_files)]
+    results = pd.concat(results, ignore_index=True)
+    duplicates = results.loc[results["local_dataset_id"].duplicated()]
+    if len(duplicates) > 0:
+        raise ValueError(
+            "Registrations found in more than one result file: "
+            + ", ".join(duplicates["local_dataset_id"])
+        )
+    registry = _as_registry(registrations_file)
+    registry.merge(_changed_records(results, registry))
+    registry.save()
+    return None
+
+
+def _changed_records(records, registry):
+    """Returns the records that differ from the registrations, so that rows a
+    shard didn't change aren't written back to the registrations file.
+
+    Parameters
+    ----------
+    records : pandas.DataFrame
+        Registration records with unique `local_dataset_id` values.
+    registry : Registry
+        A Registry of the registrations file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The records of datasets that aren't registered, or whose values
+        differ from their registration.
+    """
+    cols = [col for col in records.columns if col != "local_dataset_id"]
+    registrations = registry.data.drop_duplicates("local_dataset_id", keep="first")
+    current = (
+        registrations.set_index("local_dataset_id")
+        .reindex(records["local_dataset_id"])[cols]
+        .astype(object)
+    )
+    values = records.set_index("local_dataset_id")[cols].astype(object)
+    same = (current == values) | (current.isna() & values.isna())
+    return records.loc[~same.all(axis=1).to_numpy()]
+
+
+def _plan_latest(local_dataset_ids, registry):
+    """Plans the upload of only the most recent revision of each dataset
+    group.
+
+    Parameters
+    ----------
+    local_dataset_ids : list of str
+        The identifiers of datasets to be uploaded, in order.
+    registry : Registry
+        A Registry of the registrations file.
+
+    Returns
+    -------
+    tuple
+        A list of the datasets to upload, in which each dataset is replaced by
+        the most recent revision of its group (listed once, at the position of
+        the first dataset of the group), and a dict mapping each requested
+        dataset that is superseded to the revision replacing it. Datasets that
+        aren't registered are left as is.
+    """
+    registrations = registry.data
+    latest = _latest_revisions(registrations, registry.parsed_ids)
+    group_ids = _local_dataset_group_ids(registrations, registry.parsed_ids)
+    latest_of_group = dict(
+        zip(group_ids[latest], registrations.loc[latest, "local_dataset_id"])
+    )
+    group_of = dict(zip(registrations["local_dataset_id"], group_ids))
+    planned = {}
+    superseded = {}
+    for local_dataset_id in local_dataset_ids:
+        group_id = group_of.get(local_dataset_id)
+        latest_id = latest_of_group.get(group_id, local_dataset_id)
+        if latest_id != local_dataset_id:
+            superseded[local_dataset_id] = latest_id
+        planned.setdefault(latest_id)
+    return list(planned), superseded
+
+
+def _shard_of(registrations, num_shards, parsed_ids=None):
+    """Returns the shard of each registration.
+
+    Parameters
+    ----------
+    registrations : pandas.DataFrame
+        A dataframe of the registrations file.
+    num_shards : int
+        The number of shards.
+    parsed_ids : pandas.DataFrame, optional
+        The `local_dataset_id` column parsed by `_parse_local_dataset_ids`,
+        e.g. `Registry.parsed_ids`. Parsed here if not provided.
+
+    Returns
+    -------
+    pandas.Series
+        The shard of each registration. This is a stable hash of the
+        `local_dataset_group_id` (derived from the `local_dataset_id` of
+        incomplete registrations), and is the same on every host.
+    """
+    group_ids = _local_dataset_group_ids(registrations, parsed_ids)
+    return group_ids.map(lambda group_id: _group_bucket(group_id, num_shards))
@@ -1,7 +1,187 @@
 """Configure the gbif_registrar package for use."""
 
+from collections.abc import Mapping
+from dataclasses import dataclass, field, fields
 from json import load, dump
 from os import environ
+from types import MappingProxyType
+
+
+@dataclass(frozen=True)
+class Config:
+    """An immutable set of the configuration settings.
+
+    A Config can be passed to the register, upload, batch, and sync
+    functions in place of the global environment variables set by
+    load_configuration. Each call then uses its own GBIF account and
+    environment, so several can run at once, e.g. in parallel threads
+    targeting the GBIF test and production environments.
+
+    Parameters
+    ----------
+    user_name : str
+        The username for the GBIF account.
+    password : str
+        The password for the GBIF account.
+    organization : str
+        The organization key for the GBIF account.
+    installation : str
+        The installation key for the GBIF account.
+    gbif_api : str
+        The GBIF API endpoint.
+    registry_base_url : str
+        The GBIF registry base URL.
+    gbif_dataset_base_url : str
+        The GBIF dataset base URL.
+    pasta_environment : str
+        The PASTA environment base URL.
+    options : mapping, optional
+        The optional keys of the configuration file, e.g. "PASTA_SCOPES" or
+        "RATE_LIMIT_READ". Keys that aren't set take their defaults (see
+        initialize_configuration_file).
+
+    Notes
+    -----
+    The fields correspond to the keys of the configuration file, in lower
+    case. See initialize_configuration_file.
+
+    Examples
+    --------
+    >>> uat = Config.from_file("uat.json")
+    >>> register_dataset("edi.929.2", "registrations.csv", config=uat)
+    """
+
+    user_name: str
+    password: str
+    organization: str
+    installation: str
+    gbif_api: str
+    registry_base_url: str
+    gbif_dataset_base_url: str
+    pasta_environment: str
+    options: Mapping = field(default_factory=dict, hash=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "options", MappingProxyType(dict(self.options)))
+
+    def __reduce__(self):
+        # A MappingProxyType can't be pickled, so the options are passed as a
+        # dict, e.g. to the workers of a process pool.
+        values = [getattr(self, f.name) for f in fields(self) if f.name != "options"]
+        return (self.__class__, (*values, dict(self.options)))
+
+    def __repr__(self):
+        return (
+            f"Config(user_name={self.user_name!r}, password='***', "
+            f"gbif_api={self.gbif_api!r}, "
+            f"pasta_environment={self.pasta_environment!r})"
+        )
+
+    def option(self, key):
+        """Returns the value of an optional configuration key.
+
+        Parameters
+        ----------
+        key : str
+            One of the optional keys, e.g. "RETRY_ATTEMPTS".
+
+        Returns
+        -------
+        str or None
+            The value set in the options, or the default of the key. None if
+            the key has no default.
+        """
+        return self.options.get(key, _OPTIONAL_KEYS[key])
+
+    @classmethod
+    def from_mapping(cls, settings):
+        """Creates a Config from a mapping of configuration keys.
+
+        Parameters
+        ----------
+        settings : mapping
+            Configuration keys and values, e.g. the contents of a
+            configuration file.
+
+        Returns
+        -------
+        Config
+
+        Raises
+        ------
+        KeyError
+            If a required key is missing.
+        """
+        names = [f.name for f in fields(cls) if f.name != "options"]
+        values = {name: settings[name.upper()] for name in names}
+        options = {
+            key: value
+            for key, value in settings.items()
+            if key.lower() not in names and key in _OPTIONAL_KEYS
+        }
+        return cls(**values, options=options)
+
+    @classmethod
+    def from_file(cls, configuration_file):
+        """Reads a Config from a configuration file.
+
+        Parameters
+        ----------
+        configuration_file : str
+            Path of the configuration file.
+
+        Returns
+        -------
+        Config
+        """
+        with open(configuration_file, "r", encoding="utf-8") as config:
+            return cls.from_mapping(load(config))
+
+    @classmethod
+    def from_environ(cls):
+        """Creates a Config from the environment variables set by
+        load_configuration.
+
+        Returns
+        -------
+        Config
+
+        Raises
+        ------
+        KeyError
+            If the configuration hasn't been loaded.
+        """
+        return cls.from_mapping(environ)
+
+
+# Keys that may be added to the configuration file, in addition to those of
+# the template, and their defaults.
+_OPTIONAL_KEYS = {
+    "RATE_LIMIT_READ": "10",
+    "RATE_LIMIT_WRITE": "2",
+    "RATE_LIMIT_DIR": None,
+    "RETRY_ATTEMPTS": "4",
+    "RETRY_BACKOFF": "1",
+    "CIRCUIT_BREAKER_THRESHOLD": "5",
+    "CIRCUIT_BREAKER_TIMEOUT": "60",
+    "PASTA_SCOPES": None,
+}
+
+
+def _resolve_config(config=None):
+    """Returns a Config, defaulting to the environment variables.
+
+    Parameters
+    ----------
+    config : Config, optional
+        The Config to use. If not provided, one is created from the
+        environment variables set by load_configuration.
+
+    Returns
+    -------
+    Config
+    """
+    return Config.from_environ() if config is None else config
 
 
 def load_configuration(configuration_file):
@@ -58,6 +238,8 @@ def unload_configuration():
     ]
     for key in env_vars:
         del environ[key]
+    for key in _OPTIONAL_KEYS:
+        environ.pop(key, None)
 
 
 def initialize_configuration_file(file_path):
@@ -96,6 +278,35 @@ def initialize_configuration_file(file_path):
         PASTA_ENVIRONMENT : str
             The PASTA environment base URL.
 
+    The following optional keys may be added to tune how requests are sent
+    to each of the GBIF and PASTA hosts:
+        RATE_LIMIT_READ : str
+            Maximum GET requests per second. Defaults to "10".
+        RATE_LIMIT_WRITE : str
+            Maximum POST and DELETE requests per second. Defaults to "2".
+        RATE_LIMIT_DIR : str
+            Path of a directory in which to share the rate limits across
+            processes on one node. If unset, the limits apply to each process
+            separately.
+        RETRY_ATTEMPTS : str
+            Maximum attempts at a request that fails transiently. Defaults to
+            "4".
+        RETRY_BACKOFF : str
+            Seconds to wait before the first retry. The wait doubles with each
+            retry. Defaults to "1".
+        CIRCUIT_BREAKER_THRESHOLD : str
+            Consecutive failures of a host after which requests to it fail
+            fast. Defaults to "5".
+        CIRCUIT_BREAKER_TIMEOUT : str
+            Seconds to wait before trying a failing host again. Defaults to
+            "60".
+
+    The following optional key sets the scopes synced by the
+    sync_from_source function of the sync module:
+        PASTA_SCOPES : str
+            Comma separated scopes of the EDI repository, e.g.
+            "edi,knb-lter-msp".
+
     Examples
     --------
     >>> initialize_configuration_file("configuration.json")
@@ -0,0 +1,448 @@
+"""Register and upload datasets continuously in a long-running process."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sched
+import signal
+import threading
+import time
+import pandas as pd
+from gbif_registrar._utilities import _latest_revisions
+from gbif_registrar.metrics import render_metrics, write_metrics
+from gbif_registrar.register import complete_registration_records
+from gbif_registrar.registry import _as_registry
+from gbif_registrar.sync import sync_from_source
+from gbif_registrar.upload import upload_dataset
+
+
+class Daemon:
+    """Watches the registrations file and drains its pending work.
+
+    The daemon keeps a Registry of the registrations file in memory for its
+    whole life, rather than reading it on each run as a scheduled job would.
+    Every `interval` seconds it scans the registry, and schedules work on its
+    event loop: registrations with missing values are completed, and
+    datasets that aren't synchronized are uploaded (which includes checking
+    their synchronization with GBIF). Revisions superseded by a newer
+    revision of their group aren't uploaded, as GBIF only hosts the newest. If `scopes` are given, new datasets are
+    also synced from the EDI repository every `sync_interval` seconds.
+
+    Parameters
+    ----------
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it. A Registry that
+        isn't kept in memory only is reloaded when the file is changed by
+        another process.
+    interval : float, optional
+        Seconds between scans of the registry.
+    scopes : list of str, optional
+        Scopes of the EDI repository to sync new datasets from. See
+        `sync_from_source` in the sync module. If not provided, new datasets
+        must be added to the registrations file by other means.
+    sync_interval : float, optional
+        Seconds between syncs of new datasets from the EDI repository.
+    health_port : int, optional
+        Port on localhost at which to serve the health and status of the
+        daemon, as JSON, at the path "/health". Use 0 to pick a free port
+        (see `health_url`). If not provided, no health endpoint is served.
+        The metrics of the daemon are served at the path "/metrics", in the
+        Prometheus text format (see the metrics module).
+    metrics_file : str or pathlike object, optional
+        Path of a file to which the metrics are written after each scan, for
+        the Prometheus textfile collector. See `write_metrics` in the metrics
+        module.
+    max_retry_interval : float, optional
+        Most seconds to wait before uploading a dataset again, after uploads
+        of it failed or left it unsynchronized.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+
+    Notes
+    -----
+    The work is run one task at a time. A task that fails is reported in the
+    status and tried again on a later scan; it doesn't stop the daemon. A
+    dataset whose upload fails, or whose synchronization can't be confirmed,
+    isn't uploaded again for twice `interval` seconds, doubling with each
+    consecutive unsuccessful upload up to `max_retry_interval`, so its GBIF
+    endpoint isn't recreated on every scan.
+
+    `stop` lets the running task finish, skips the queued tasks, then ends
+    `run`. The registrations are written as each task completes, so nothing
+    is lost on shutdown.
+
+    This class requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> daemon = Daemon("registrations.csv", interval=300, health_port=8787)
+    >>> daemon.run()  # Until daemon.stop() is called from another thread
+    """
+
+    def __init__(
+        self,
+        registrations_file,
+        interval=60.0,
+        scopes=None,
+        sync_interval=3600.0,
+        health_port=None,
+        metrics_file=None,
+        max_retry_interval=86400.0,
+        config=None,
+    ):
+        self.config = config
+        self.metrics_file = metrics_file
+        self.registry = _as_registry(registrations_file)
+        self.interval = interval
+        self.scopes = scopes
+        self.sync_interval = sync_interval
+        self.health_port = health_port
+        self.max_retry_interval = max_retry_interval
+        self._scheduler = sched.scheduler(time.monotonic)
+        self._stop = threading.Event()
+        self._queued = set()
+        # Consecutive unsuccessful uploads and the monotonic time before which
+        # the dataset isn't uploaded again, by local_dataset_id.
+        self._retries = {}
+        self._mtime = self._file_mtime()
+        # The tasks write the registrations file through the registry, so its
+        # saves are tracked to tell them from changes by other processes.
+        self._save_registry = self.registry.save
+        self.registry.save = self._save
+        self._health_server = None
+        self._lock = threading.Lock()
+        self._status = {
+            "state": "starting",
+            "started": None,
+            "last_scan": None,
+            "registered": 0,
+            "uploaded": 0,
+            "failures": 0,
+            "last_error": None,
+        }
+
+    @property
+    def health_url(self):
+        """str or None : URL of the health endpoint, while it is served."""
+        if self._health_server is None:
+            return None
+        return f"http://127.0.0.1:{self._health_server.server_address[1]}/health"
+
+    def run(self):
+        """Runs the daemon until `stop` is called.
+
+        Returns
+        -------
+        None
+        """
+        self._set_status(state="running", started=time.time())
+        if self.health_port is not None:
+            self._start_health_server()
+        self._scheduler.enter(0, 1, self._scan)
+        if self.scopes:
+            self._scheduler.enter(0, 0, self._sync)
+        try:
+            while not self._stop.is_set():
+                delay = self._scheduler.run(blocking=False)
+                if delay is None:
+                    break
+                self._stop.wait(delay)
+        finally:
+            for event in self._scheduler.queue:
+                self._scheduler.cancel(event)
+            self._queued.clear()
+            if self._health_server is not None:
+                self._health_server.shutdown()
+                self._health_server.server_close()
+                self._health_server = None
+            self._set_status(state="stopped")
+        return None
+
+    def stop(self):
+        """Stops the daemon after the running task.
+
+        Returns
+        -------
+        None
+        """
+        self._set_status(state="stopping")
+        self._stop.set()
+
+    def status(self):
+        """Returns the status of the daemon.
+
+        Returns
+        -------
+        dict
+            The state ("starting", "running", "stopping", or "stopped"), the
+            times the daemon started and last scanned the registry, the number
+            of pending registrations and queued tasks, counts of completed
+            registrations, uploads, and failed tasks, and the last error.
+        """
+        with self._lock:
+            status = dict(self._status)
+        registrations = self.registry.data
+        status["pending"] = int(
+            (~registrations["synchronized"].fillna(False).astype(bool)).sum()
+        )
+        status["queued"] = len(self._queued)
+        return status
+
+    def _scan(self):
+        """Schedules the pending work in the registry, then the next scan."""
+        if self._stop.is_set():
+            return
+        self._run_task("reload", self._reload_if_changed)
+        for local_dataset_id in self.registry.incomplete():
+            self._schedule(0, self._register, local_dataset_id)
+        registrations = self.registry.data
+        parsed_ids = self.registry.parsed_ids
+        synchronized = registrations["synchronized"].fillna(False).astype(bool)
+        superseded = parsed_ids["valid"] & ~_latest_revisions(registrations, parsed_ids)
+        pending = ~synchronized & ~superseded
+        for local_dataset_id in registrations.loc[pending, "local_dataset_id"]:
+            if not pd.isna(local_dataset_id) and not self._retry_pending(
+                local_dataset_id
+            ):
+                self._schedule(1, self._upload, local_dataset_id)
+        self._set_status(last_scan=time.time())
+        if self.metrics_file is not None:
+            self._run_task("metrics", write_metrics, self.metrics_file)
+        self._scheduler.enter(self.interval, 2, self._scan)
+
+    def _sync(self):
+        """Syncs new datasets from the EDI repository, then schedules the
+        next sync. The new datasets are uploaded by the sync."""
+        if self._stop.is_set():
+            return
+        self._run_task(
+            "sync",
+            sync_from_source,
+            self.registry,
+            self.scopes,
+            config=self.config,
+        )
+        self._scheduler.enter(self.sync_interval, 0, self._sync)
+
+    def _register(self, local_dataset_id):
+        """Completes the registration of a dataset."""
+        if self._run_task(
+            f"register {local_dataset_id}",
+            complete_registration_records,
+            self.registry,
+            local_dataset_id,
+            config=self.config,
+        ):
+            self._increment("registered")
+
+    def _upload(self, local_dataset_id):
+        """Uploads a dataset, unless it was synchronized in the meantime, and
+        delays the next upload of it if it isn't synchronized afterwards."""
+        if self._synchronized(local_dataset_id) is not False:
+            return
+        if (
+            self._run_task(
+                f"upload {local_dataset_id}",
+                upload_dataset,
+                local_dataset_id,
+                self.registry,
+                config=self.config,
+            )
+            and self._synchronized(local_dataset_id) is not False
+        ):
+            self._retries.pop(local_dataset_id, None)
+            if self._synchronized(local_dataset_id):
+                self._increment("uploaded")
+            return
+        attempts = self._retries.get(local_dataset_id, (0, None))[0] + 1
+        delay = min(self.interval * 2**attempts, self.max_retry_interval)
+        self._retries[local_dataset_id] = (attempts, time.monotonic() + delay)
+
+    def _retry_pending(self, local_dataset_id):
+        """Returns True if a dataset shouldn't be uploaded yet, because recent
+        uploads of it were unsuccessful."""
+        retry = self._retries.get(local_dataset_id)
+        return retry is not None and time.monotonic() < retry[1]
+
+    def _synchronized(self, local_dataset_id):
+        """Returns the synchronization status of a dataset, or None if it
+        isn't registered."""
+        record = self.registry.get(local_dataset_id)
+        if record is None:
+            return None
+        return not pd.isna(record["synchronized"]) and bool(record["synchronized"])
+
+    def _schedule(self, priority, task, local_dataset_id):
+        """Schedules a task for a dataset, unless it is already queued."""
+        key = (task.__name__, local_dataset_id)
+        if key in self._queued:
+            return
+
+        def run_task():
+            self._queued.discard(key)
+            if not self._stop.is_set():
+                task(local_dataset_id)
+
+        self._queued.add(key)
+        self._scheduler.enter(0, priority, run_task)
+
+    def _run_task(self, name, function, *args, **kwargs):
+        """Runs a task, recording rather than raising its errors.
+
+        Returns
+        -------
+        bool
+            True if the task succeeded.
+        """
+        try:
+            function(*args, **kwargs)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            print(f"Task {name} failed: {error!r}")
+            with self._lock:
+                self._status["failures"] += 1
+                self._status["last_error"] = repr(error)
+            return False
+        return True
+
+    def _reload_if_changed(self):
+        """Reloads the registry if another process changed the registrations
+        file."""
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self._mtime:
+            self._save_registry()
+            self.registry.reload()
+            self._mtime = self._file_mtime()
+
+    def _save(self):
+        """Saves the registry, and records the modification time of the
+        file written, unless another process changed the file before."""
+        changed = self._file_mtime() != self._mtime
+        self._save_registry()
+        if not changed:
+            self._mtime = self._file_mtime()
+
+    def _file_mtime(self):
+        """Returns the modification time of the registrations file, or None if
+        the registry is kept in memory only."""
+        if self.registry.registrations_file is None:
+            return None
+        return os.stat(self.registry.registrations_file).st_mtime_ns
+
+    def _increment(self, key):
+        with self._lock:
+            self._status[key] += 1
+
+    def _set_status(self, **values):
+        with self._lock:
+            self._status.update(values)
+
+    def _start_health_server(self):
+        """Serves the status of the daemon on localhost."""
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            """Responds to health checks with the status of the daemon."""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Responds with the status as JSON, or the metrics."""
+                if self.path == "/metrics":
+                    body = render_metrics().encode("utf-8")
+                    self.send_response(200)
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/health":
+                    status = daemon.status()
+                    body = json.dumps(status).encode("utf-8")
+                    self.send_response(200 if status["state"] == "running" else 503)
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=W0622
+                """Silences request logging."""
+
+        self._health_server = ThreadingHTTPServer(
+            ("127.0.0.1", self.health_port), HealthHandler
+        )
+        threading.Thread(target=self._health_server.serve_forever, daemon=True).start()
+
+
+def run_daemon(
+    registrations_file,
+    interval=60.0,
+    scopes=None,
+    sync_interval=3600.0,
+    health_port=None,
+    metrics_file=None,
+    max_retry_interval=86400.0,
+    config=None,
+):
+    """Runs a Daemon until the process is interrupted or terminated.
+
+    Parameters
+    ----------
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it.
+    interval : float, optional
+        Seconds between scans of the registry for pending work.
+    scopes : list of str, optional
+        Scopes of the EDI repository to sync new datasets from.
+    sync_interval : float, optional
+        Seconds between syncs of new datasets from the EDI repository.
+    health_port : int, optional
+        Port on localhost at which to serve the health and status of the
+        daemon at the path "/health", and its metrics at "/metrics".
+    metrics_file : str or pathlike object, optional
+        Path of a file to which the metrics are written after each scan, for
+        the Prometheus textfile collector.
+    max_retry_interval : float, optional
+        Most seconds to wait before uploading a dataset again, after uploads
+        of it were unsuccessful.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    SIGINT (Ctrl+C) and SIGTERM stop the daemon gracefully: the running task
+    is finished, and the queued tasks skipped, before the function returns.
+    This function must be called from the main thread.
+
+    This function requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> run_daemon("registrations.csv", interval=300, health_port=8787)
+    """
+    daemon = Daemon(
+        registrations_file,
+        interval=interval,
+        scopes=scopes,
+        sync_interval=sync_interval,
+        health_port=health_port,
+        metrics_file=metrics_file,
+        max_retry_interval=max_retry_interval,
+        config=config,
+    )
+    handlers = {}
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        handlers[signum] = signal.signal(signum, lambda *_: daemon.stop())
+    try:
+        daemon.run()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return None
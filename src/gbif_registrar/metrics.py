@@ -0,0 +1,228 @@
+"""Collect metrics of registrar runs, for Prometheus.
+
+The registrar counts the datasets it registers, uploads, and synchronizes,
+and the HTTP requests it makes, and times requests and synchronizations, as
+it runs. Write the metrics with `write_metrics` at the end of a run, to a
+directory read by the textfile collector of the Prometheus node exporter. A
+`Daemon` can also serve them at the "/metrics" path of its health endpoint.
+
+Metrics are kept in memory for the life of the process, and are the totals
+of the process. A cron job writes the metrics of its own run.
+"""
+
+import os
+import tempfile
+import threading
+
+# Upper bounds, in seconds, of the histogram buckets of each histogram.
+_BUCKETS = {
+    "gbif_registrar_http_request_duration_seconds": (
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+        30.0,
+        60.0,
+    ),
+    "gbif_registrar_time_to_sync_seconds": (
+        5.0,
+        10.0,
+        20.0,
+        30.0,
+        45.0,
+        60.0,
+        90.0,
+        120.0,
+        300.0,
+    ),
+}
+
+# Help text of each metric, in the order they are written.
+_HELP = {
+    "gbif_registrar_datasets_registered_total": (
+        "counter",
+        "Datasets added to the registrations file.",
+    ),
+    "gbif_registrar_datasets_uploaded_total": (
+        "counter",
+        "Datasets whose endpoint and metadata were posted to GBIF.",
+    ),
+    "gbif_registrar_datasets_synced_total": (
+        "counter",
+        "Uploaded datasets found synchronized with GBIF.",
+    ),
+    "gbif_registrar_sync_timeouts_total": (
+        "counter",
+        "Uploaded datasets whose synchronization checks timed out.",
+    ),
+    "gbif_registrar_http_requests_total": (
+        "counter",
+        "HTTP requests sent, by host, method, and status code.",
+    ),
+    "gbif_registrar_http_request_duration_seconds": (
+        "histogram",
+        "Latency of HTTP requests, by host.",
+    ),
+    "gbif_registrar_time_to_sync_seconds": (
+        "histogram",
+        "Time from posting a dataset to GBIF to finding it synchronized.",
+    ),
+}
+
+
+class _Metrics:
+    """The counters and histograms of the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, amount=1, **labels):
+        """Adds to a counter."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Records a value in a histogram."""
+        key = (name, _label_key(labels))
+        buckets = _BUCKETS[name]
+        with self._lock:
+            counts, total, count = self._histograms.get(
+                key, ([0] * len(buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._histograms[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._histograms.items()
+            }
+        lines = []
+        for name, (kind, text) in _HELP.items():
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (key_name, labels), value in sorted(counters.items()):
+                    if key_name == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            for (key_name, labels), (counts, total, count) in sorted(
+                histograms.items()
+            ):
+                if key_name != name:
+                    continue
+                for bound, bucket_count in zip(_BUCKETS[name], counts):
+                    bucket_labels = labels + (("le", repr(bound)),)
+                    lines.append(
+                        f"{name}_bucket{_labels(bucket_labels)} {bucket_count}"
+                    )
+                bucket_labels = labels + (("le", "+Inf"),)
+                lines.append(f"{name}_bucket{_labels(bucket_labels)} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Clears all metrics."""
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+
+_metrics = _Metrics()
+
+
+def _increment(name, amount=1, **labels):
+    """Adds to a counter of the process. See `_Metrics.increment`."""
+    _metrics.increment(name, amount, **labels)
+
+
+def _observe(name, value, **labels):
+    """Records a value in a histogram of the process. See
+    `_Metrics.observe`."""
+    _metrics.observe(name, value, **labels)
+
+
+def _label_key(labels):
+    """Returns labels as a sortable key, with their values as strings."""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _labels(labels):
+    """Formats labels for the text exposition format."""
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def render_metrics():
+    """Returns the metrics of the process.
+
+    Returns
+    -------
+    str
+        The metrics, in the Prometheus text exposition format.
+    """
+    return _metrics.render()
+
+
+def write_metrics(metrics_file):
+    """Writes the metrics of the process for the Prometheus textfile
+    collector.
+
+    The file is replaced atomically, so the collector never reads a partially
+    written file.
+
+    Parameters
+    ----------
+    metrics_file : str or pathlike object
+        Path of the metrics file. Its name must end in ".prom" to be read by
+        the textfile collector, e.g. "gbif_registrar.prom" in the directory
+        given to the node exporter's --collector.textfile.directory flag.
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> upload_datasets(local_dataset_ids, "registrations.csv")
+    >>> write_metrics("/var/lib/node_exporter/textfile/gbif_registrar.prom")
+    """
+    directory = os.path.dirname(os.path.abspath(metrics_file))
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8"
+    ) as tmp:
+        tmp.write(render_metrics())
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.chmod(tmp.name, 0o644)
+    os.replace(tmp.name, metrics_file)
+    return None
+
+
+def reset_metrics():
+    """Clears the metrics of the process, e.g. between runs of a long-lived
+    process that writes the metrics of each run.
+
+    Returns
+    -------
+    None
+    """
+    _metrics.reset()
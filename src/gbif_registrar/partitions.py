@@ -0,0 +1,112 @@
+"""Partition the registrations into a directory of files.
+
+A registrations file is rewritten whole by every update, so updates to the
+datasets of one scope rewrite the registrations of all scopes. A partitioned
+registrations directory instead holds one registrations file per scope (or
+per bucket of dataset groups), and a manifest. Updates rewrite only the
+partitions of the datasets they change, and `Registry.load` can read only the
+partitions of the datasets to be worked on.
+
+The path of a partitioned directory can be passed wherever the path of a
+registrations file is accepted.
+"""
+
+import os
+from gbif_registrar._utilities import (
+    _MANIFEST,
+    _partition_key,
+    _read_registrations_file,
+    _write_manifest,
+    _write_registrations_file,
+)
+
+
+def partition_registrations(
+    registrations_file, directory, partition_by="scope", buckets=16
+):
+    """Writes the registrations file as a partitioned registrations directory.
+
+    Parameters
+    ----------
+    registrations_file : str or pathlike object
+        Path of the registrations file.
+    directory : str or pathlike object
+        Path of the directory. It is created if it doesn't exist.
+    partition_by : str, optional
+        "scope" to write the registrations of each scope (e.g.
+        "knb-lter-ble") to their own file, or "bucket" to write each of
+        `buckets` files with the registrations of the dataset groups that
+        hash to it. Buckets suit repositories with many small scopes.
+    buckets : int, optional
+        The number of buckets, if `partition_by` is "bucket".
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If `partition_by` isn't "scope" or "bucket", or the directory is
+        already partitioned.
+
+    Notes
+    -----
+    The manifest records the order of the registrations, so
+    `combine_partitions` writes back the same registrations file.
+
+    Examples
+    --------
+    >>> partition_registrations("registrations.csv", "registrations")
+    >>> upload_dataset("edi.929.2", "registrations")
+    """
+    if partition_by not in ("scope", "bucket"):
+        raise ValueError('partition_by must be "scope" or "bucket".')
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, _MANIFEST)):
+        raise ValueError(f"{directory} is already partitioned.")
+    manifest = {
+        "partition_by": partition_by,
+        "buckets": buckets if partition_by == "bucket" else None,
+        "partitions": {},
+        "order": [],
+    }
+    registrations = _read_registrations_file(registrations_file)
+    keys = registrations["local_dataset_id"].map(lambda i: _partition_key(i, manifest))
+    for key in keys:
+        if manifest["order"] and manifest["order"][-1][0] == key:
+            manifest["order"][-1][1] += 1
+        else:
+            manifest["order"].append([key, 1])
+    for key, partition in registrations.groupby(keys, sort=True):
+        manifest["partitions"][key] = key + ".csv"
+        _write_registrations_file(partition, os.path.join(directory, key + ".csv"))
+    # The manifest is written last, so an interrupted partitioning can be
+    # run again.
+    _write_manifest(directory, manifest)
+    return None
+
+
+def combine_partitions(directory, registrations_file):
+    """Writes a partitioned registrations directory as a registrations file.
+
+    Parameters
+    ----------
+    directory : str or pathlike object
+        Path of the partitioned registrations directory.
+    registrations_file : str or pathlike object
+        Path of the registrations file. Its registrations are in the order of
+        the file the directory was partitioned from, followed by those added
+        since.
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> combine_partitions("registrations", "registrations.csv")
+    """
+    registrations = _read_registrations_file(directory)
+    _write_registrations_file(registrations, registrations_file)
+    return None
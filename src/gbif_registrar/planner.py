@@ -0,0 +1,282 @@
+"""Plan batches of registrations and uploads before running them."""
+
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from gbif_registrar._buffer import _StatusBuffer
+from gbif_registrar._utilities import (
+    _cache_local_dataset_metadata,
+    _get_local_dataset_group_id,
+)
+from gbif_registrar.register import complete_registration_records, register_dataset
+from gbif_registrar.registry import _as_registry
+from gbif_registrar.upload import upload_dataset
+
+# The synchronization checks of an upload: one before the upload, and at least
+# one, and at most 12, while GBIF crawls the dataset. See upload_dataset.
+_MIN_SYNC_CHECKS = 2
+_MAX_SYNC_CHECKS = 13
+
+
+class Plan:
+    """The operations of a batch, computed before any of them are run.
+
+    A plan is a graph of tasks, each of which registers, completes, or
+    uploads a dataset, and the HTTP operations each task makes. Operations
+    shared by several tasks, such as reading the metadata document of a
+    dataset or requesting a GBIF dataset UUID for a new dataset group, are
+    listed once. Create a plan with `plan_batch`, and run it with
+    `execute_plan`.
+
+    Attributes
+    ----------
+    registry : Registry
+        The registry the plan was made from, and is run against.
+    tasks : list of dict
+        The tasks, in an order that satisfies their dependencies. Each has the
+        keys "task" ("register", "complete", or "upload"),
+        "local_dataset_id", "local_dataset_group_id", "requires" (the
+        (task, local_dataset_id) pairs that must run first), and "operations"
+        (the keys of its HTTP operations).
+    operations : dict
+        The HTTP operations, keyed by (host, method, resource). Each value is
+        the minimum number of requests, regardless of how many tasks share
+        the operation.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.tasks = []
+        self.operations = {}
+        self._maxima = {}
+        self._references = 0
+
+    def __str__(self):
+        counts = {}
+        for task in self.tasks:
+            counts[task["task"]] = counts.get(task["task"], 0) + 1
+        lines = [
+            f"Planned {len(self.tasks)} tasks: "
+            + ", ".join(f"{count} {task}" for task, count in counts.items())
+        ]
+        maxima = self.estimate(maximum=True)
+        for (host, method), count in sorted(self.estimate().items()):
+            if maxima[(host, method)] > count:
+                count = f"{count} to {maxima[(host, method)]}"
+            lines.append(f"  {host} {method}: {count} requests")
+        duplicates = self._references - len(self.operations)
+        lines.append(f"  {duplicates} duplicate operations removed")
+        return "\n".join(lines)
+
+    def estimate(self, maximum=False):
+        """Returns the estimated number of HTTP requests of the plan.
+
+        Parameters
+        ----------
+        maximum : bool, optional
+            If False (the default), the minimum number of requests is
+            returned. If True, the maximum is returned.
+
+        Returns
+        -------
+        dict
+            The number of requests, keyed by (host, method), e.g.
+            ("GBIF", "POST"). The synchronization checks of an upload, GETs
+            of the GBIF dataset that are repeated while GBIF crawls it, are
+            counted at their minimum of 2, or their maximum of 13. The other
+            operations are made once.
+        """
+        estimate = {}
+        for key, count in self.operations.items():
+            if maximum:
+                count = self._maxima[key]
+            host, method, _ = key
+            estimate[(host, method)] = estimate.get((host, method), 0) + count
+        return estimate
+
+    def _add_task(self, task, local_dataset_id, group_id, requires, operations):
+        """Adds a task, and its operations unless they are already planned.
+
+        Each operation is a (host, method, resource, count) tuple, or a
+        (host, method, resource, minimum, maximum) tuple if the number of
+        requests varies."""
+        keys = []
+        for host, method, resource, count, *maximum in operations:
+            key = (host, method, resource)
+            self.operations.setdefault(key, count)
+            self._maxima.setdefault(key, maximum[0] if maximum else count)
+            self._references += 1
+            keys.append(key)
+        self.tasks.append(
+            {
+                "task": task,
+                "local_dataset_id": local_dataset_id,
+                "local_dataset_group_id": group_id,
+                "requires": requires,
+                "operations": keys,
+            }
+        )
+
+
+def plan_batch(local_dataset_ids, registrations_file):
+    """Plans the registration and upload of a batch of datasets.
+
+    Datasets that aren't in the registrations file are registered, datasets
+    with incomplete registrations are completed, and datasets that aren't
+    synchronized are uploaded. Nothing is sent to GBIF or the EDI repository,
+    so this can be used to preview a batch.
+
+    Parameters
+    ----------
+    local_dataset_ids : list of str
+        The identifiers of datasets in the EDI repository, in the order they
+        are to be uploaded.
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it.
+
+    Returns
+    -------
+    Plan
+        The plan. Print it for a summary of the estimated cost.
+
+    Notes
+    -----
+    Uploads of datasets in the same group replace the endpoint of the same
+    GBIF dataset, so they are planned to run one after another, in the order
+    listed. Uploads of different groups are independent of each other.
+
+    Examples
+    --------
+    >>> plan = plan_batch(["edi.1.1", "edi.2.1"], "registrations.csv")
+    >>> print(plan)
+    """
+    registry = _as_registry(registrations_file)
+    plan = Plan(registry)
+    incomplete = set(registry.incomplete())
+    last_upload_of_group = {}
+    for local_dataset_id in dict.fromkeys(local_dataset_ids):
+        record = registry.get(local_dataset_id)
+        if record is None:
+            group_id = _get_local_dataset_group_id(local_dataset_id)
+            gbif_dataset_uuid = registry.gbif_dataset_uuid_of(group_id)
+            synchronized = False
+        else:
+            group_id = record["local_dataset_group_id"]
+            if pd.isna(group_id):
+                group_id = _get_local_dataset_group_id(local_dataset_id)
+            gbif_dataset_uuid = record["gbif_dataset_uuid"]
+            if pd.isna(gbif_dataset_uuid):
+                gbif_dataset_uuid = registry.gbif_dataset_uuid_of(group_id)
+            synchronized = not pd.isna(record["synchronized"]) and bool(
+                record["synchronized"]
+            )
+        # Registering and completing a registration only call GBIF to request
+        # a UUID for a new dataset group, which the group's datasets share.
+        requires = []
+        if record is None or local_dataset_id in incomplete:
+            task = "register" if record is None else "complete"
+            operations = []
+            if gbif_dataset_uuid is None:
+                operations.append(("GBIF", "POST", f"dataset {group_id}", 1))
+            plan._add_task(task, local_dataset_id, group_id, [], operations)
+            requires.append((task, local_dataset_id))
+        if synchronized:
+            continue
+
+        # The operations of upload_dataset. The metadata document is read once
+        # for the synchronization checks and the metadata post, which share
+        # it. Endpoints are only deleted from GBIF datasets that have them.
+        if group_id in last_upload_of_group:
+            requires.append(("upload", last_upload_of_group[group_id]))
+        resource = f"dataset {group_id}"
+        has_endpoint = gbif_dataset_uuid is not None or group_id in last_upload_of_group
+        deletes = 1 if has_endpoint else 0
+        operations = [
+            ("PASTA", "GET", f"metadata {local_dataset_id}", 1),
+            (
+                "GBIF",
+                "GET",
+                f"{resource} synchronization {local_dataset_id}",
+                _MIN_SYNC_CHECKS,
+                _MAX_SYNC_CHECKS,
+            ),
+            ("GBIF", "GET", f"{resource} endpoints {local_dataset_id}", 1),
+            ("GBIF", "DELETE", f"{resource} endpoints {local_dataset_id}", deletes),
+            ("GBIF", "POST", f"{resource} endpoint {local_dataset_id}", 1),
+            ("GBIF", "POST", f"{resource} document {local_dataset_id}", 1),
+        ]
+        plan._add_task("upload", local_dataset_id, group_id, requires, operations)
+        last_upload_of_group[group_id] = local_dataset_id
+    return plan
+
+
+def execute_plan(plan, max_workers=4, dry_run=False, config=None):
+    """Runs a plan made by `plan_batch`.
+
+    Registrations are run first, one at a time, because new dataset groups
+    are assigned GBIF dataset UUIDs as they are registered. The uploads of
+    different dataset groups are then run in parallel, while the uploads of
+    each group are run in order.
+
+    Parameters
+    ----------
+    plan : Plan
+        The plan to run.
+    max_workers : int, optional
+        Maximum number of dataset groups uploaded at a time.
+    dry_run : bool, optional
+        If True, print the plan without running it.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+
+    Returns
+    -------
+    None
+        The registrations file written back to itself as a .csv.
+
+    Notes
+    -----
+    The metadata document of each dataset is read from the EDI repository
+    once, and reused by the metadata post and every synchronization check.
+
+    This function requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> plan = plan_batch(["edi.1.1", "edi.2.1"], "registrations.csv")
+    >>> execute_plan(plan, dry_run=True)  # Preview
+    >>> execute_plan(plan)
+    """
+    print(plan)
+    if dry_run:
+        return None
+    registry = plan.registry
+    for task in plan.tasks:
+        if task["task"] == "register":
+            register_dataset(task["local_dataset_id"], registry, config)
+        elif task["task"] == "complete":
+            complete_registration_records(registry, task["local_dataset_id"], config)
+    chains = {}
+    for task in plan.tasks:
+        if task["task"] == "upload":
+            chains.setdefault(task["local_dataset_group_id"], []).append(
+                task["local_dataset_id"]
+            )
+
+    def upload_chain(local_dataset_ids, buffer):
+        for local_dataset_id in local_dataset_ids:
+            upload_dataset(
+                local_dataset_id, registry, status_buffer=buffer, config=config
+            )
+
+    with _cache_local_dataset_metadata(), _StatusBuffer(registry) as buffer:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(upload_chain, chain, buffer)
+                for chain in chains.values()
+            ]
+            for future in futures:
+                future.result()
+    return None
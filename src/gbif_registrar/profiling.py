@@ -0,0 +1,190 @@
+"""Profile the memory used by registrar operations.
+
+Within a `profile_memory` block, each public operation (`register_dataset`,
+`complete_registration_records`, `upload_dataset`, and
+`validate_registrations`) and each registration check is measured with
+`tracemalloc`: the peak memory allocated while it ran, the memory it left
+allocated, and the lines of code that allocated the most. Outside the block,
+operations run without instrumentation.
+"""
+
+from contextlib import contextmanager
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+# The active profile, while in a profile_memory block.
+_profile = None
+
+
+class MemoryProfile:
+    """The memory measurements of operations run in a `profile_memory` block.
+
+    Attributes
+    ----------
+    records : list of dict
+        One record per operation run, in the order they ended. Each has the
+        keys "operation" (the function name), "peak_bytes" (the peak memory
+        allocated while it ran, above that allocated when it started),
+        "net_bytes" (the memory it left allocated), "seconds", and "top_lines"
+        (the lines of code whose allocations grew the most, each a dict of
+        "file", "line", "size_bytes", and "count").
+    """
+
+    def __init__(self, top=10, hooks=None):
+        self.top = top
+        self.hooks = list(hooks or [])
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def peaks(self):
+        """Returns the largest peak of each operation.
+
+        Returns
+        -------
+        dict
+            The largest `peak_bytes` of each operation, in bytes.
+        """
+        peaks = {}
+        for record in self.records:
+            operation = record["operation"]
+            peaks[operation] = max(peaks.get(operation, 0), record["peak_bytes"])
+        return peaks
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self):
+        """Starts measuring an operation."""
+        current, peak = tracemalloc.get_traced_memory()
+        stack = self._stack()
+        if stack:
+            # The peak is reset for this operation, so keep the peak of the
+            # enclosing operation so far.
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        frame = {
+            "start": current,
+            "peak": current,
+            "snapshot": tracemalloc.take_snapshot() if self.top else None,
+            "time": time.perf_counter(),
+        }
+        stack.append(frame)
+
+    def _exit(self, operation):
+        """Ends the measurement of an operation, and reports it."""
+        current, peak = tracemalloc.get_traced_memory()
+        stack = self._stack()
+        frame = stack.pop()
+        peak = max(frame["peak"], peak)
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        record = {
+            "operation": operation,
+            "peak_bytes": peak - frame["start"],
+            "net_bytes": current - frame["start"],
+            "seconds": time.perf_counter() - frame["time"],
+            "top_lines": [],
+        }
+        if frame["snapshot"] is not None:
+            # The profiler's own allocations are left out.
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            filters.append(tracemalloc.Filter(False, __file__))
+            stats = (
+                tracemalloc.take_snapshot()
+                .filter_traces(filters)
+                .compare_to(frame["snapshot"].filter_traces(filters), "lineno")
+            )
+            for stat in stats[: self.top]:
+                if stat.size_diff <= 0:
+                    break
+                trace = stat.traceback[0]
+                record["top_lines"].append(
+                    {
+                        "file": trace.filename,
+                        "line": trace.lineno,
+                        "size_bytes": stat.size_diff,
+                        "count": stat.count_diff,
+                    }
+                )
+        with self._lock:
+            self.records.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+
+@contextmanager
+def profile_memory(report_file=None, top=10, hooks=None):
+    """Profiles the memory used by registrar operations within a block.
+
+    Parameters
+    ----------
+    report_file : str or pathlike object, optional
+        Path of a JSON file to which the records of the profile are written
+        at the end of the block.
+    top : int, optional
+        The number of top allocating lines reported for each operation. Use 0
+        to skip them, which makes profiling much cheaper.
+    hooks : list of callable, optional
+        Functions called with the record of each operation as it ends, e.g.
+        to log it.
+
+    Yields
+    ------
+    MemoryProfile
+        The profile, whose records are added as operations end.
+
+    Notes
+    -----
+    Profiling slows operations down, and `tracemalloc` only sees memory
+    allocated by Python (including pandas and numpy). The memory of
+    operations run at the same time in several threads is measured
+    together.
+
+    Examples
+    --------
+    >>> with profile_memory("memory.json", hooks=[print]) as profile:
+    ...     validate_registrations("registrations.csv")
+    >>> profile.peaks()
+    """
+    global _profile  # pylint: disable=global-statement
+    if _profile is not None:
+        raise RuntimeError("Memory is already being profiled.")
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _profile = MemoryProfile(top, hooks)
+    try:
+        yield _profile
+    finally:
+        profile = _profile
+        _profile = None
+        if started:
+            tracemalloc.stop()
+        if report_file is not None:
+            with open(report_file, "w", encoding="utf-8") as report:
+                json.dump(profile.records, report, indent=4)
+                report.write("\n")
+
+
+def _profiled(function):
+    """Decorates an operation to be measured within a `profile_memory`
+    block."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = _profile
+        if profile is None:
+            return function(*args, **kwargs)
+        profile._enter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile._exit(function.__name__)
+
+    return wrapper
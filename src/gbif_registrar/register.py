@@ -1,15 +1,16 @@
 """Register datasets with GBIF."""
 
 import os.path
-import tempfile
 import pandas as pd
 from gbif_registrar._utilities import (
     _get_local_dataset_endpoint,
     _expected_cols,
     _get_local_dataset_group_id,
     _get_gbif_dataset_uuid,
-    _read_registrations_file,
 )
+from gbif_registrar.metrics import _increment
+from gbif_registrar.profiling import _profiled
+from gbif_registrar.registry import _as_registry
 
 
 def initialize_registrations_file(file_path):
@@ -64,7 +65,8 @@ def initialize_registrations_file(file_path):
         data.to_csv(file_path, index=False, mode="x")
 
 
-def register_dataset(local_dataset_id, registrations_file):
+@_profiled
+def register_dataset(local_dataset_id, registrations_file, config=None, uuid_pool=None):
     """Registers a local dataset with GBIF and adds it to the registrations
     file.
 
@@ -72,8 +74,16 @@ def register_dataset(local_dataset_id, registrations_file):
     ----------
     local_dataset_id : str
         The local dataset identifier.
-    registrations_file : str
-        The path of the registrations file.
+    registrations_file : str or Registry
+        The path of the registrations file, or a Registry of it.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+    uuid_pool : UuidPool, optional
+        A pool of GBIF dataset UUIDs reserved in advance (see the reservations
+        module). A new dataset group is assigned a UUID from the pool, if it
+        has one, rather than waiting for GBIF to create one.
 
     Returns
     -------
@@ -83,40 +93,31 @@ def register_dataset(local_dataset_id, registrations_file):
     Notes
     -----
     This function requires authentication with GBIF. Use the load_configuration
-    function from the configure module to do this.
+    function from the configure module, or pass a `config`, to do this.
 
     Examples
     --------
     >>> register_dataset("edi.929.2", "registrations.csv")
     """
-    registrations = _read_registrations_file(registrations_file)
+    registry = _as_registry(registrations_file)
     # Return the registrations file "as is" if there is no work to be done
     # (the local_dataset_id is already in the registrations file).
-    if local_dataset_id in set(registrations["local_dataset_id"]):
-        registrations.to_csv(registrations_file, index=False, mode="w")
+    if local_dataset_id in registry:
         return None
     # Initialize a registration record for the local_dataset_id so it can be
-    # added to the registrations dataframe and passed to the
-    # complete_registration_records function to operate on.
+    # added to the registry and passed to the complete_registration_records
+    # function to operate on.
     if local_dataset_id is not None:  # None is invalid and will cause an error
-        new_record = pd.DataFrame(
-            {
-                "local_dataset_id": local_dataset_id,
-                "synchronized": False,
-            },
-            index=[0],
-        )
-        registrations = pd.concat([registrations, new_record], ignore_index=True)
-        # Write the dataframe to file for complete_registration_records.
-        with tempfile.NamedTemporaryFile(suffix=".csv", delete=True) as temp_file:
-            registrations.to_csv(temp_file.name, index=False, mode="w")
-            complete_registration_records(temp_file.name, local_dataset_id)
-            registrations = _read_registrations_file(temp_file.name)
-        registrations.to_csv(registrations_file, index=False, mode="w")
+        registry.add(local_dataset_id, synchronized=False)
+        complete_registration_records(registry, local_dataset_id, config, uuid_pool)
+        _increment("gbif_registrar_datasets_registered_total")
     return None
 
 
-def complete_registration_records(registrations_file, local_dataset_id=None):
+@_profiled
+def complete_registration_records(
+    registrations_file, local_dataset_id=None, config=None, uuid_pool=None
+):
     """Returns a completed set of registration records.
 
     This function can be run to repair one or more dataset registrations that
@@ -125,13 +126,20 @@ def complete_registration_records(registrations_file, local_dataset_id=None):
 
     Parameters
     ----------
-    registrations_file : str
-        The path of the registrations file.
+    registrations_file : str or Registry
+        The path of the registrations file, or a Registry of it.
     local_dataset_id : str, optional
         The dataset identifier in the EDI repository. If provided, only the
         registration record for the specified `local_dataset_id` will be
         completed. If not provided, all registration records with incomplete
         information will be repaired.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+    uuid_pool : UuidPool, optional
+        A pool of GBIF dataset UUIDs reserved in advance, to assign to new
+        dataset groups. See `register_dataset`.
 
     Returns
     -------
@@ -141,7 +149,7 @@ def complete_registration_records(registrations_file, local_dataset_id=None):
     Notes
     -----
     This function requires authentication with GBIF. Use the load_configuration
-    function from the configure module to do this.
+    function from the configure module, or pass a `config`, to do this.
 
     Examples
     --------
@@ -150,43 +158,45 @@ def complete_registration_records(registrations_file, local_dataset_id=None):
     >>> # Repair the registration record for a specific dataset.
     >>> complete_registration_records("registrations.csv", "edi.929.2")
     """
-    registrations = _read_registrations_file(registrations_file)
+    registry = _as_registry(registrations_file)
     # Identify incomplete records to fix.
-    record = registrations[
-        (registrations["local_dataset_group_id"].isna())
-        | (registrations["local_dataset_endpoint"].isna())
-        | (registrations["gbif_dataset_uuid"].isna())
-    ]
-    # Return the registrations dataframe "as is" if there's nothing to fix.
-    if record.empty:
-        return None
+    incomplete = registry.incomplete()
     # Narrow down the list of records to fix if specified by the user.
     if local_dataset_id is not None:
-        if local_dataset_id not in set(record["local_dataset_id"]):
+        if local_dataset_id not in incomplete:
             return None
-        record = record[record["local_dataset_id"] == local_dataset_id]
+        incomplete = [local_dataset_id]
     # Iterate through incomplete records to fix.
-    for index, row in record.iterrows():
+    for incomplete_id in incomplete:
+        record = registry.get(incomplete_id)
         # Fix the record's local_dataset_group_id.
-        if pd.isna(row["local_dataset_group_id"]):
+        if pd.isna(record["local_dataset_group_id"]):
             local_dataset_group_id = _get_local_dataset_group_id(
-                local_dataset_id=row["local_dataset_id"]
+                local_dataset_id=incomplete_id
+            )
+            registry.update(
+                incomplete_id, local_dataset_group_id=local_dataset_group_id
             )
-            registrations.loc[index, "local_dataset_group_id"] = local_dataset_group_id
         # Fix the record's local_dataset_endpoint.
-        if pd.isna(row["local_dataset_endpoint"]):
+        if pd.isna(record["local_dataset_endpoint"]):
             local_dataset_endpoint = _get_local_dataset_endpoint(
-                local_dataset_id=row["local_dataset_id"]
+                local_dataset_id=incomplete_id, config=config
+            )
+            registry.update(
+                incomplete_id, local_dataset_endpoint=local_dataset_endpoint
             )
-            registrations.loc[index, "local_dataset_endpoint"] = local_dataset_endpoint
         # Fix the record's gbif_dataset_uuid.
-        if pd.isna(row["gbif_dataset_uuid"]):
+        if pd.isna(record["gbif_dataset_uuid"]):
             gbif_dataset_uuid = _get_gbif_dataset_uuid(
-                local_dataset_group_id=registrations.loc[
-                    index, "local_dataset_group_id"
+                local_dataset_group_id=registry.get(incomplete_id)[
+                    "local_dataset_group_id"
                 ],
-                registrations=registrations,
+                registrations=registry,
+                config=config,
+                uuid_pool=uuid_pool,
             )
-            registrations.loc[index, "gbif_dataset_uuid"] = gbif_dataset_uuid
-    registrations.to_csv(registrations_file, index=False, mode="w")
+            registry.update(incomplete_id, gbif_dataset_uuid=gbif_dataset_uuid)
+    # Write only the completed records to the registrations file, preserving
+    # any changes made to it by other processes in the meantime.
+    registry.save()
     return None
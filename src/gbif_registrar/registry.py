@@ -0,0 +1,355 @@
+"""Work with the dataset registrations in memory."""
+
+import os
+import pandas as pd
+from gbif_registrar._utilities import (
+    _expected_cols,
+    _parse_local_dataset_ids,
+    _partition_key,
+    _read_manifest,
+    _read_registrations_file,
+    _update_registrations_file,
+)
+
+
+class Registry:
+    """The dataset registrations, loaded into memory once and indexed for
+    fast lookup and update.
+
+    Every public function that accepts the path of a registrations file also
+    accepts a Registry in its place. Passing the same Registry to a series of
+    calls avoids reading and parsing the registrations file in each of them.
+
+    Parameters
+    ----------
+    registrations : pandas.DataFrame
+        A dataframe of the registrations file.
+    registrations_file : str or pathlike object, optional
+        Path of the registrations file the registrations were read from.
+        Changes are written back to it by `save`. If not provided, the
+        registry is kept in memory only.
+    engine : str, optional
+        The parser engine used by `reload`. See `load`.
+    partitions : list of str, optional
+        The partitions of a partitioned registrations directory read by
+        `reload`. See `load`.
+
+    Notes
+    -----
+    Lookups by `local_dataset_id` and `local_dataset_group_id` use dict
+    indexes, and take constant time regardless of the number of
+    registrations.
+
+    Changes made by other processes to the registrations file after it is
+    loaded are not seen by the registry. They are, however, preserved by
+    `save`, which only writes the rows changed through the registry.
+
+    Examples
+    --------
+    >>> registry = Registry.load("registrations.csv")
+    >>> register_dataset("edi.929.2", registry)
+    >>> upload_dataset("edi.929.2", registry)
+    """
+
+    def __init__(
+        self, registrations, registrations_file=None, engine=None, partitions=None
+    ):
+        self.registrations_file = registrations_file
+        self.engine = engine
+        self.partitions = partitions
+        self._index(registrations)
+
+    def _index(self, registrations):
+        """Sets the registrations and builds their indexes."""
+        self._data = registrations.reset_index(drop=True)
+        self._dirty = set()
+        self._parsed_ids = None
+        self._ids = {}
+        self._groups = {}
+        for label, local_dataset_id in enumerate(self._data["local_dataset_id"]):
+            if not pd.isna(local_dataset_id):
+                self._ids.setdefault(local_dataset_id, label)
+        for label, group_id in enumerate(self._data["local_dataset_group_id"]):
+            if not pd.isna(group_id):
+                self._groups.setdefault(group_id, []).append(label)
+
+    @classmethod
+    def load(cls, registrations_file, engine=None, local_dataset_ids=None):
+        """Reads a registrations file into a Registry.
+
+        Parameters
+        ----------
+        registrations_file : str or pathlike object
+            Path of the registrations file, or of a partitioned registrations
+            directory (see the partitions module).
+        engine : str, optional
+            The parser engine, used by `load` and `reload`. Use "pyarrow" to
+            parse large files with several threads. This requires the optional
+            pyarrow package. Defaults to the C engine of pandas.
+        local_dataset_ids : list of str, optional
+            The datasets to be worked on, if `registrations_file` is a
+            partitioned directory. Only the partitions holding them are read,
+            and `save` only rewrites those partitions. Defaults to all
+            partitions. Ignored for a registrations file.
+
+        Returns
+        -------
+        Registry
+
+        Examples
+        --------
+        >>> registry = Registry.load("registrations", local_dataset_ids=["edi.1.1"])
+        """
+        partitions = None
+        if local_dataset_ids is not None and os.path.isdir(registrations_file):
+            manifest = _read_manifest(registrations_file)
+            partitions = sorted(
+                {_partition_key(i, manifest) for i in local_dataset_ids}
+            )
+        registrations = _read_registrations_file(
+            registrations_file, engine=engine, partitions=partitions
+        )
+        return cls(registrations, registrations_file, engine, partitions)
+
+    def reload(self):
+        """Re-reads the registrations file, e.g. after another process changed
+        it. Changes not yet written with `save` are discarded.
+
+        Returns
+        -------
+        None
+        """
+        if self.registrations_file is not None:
+            self._index(
+                _read_registrations_file(
+                    self.registrations_file,
+                    engine=self.engine,
+                    partitions=self.partitions,
+                )
+            )
+        return None
+
+    @property
+    def data(self):
+        """pandas.DataFrame : The registrations. Treat this as read-only, and
+        make changes with `add` and `update`."""
+        return self._data
+
+    @property
+    def parsed_ids(self):
+        """pandas.DataFrame : The `local_dataset_id` of each registration,
+        split into its scope, identifier, revision, and group, with a "valid"
+        mask of the ones that have the `scope.identifier.revision` format.
+        Parsed once, when first used, by `_parse_local_dataset_ids`."""
+        if self._parsed_ids is None:
+            self._parsed_ids = _parse_local_dataset_ids(self._data["local_dataset_id"])
+        return self._parsed_ids
+
+    def __contains__(self, local_dataset_id):
+        return local_dataset_id in self._ids
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, local_dataset_id):
+        """Returns the registration of a dataset.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The dataset identifier in the EDI repository.
+
+        Returns
+        -------
+        dict or None
+            The registration, keyed by column name, or None if the dataset
+            isn't registered.
+        """
+        label = self._ids.get(local_dataset_id)
+        if label is None:
+            return None
+        return self._data.loc[label].to_dict()
+
+    def group(self, local_dataset_group_id):
+        """Returns the registrations of a dataset group.
+
+        Parameters
+        ----------
+        local_dataset_group_id : str
+            The dataset group identifier in the EDI repository.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The registrations of the group, in file order. Empty if the group
+            has no registrations.
+        """
+        return self._data.loc[self._groups.get(local_dataset_group_id, [])]
+
+    def gbif_dataset_uuid_of(self, local_dataset_group_id):
+        """Returns the GBIF dataset UUID of a dataset group.
+
+        Parameters
+        ----------
+        local_dataset_group_id : str
+            The dataset group identifier in the EDI repository.
+
+        Returns
+        -------
+        str or None
+            The first `gbif_dataset_uuid` registered for the group, or None if
+            there is none.
+        """
+        for label in self._groups.get(local_dataset_group_id, []):
+            gbif_dataset_uuid = self._data.at[label, "gbif_dataset_uuid"]
+            if not pd.isna(gbif_dataset_uuid):
+                return gbif_dataset_uuid
+        return None
+
+    def incomplete(self):
+        """Returns the datasets with incomplete registrations.
+
+        Returns
+        -------
+        list of str
+            The `local_dataset_id` of each registration missing a
+            `local_dataset_group_id`, `local_dataset_endpoint`, or
+            `gbif_dataset_uuid`, in file order.
+        """
+        cols = ["local_dataset_group_id", "local_dataset_endpoint", "gbif_dataset_uuid"]
+        incomplete = self._data[cols].isna().any(axis=1)
+        return self._data.loc[incomplete, "local_dataset_id"].tolist()
+
+    def add(self, local_dataset_id, **values):
+        """Adds a registration.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The dataset identifier in the EDI repository.
+        **values
+            Values of the other registration columns. Columns not listed are
+            left empty.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If the dataset is already registered.
+        """
+        if local_dataset_id in self._ids:
+            raise ValueError(f"{local_dataset_id} is already registered.")
+        record = pd.DataFrame({"local_dataset_id": local_dataset_id, **values}, [0])
+        self._data = pd.concat([self._data, record], ignore_index=True)
+        self._parsed_ids = None
+        label = len(self._data) - 1
+        self._ids[local_dataset_id] = label
+        group_id = values.get("local_dataset_group_id")
+        if group_id is not None and not pd.isna(group_id):
+            self._groups.setdefault(group_id, []).append(label)
+        self._dirty.add(label)
+
+    def update(self, local_dataset_id, /, **values):
+        """Updates the registration of a dataset.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The dataset identifier in the EDI repository.
+        **values
+            New values of registration columns, e.g. `synchronized=True`.
+            The `local_dataset_id` itself can't be changed.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        KeyError
+            If the dataset isn't registered.
+        ValueError
+            If a new `local_dataset_id` is given. Saved rows are matched to the
+            registrations file by `local_dataset_id`, so a changed one would
+            be written as a new registration. Add the new dataset instead.
+        """
+        label = self._ids[local_dataset_id]
+        if values.get("local_dataset_id", local_dataset_id) != local_dataset_id:
+            raise ValueError(
+                f"The local_dataset_id of {local_dataset_id} can't change."
+            )
+        if "local_dataset_group_id" in values:
+            old_group_id = self._data.at[label, "local_dataset_group_id"]
+            if not pd.isna(old_group_id):
+                self._groups[old_group_id].remove(label)
+            new_group_id = values["local_dataset_group_id"]
+            if new_group_id is not None and not pd.isna(new_group_id):
+                self._groups.setdefault(new_group_id, []).append(label)
+                self._groups[new_group_id].sort()
+        for col, value in values.items():
+            self._data.loc[label, col] = value
+        self._dirty.add(label)
+
+    def merge(self, records):
+        """Updates or adds registrations from a dataframe of records.
+
+        Parameters
+        ----------
+        records : pandas.DataFrame
+            Registration records with a `local_dataset_id` column and any of
+            the other registration columns. Records of registered datasets
+            update them. Other records are added.
+
+        Returns
+        -------
+        None
+        """
+        for record in records.to_dict("records"):
+            local_dataset_id = record.pop("local_dataset_id")
+            if local_dataset_id in self._ids:
+                self.update(local_dataset_id, **record)
+            else:
+                self.add(local_dataset_id, **record)
+
+    def save(self):
+        """Writes changed registrations to the registrations file.
+
+        Only rows added or updated since the last save are written, and they
+        are merged into the current contents of the file, so concurrent
+        changes by other processes are preserved. Does nothing if the
+        registry has no registrations file.
+
+        Returns
+        -------
+        None
+        """
+        if self.registrations_file is None or not self._dirty:
+            return None
+        records = self._data.loc[sorted(self._dirty), _expected_cols()]
+        _update_registrations_file(self.registrations_file, records)
+        self._dirty = set()
+        return None
+
+
+def _as_registry(registrations):
+    """Returns registrations as a Registry.
+
+    Parameters
+    ----------
+    registrations : str, pathlike object, or Registry
+        Path of the registrations file, or a Registry. A RegistrySnapshot is
+        also accepted, by functions that only look up registrations and set
+        their synchronization status.
+
+    Returns
+    -------
+    Registry
+        The Registry (or RegistrySnapshot) itself, or a Registry loaded from
+        the file.
+    """
+    if isinstance(registrations, (str, os.PathLike)):
+        return Registry.load(os.fspath(registrations))
+    return registrations
@@ -0,0 +1,244 @@
+"""Reserve GBIF dataset UUIDs for new dataset groups in advance."""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+from gbif_registrar._locking import _file_lock, _lock_path
+from gbif_registrar._utilities import _delete_gbif_dataset, _request_gbif_dataset_uuid
+from gbif_registrar.configure import _resolve_config
+
+
+class UuidPool:
+    """A pool of GBIF dataset UUIDs, created before they are needed.
+
+    Registering the first dataset of a new dataset group creates a GBIF
+    dataset for the group, which takes a round trip to GBIF. A pool creates
+    these datasets ahead of time, in the background, and hands out their
+    UUIDs instantly when groups are registered. Pass the pool to
+    `register_dataset` or `complete_registration_records` as `uuid_pool`.
+
+    The unassigned UUIDs are kept in a file, so they survive restarts and can
+    be shared by processes on the same node.
+
+    Parameters
+    ----------
+    pool_file : str or pathlike object
+        Path of the file of unassigned UUIDs. It is created if it doesn't
+        exist.
+    depth : int, optional
+        The number of unassigned UUIDs the pool is kept filled to.
+    max_age : float, optional
+        Seconds after which an unassigned UUID is deleted from GBIF by `reap`.
+        If not provided, reservations are kept until reaped explicitly.
+    interval : float, optional
+        Seconds between checks of the background filler, when it isn't woken
+        by a UUID being taken.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+
+    Raises
+    ------
+    ValueError
+        If the pool file holds UUIDs of another GBIF environment.
+
+    Notes
+    -----
+    A reservation is a GBIF dataset with a placeholder title, like the one
+    created when a group is registered without a pool. Its metadata is
+    written by the first upload of the group.
+
+    This class requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> with UuidPool("uuid_pool.json", depth=20) as pool:
+    ...     for local_dataset_id in new_datasets:
+    ...         register_dataset(local_dataset_id, registry, uuid_pool=pool)
+    >>> UuidPool("uuid_pool.json").reap(max_age=0)  # Delete all reservations
+    """
+
+    def __init__(self, pool_file, depth=10, max_age=None, interval=60.0, config=None):
+        self.pool_file = os.fspath(pool_file)
+        self.depth = depth
+        self.max_age = max_age
+        self.interval = interval
+        self.config = _resolve_config(config)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        with self._locked():
+            self._read()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __len__(self):
+        with self._locked():
+            return len(self._read())
+
+    def take(self):
+        """Takes an unassigned UUID from the pool.
+
+        Returns
+        -------
+        str or None
+            The UUID, or None if the pool is empty. The background filler, if
+            running, is woken to replace it.
+        """
+        with self._locked():
+            reservations = self._read()
+            if not reservations:
+                return None
+            reservation = reservations.pop(0)
+            self._write(reservations)
+        self._wake.set()
+        return reservation["gbif_dataset_uuid"]
+
+    def fill(self):
+        """Creates GBIF datasets until the pool holds `depth` UUIDs.
+
+        Returns
+        -------
+        int
+            The number of UUIDs added. This is fewer than needed if GBIF
+            failed to create a dataset.
+        """
+        added = 0
+        while not self._stop.is_set():
+            with self._locked():
+                if len(self._read()) >= self.depth:
+                    return added
+            # The request is made outside the lock, so takes aren't blocked.
+            try:
+                gbif_dataset_uuid = _request_gbif_dataset_uuid(self.config)
+            except requests.exceptions.RequestException as error:
+                print(f"Failed to create a GBIF dataset: {error}")
+                return added
+            with self._locked():
+                reservations = self._read()
+                reservations.append(
+                    {"gbif_dataset_uuid": gbif_dataset_uuid, "created": time.time()}
+                )
+                self._write(reservations)
+            added += 1
+        return added
+
+    def reap(self, max_age=None):
+        """Deletes unassigned UUIDs older than `max_age` from GBIF.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            Age in seconds. Use 0 to delete all unassigned UUIDs, e.g. when
+            the pool is no longer needed. Defaults to the `max_age` of the
+            pool.
+
+        Returns
+        -------
+        list of str
+            The UUIDs deleted. UUIDs that GBIF failed to delete are kept in
+            the pool, to be reaped later.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is None:
+            return []
+        cutoff = time.time() - max_age
+        with self._locked():
+            reservations = self._read()
+            expired = [r for r in reservations if r["created"] <= cutoff]
+            self._write([r for r in reservations if r["created"] > cutoff])
+        deleted = []
+        failed = []
+        for reservation in expired:
+            try:
+                _delete_gbif_dataset(reservation["gbif_dataset_uuid"], self.config)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                print(f"Failed to delete {reservation['gbif_dataset_uuid']}: {error}")
+                failed.append(reservation)
+            else:
+                deleted.append(reservation["gbif_dataset_uuid"])
+        if failed:
+            with self._locked():
+                self._write(failed + self._read())
+        return deleted
+
+    def start(self):
+        """Starts filling and reaping the pool in a background thread.
+
+        Returns
+        -------
+        None
+        """
+        if self._thread is not None:
+            return None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return None
+
+    def stop(self):
+        """Stops the background thread, after its current request.
+
+        Returns
+        -------
+        None
+        """
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        return None
+
+    def _run(self):
+        """Keeps the pool filled, and reaped, until stopped."""
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.reap()
+                self.fill()
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                print(f"Failed to fill the UUID pool: {error!r}")
+            self._wake.wait(self.interval)
+
+    def _locked(self):
+        """Returns a lock on the pool file, for this and other processes."""
+        return _file_lock(_lock_path(self.pool_file))
+
+    def _read(self):
+        """Returns the unassigned reservations, oldest first. Call with the
+        pool locked."""
+        if not os.path.exists(self.pool_file):
+            return []
+        with open(self.pool_file, "r", encoding="utf-8") as pool:
+            contents = json.load(pool)
+        if contents["gbif_api"] != self.config.gbif_api:
+            raise ValueError(
+                f"{self.pool_file} holds UUIDs of {contents['gbif_api']}, not "
+                f"{self.config.gbif_api}."
+            )
+        return contents["reservations"]
+
+    def _write(self, reservations):
+        """Replaces the reservations in the pool file atomically. Call with
+        the pool locked."""
+        contents = {"gbif_api": self.config.gbif_api, "reservations": reservations}
+        directory = os.path.dirname(os.path.abspath(self.pool_file))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8"
+        ) as tmp:
+            json.dump(contents, tmp, indent=4)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp.name, self.pool_file)
@@ -0,0 +1,330 @@
+"""Share a read-only snapshot of the registrations with worker processes.
+
+A process pool that uploads datasets in parallel would otherwise have each
+worker read and parse the whole registrations file to look up its datasets.
+Instead, the parent publishes a columnar snapshot of the registrations to a
+file once, and each worker memory-maps it. Lookups read the mapped pages
+directly, so a worker starts in constant time and the pages are shared
+between workers by the operating system, however large the registry grows.
+
+Workers don't write the registrations file. Changes they make through a
+`RegistrySnapshot` are sent to the parent on a queue, and applied to the
+registrations with `apply_status_changes`.
+"""
+
+from array import array
+import json
+import mmap
+import os
+import queue
+import struct
+import tempfile
+import pandas as pd
+from gbif_registrar._utilities import _expected_cols
+from gbif_registrar.registry import _as_registry
+
+_MAGIC = b"GBRSNAP1"
+
+# The string columns of the snapshot. The synchronized column is stored
+# separately, as one byte per registration.
+_STRING_COLS = [col for col in _expected_cols() if col != "synchronized"]
+
+# Byte values of the synchronized column.
+_SYNCHRONIZED = {None: 0, False: 1, True: 2}
+
+
+def publish_snapshot(registrations_file, snapshot_file):
+    """Writes a snapshot of the registrations, to be opened by worker
+    processes as a `RegistrySnapshot`.
+
+    Parameters
+    ----------
+    registrations_file : str, pathlike object, or Registry
+        Path of the registrations file, or a Registry of it.
+    snapshot_file : str or pathlike object
+        Path of the snapshot file. It is replaced atomically, so workers
+        never open a partially written snapshot.
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    Each string column is stored like an Arrow string array: the UTF-8 bytes
+    of all values, one after another, and the offset of each value in them.
+    The row numbers of the registrations, sorted by `local_dataset_id`, are
+    stored as an index, so a dataset is found by binary search without
+    building a dict in each worker.
+
+    Examples
+    --------
+    >>> publish_snapshot("registrations.csv", "registrations.snapshot")
+    """
+    registrations = _as_registry(registrations_file).data
+    buffers = []
+    layout = {"rows": len(registrations), "columns": {}}
+    for col in _STRING_COLS:
+        values = [
+            None if pd.isna(value) else str(value).encode("utf-8")
+            for value in registrations[col]
+        ]
+        offsets = array("q", [0])
+        for value in values:
+            offsets.append(offsets[-1] + (0 if value is None else len(value)))
+        valid = bytes(value is not None for value in values)
+        layout["columns"][col] = {
+            "offsets": len(buffers),
+            "data": len(buffers) + 1,
+            "valid": len(buffers) + 2,
+        }
+        buffers += [offsets.tobytes(), b"".join(v or b"" for v in values), valid]
+        if col == "local_dataset_id":
+            # Python orders strings by code point, as UTF-8 orders bytes. The
+            # sort is stable, so the first of duplicated ids comes first.
+            rows = [row for row, value in enumerate(values) if value is not None]
+            rows.sort(key=values.__getitem__)
+            layout["index"] = len(buffers)
+            buffers.append(array("q", rows).tobytes())
+    layout["synchronized"] = len(buffers)
+    buffers.append(
+        bytes(
+            _SYNCHRONIZED[None if pd.isna(value) else bool(value)]
+            for value in registrations["synchronized"]
+        )
+    )
+    _write_snapshot(snapshot_file, layout, buffers)
+    return None
+
+
+def _write_snapshot(snapshot_file, layout, buffers):
+    """Writes the layout and buffers of a snapshot atomically.
+
+    The file is the magic bytes, the length of the layout, the layout as
+    JSON, and the buffers, each aligned to 8 bytes. Buffer positions are
+    relative to the end of the layout."""
+    layout["buffers"] = []
+    position = 0
+    for buffer in buffers:
+        layout["buffers"].append([position, len(buffer)])
+        position = _align(position + len(buffer))
+    header = json.dumps(layout).encode("utf-8")
+    header = _MAGIC + struct.pack("<Q", len(header)) + header
+    directory = os.path.dirname(os.path.abspath(snapshot_file))
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=directory, suffix=".tmp", delete=False
+    ) as tmp:
+        tmp.write(header.ljust(_align(len(header)), b"\0"))
+        for buffer in buffers:
+            tmp.write(buffer.ljust(_align(len(buffer)), b"\0"))
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(tmp.name, snapshot_file)
+
+
+def _align(position):
+    """Rounds a position up to a multiple of 8 bytes."""
+    return -(-position // 8) * 8
+
+
+class RegistrySnapshot:
+    """A read-only view of a snapshot written by `publish_snapshot`.
+
+    The snapshot can be passed in place of a Registry to `upload_dataset`,
+    which only looks up registrations and sets their synchronization status.
+    Changes made with `update` are seen by later lookups in this process, and
+    sent to the parent process on `status_queue`.
+
+    Parameters
+    ----------
+    snapshot_file : str or pathlike object
+        Path of the snapshot file.
+    status_queue : multiprocessing.Queue, optional
+        A queue on which changes are sent as (local_dataset_id, values)
+        tuples. If not provided, changes are only seen in this process.
+
+    Raises
+    ------
+    ValueError
+        If the file isn't a registry snapshot.
+
+    Examples
+    --------
+    >>> # In a worker process
+    >>> snapshot = RegistrySnapshot("registrations.snapshot", status_queue)
+    >>> upload_dataset("edi.929.2", snapshot)
+    >>> # In the parent process
+    >>> apply_status_changes(status_queue, "registrations.csv")
+    """
+
+    def __init__(self, snapshot_file, status_queue=None):
+        self.snapshot_file = os.fspath(snapshot_file)
+        self.status_queue = status_queue
+        self._changes = {}
+        with open(self.snapshot_file, "rb") as snapshot:
+            self._mmap = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(_MAGIC)] != _MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{self.snapshot_file} is not a registry snapshot.")
+        start = len(_MAGIC) + 8
+        (length,) = struct.unpack("<Q", self._mmap[len(_MAGIC) : start])
+        layout = json.loads(self._mmap[start : start + length])
+        start = _align(start + length)
+        # Views are released in reverse, before the map is closed.
+        self._views = [memoryview(self._mmap)]
+        for position, length in layout["buffers"]:
+            position += start
+            self._views.append(self._views[0][position : position + length])
+        buffers = self._views[1:]
+        self._rows = layout["rows"]
+        self._columns = {}
+        for col, positions in layout["columns"].items():
+            self._views.append(buffers[positions["offsets"]].cast("q"))
+            self._columns[col] = (
+                self._views[-1],
+                buffers[positions["data"]],
+                buffers[positions["valid"]],
+            )
+        self._views.append(buffers[layout["index"]].cast("q"))
+        self._index = self._views[-1]
+        self._synchronized = buffers[layout["synchronized"]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, local_dataset_id):
+        return self._row_of(local_dataset_id) is not None
+
+    def __len__(self):
+        return self._rows
+
+    def close(self):
+        """Unmaps the snapshot.
+
+        Returns
+        -------
+        None
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+        return None
+
+    def get(self, local_dataset_id):
+        """Returns the registration of a dataset.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The dataset identifier in the EDI repository.
+
+        Returns
+        -------
+        dict or None
+            The registration, keyed by column name, or None if the dataset
+            isn't registered. Missing values are None.
+        """
+        row = self._row_of(local_dataset_id)
+        if row is None:
+            return None
+        record = {col: self._value(col, row) for col in _STRING_COLS}
+        synchronized = self._synchronized[row]
+        record["synchronized"] = None if synchronized == 0 else synchronized == 2
+        record.update(self._changes.get(local_dataset_id, {}))
+        return record
+
+    def update(self, local_dataset_id, **values):
+        """Changes the registration of a dataset in this process, and sends
+        the change to the parent process.
+
+        Parameters
+        ----------
+        local_dataset_id : str
+            The dataset identifier in the EDI repository.
+        **values
+            New values of registration columns, e.g. `synchronized=True`.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        KeyError
+            If the dataset isn't registered.
+        """
+        if local_dataset_id not in self:
+            raise KeyError(local_dataset_id)
+        self._changes.setdefault(local_dataset_id, {}).update(values)
+        if self.status_queue is not None:
+            self.status_queue.put((local_dataset_id, values))
+
+    def save(self):
+        """Does nothing, as changes are written by the parent process. This
+        lets a snapshot be used in place of a Registry.
+
+        Returns
+        -------
+        None
+        """
+        return None
+
+    def _value(self, col, row):
+        """Returns the value of a column of a row, or None if missing."""
+        offsets, data, valid = self._columns[col]
+        if not valid[row]:
+            return None
+        return str(data[offsets[row] : offsets[row + 1]], "utf-8")
+
+    def _row_of(self, local_dataset_id):
+        """Returns the row of a dataset, found by binary search of the
+        index, or None if it isn't registered."""
+        key = local_dataset_id.encode("utf-8")
+        offsets, data, _ = self._columns["local_dataset_id"]
+        low, high = 0, len(self._index)
+        while low < high:
+            middle = (low + high) // 2
+            row = self._index[middle]
+            if data[offsets[row] : offsets[row + 1]].tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._index):
+            row = self._index[low]
+            if data[offsets[row] : offsets[row + 1]] == key:
+                return row
+        return None
+
+
+def apply_status_changes(status_queue, registrations_file):
+    """Applies the changes sent by worker processes to the registrations.
+
+    Parameters
+    ----------
+    status_queue : multiprocessing.Queue
+        The queue given to the workers' `RegistrySnapshot`.
+    registrations_file : str, pathlike object, or Registry
+        Path of the registrations file, or a Registry of it. The changed rows
+        are written to the file.
+
+    Returns
+    -------
+    int
+        The number of changes applied. Changes not yet sent by the workers
+        are left on the queue.
+    """
+    registry = _as_registry(registrations_file)
+    applied = 0
+    while True:
+        try:
+            local_dataset_id, values = status_queue.get_nowait()
+        except queue.Empty:
+            break
+        registry.update(local_dataset_id, **values)
+        applied += 1
+    if applied:
+        registry.save()
+    return applied
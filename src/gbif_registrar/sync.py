@@ -0,0 +1,200 @@
+"""Synchronize GBIF with new datasets in the EDI repository."""
+
+import json
+import os
+import tempfile
+import pandas as pd
+from gbif_registrar._utilities import _get_changed_local_datasets
+from gbif_registrar.batch import upload_datasets
+from gbif_registrar.configure import _resolve_config
+from gbif_registrar.register import register_dataset
+from gbif_registrar.registry import _as_registry
+
+
+def sync_from_source(
+    registrations_file,
+    scopes=None,
+    since=None,
+    watermark_file=None,
+    journal_file=None,
+    config=None,
+):
+    """Registers and uploads the datasets created or revised in the EDI
+    repository since the last sync.
+
+    The EDI repository (PASTA) is asked for the datasets of each scope that
+    changed since the scope's high-water mark: the date of the latest change
+    seen by the previous sync. Datasets already in the registrations file are
+    not registered again, and the rest are registered and uploaded as a batch,
+    with the listed datasets that are registered but not yet synchronized. The
+    high-water marks are then advanced, so the next sync only lists newer
+    changes.
+
+    Parameters
+    ----------
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it.
+    scopes : list of str, optional
+        The scopes to sync, e.g. ["edi", "knb-lter-msp"]. Defaults to the
+        comma separated scopes of the PASTA_SCOPES configuration key.
+    since : str, optional
+        The date and time, in ISO 8601 format (e.g. "2023-06-01T00:00:00"),
+        from which to list the changes of scopes that have no high-water mark
+        yet, i.e. on the first sync of a scope.
+    watermark_file : str, optional
+        Path of the file in which the high-water marks are stored. Defaults to
+        the path of the registrations file with the suffix ".watermark".
+    journal_file : str, optional
+        Path of a journal file for the batch upload. See `upload_datasets` in
+        the batch module.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
+
+    Returns
+    -------
+    list of str
+        The `local_dataset_id` of each dataset registered, in order of
+        change.
+
+    Raises
+    ------
+    ValueError
+        If there are no scopes, or a scope has no high-water mark and `since`
+        is not provided, or there is no `watermark_file` and the registrations
+        are not from a file.
+    requests.HTTPError
+        If the changes of a scope can't be listed. The high-water marks are
+        left as they were.
+
+    Notes
+    -----
+    The high-water marks are only advanced when every listed dataset has been
+    registered and its upload attempted, and only up to the first change of
+    each scope whose dataset isn't synchronized afterwards. If the sync fails
+    part way, or an upload times out, the next sync lists the same changes
+    again, and uploads the datasets registered in the meantime that aren't
+    synchronized, rather than registering them again.
+
+    This function requires authentication with GBIF. Use the load_configuration
+    function from the configure module, or pass a `config`, to do this.
+
+    Examples
+    --------
+    >>> # The first sync of a scope requires a starting date.
+    >>> sync_from_source("registrations.csv", ["edi"], since="2023-06-01T00:00:00")
+    >>> # Later syncs continue from the high-water mark.
+    >>> sync_from_source("registrations.csv", ["edi"])
+    """
+    registry = _as_registry(registrations_file)
+    config = _resolve_config(config)
+    if scopes is None:
+        scopes = config.options.get("PASTA_SCOPES", "").split(",")
+        scopes = [scope.strip() for scope in scopes]
+        scopes = [scope for scope in scopes if scope]
+    if not scopes:
+        raise ValueError("No scopes to sync. Pass scopes or configure PASTA_SCOPES.")
+    if watermark_file is None:
+        if registry.registrations_file is None:
+            raise ValueError("A watermark_file is required for an in-memory Registry.")
+        watermark_file = os.fspath(registry.registrations_file) + ".watermark"
+    watermarks = _read_watermarks(watermark_file)
+
+    # List the changes of each scope, and keep the datasets that aren't
+    # registered, or whose upload didn't synchronize them.
+    new_ids = []
+    upload_ids = {}
+    changes_of_scope = {}
+    for scope in scopes:
+        from_date = watermarks.get(scope, since)
+        if from_date is None:
+            raise ValueError(
+                f"No high-water mark for scope {scope}. Pass since to start from."
+            )
+        changes = _get_changed_local_datasets(scope, from_date, config)
+        changes_of_scope[scope] = (from_date, changes)
+        for local_dataset_id, _ in changes:
+            if local_dataset_id in upload_ids:
+                continue
+            if local_dataset_id not in registry:
+                new_ids.append(local_dataset_id)
+            elif _is_synchronized_in(registry, local_dataset_id):
+                continue
+            upload_ids[local_dataset_id] = None
+    print(
+        f"Found {len(new_ids)} new and {len(upload_ids) - len(new_ids)} "
+        f"unsynchronized datasets in scopes {', '.join(scopes)}."
+    )
+
+    for local_dataset_id in new_ids:
+        register_dataset(local_dataset_id, registry, config)
+    upload_datasets(list(upload_ids), registry, journal_file, config=config)
+
+    # Each high-water mark is advanced to the latest change of its scope, or
+    # only up to the first change whose dataset isn't synchronized, so the
+    # next sync lists it again.
+    for scope, (from_date, changes) in changes_of_scope.items():
+        watermark = max([from_date] + [date for _, date in changes])
+        for local_dataset_id, date in changes:
+            if not _is_synchronized_in(registry, local_dataset_id):
+                watermark = date
+                break
+        watermarks[scope] = watermark
+    _write_watermarks(watermarks, watermark_file)
+    return new_ids
+
+
+def _is_synchronized_in(registry, local_dataset_id):
+    """Returns True if a dataset is registered and synchronized with GBIF."""
+    record = registry.get(local_dataset_id)
+    if record is None:
+        return False
+    return not pd.isna(record["synchronized"]) and bool(record["synchronized"])
+
+
+def _read_watermarks(watermark_file):
+    """Reads the high-water marks of a sync.
+
+    Parameters
+    ----------
+    watermark_file : str
+        Path of the watermark file.
+
+    Returns
+    -------
+    dict
+        The high-water mark of each scope. Empty if the file doesn't exist.
+    """
+    if not os.path.exists(watermark_file):
+        return {}
+    with open(watermark_file, "r", encoding="utf-8") as watermarks:
+        return json.load(watermarks)
+
+
+def _write_watermarks(watermarks, watermark_file):
+    """Writes the high-water marks of a sync.
+
+    The file is replaced atomically, so an interrupted write leaves the
+    previous high-water marks in place.
+
+    Parameters
+    ----------
+    watermarks : dict
+        The high-water mark of each scope.
+    watermark_file : str
+        Path of the watermark file.
+
+    Returns
+    -------
+    None
+    """
+    directory = os.path.dirname(os.path.abspath(watermark_file))
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8"
+    ) as tmp:
+        json.dump(watermarks, tmp, indent=4, sort_keys=True)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(tmp.name, watermark_file)
+    return None
@@ -0,0 +1,580 @@
+"""Send the HTTP requests of the registrar, or record and replay them."""
+
+import base64
+from contextlib import contextmanager
+from datetime import timedelta
+import gzip
+from http import HTTPStatus
+import json
+import threading
+import time
+import requests
+
+try:
+    import httpx
+except ImportError:  # httpx is optional
+    httpx = None
+
+
+# Response headers that carry credentials, and are left out of cassettes.
+_CREDENTIAL_HEADERS = ("authorization", "proxy-authorization", "cookie", "set-cookie")
+
+
+class CassetteMissError(LookupError):
+    """Raised when a replayed request was not recorded in the cassette."""
+
+
+class RequestsTransport:
+    """Sends requests over the network with the `requests` library. This is
+    the default transport.
+
+    The requests are sent with one `requests.Session`, so connections to each
+    host are kept open and reused by later requests, rather than opened for
+    each request.
+
+    Parameters
+    ----------
+    pool_maxsize : int, optional
+        Maximum number of connections kept open to each host, e.g. for the
+        threads of a batch upload.
+    session : requests.Session, optional
+        The session to send requests with, in place of one created with the
+        option above.
+    """
+
+    def __init__(self, pool_maxsize=10, session=None):
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, method, url, **kwargs):
+        """Sends an HTTP request.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method, e.g. "GET".
+        url : str
+            The URL to send the request to.
+        **kwargs
+            Keyword arguments passed on to `requests` (e.g. `data`, `auth`,
+            `headers`, `timeout`).
+
+        Returns
+        -------
+        requests.Response
+            The response to the request.
+        """
+        return getattr(self.session, method.lower())(url, **kwargs)
+
+    def close(self):
+        """Closes the connections of the session.
+
+        Returns
+        -------
+        None
+        """
+        self.session.close()
+
+
+class HttpxTransport:
+    """Sends requests over the network with the optional `httpx` library,
+    multiplexed over HTTP/2.
+
+    A `requests` connection carries one request at a time, so concurrent
+    uploads open a connection to GBIF for each request in flight. Over
+    HTTP/2, the requests of all threads share a few connections to each
+    host.
+
+    Parameters
+    ----------
+    http2 : bool, optional
+        If True (the default), requests are sent over HTTP/2 to hosts that
+        support it, and over HTTP/1.1 to others.
+    max_connections : int, optional
+        Maximum number of connections open at a time, to all hosts.
+    client : httpx.Client, optional
+        The client to send requests with, in place of one created with the
+        options above.
+
+    Raises
+    ------
+    ImportError
+        If httpx isn't installed. Install the optional `http2` extra to
+        install it with HTTP/2 support.
+
+    Examples
+    --------
+    >>> with HttpxTransport() as transport, use_transport(transport):
+    ...     upload_datasets(local_dataset_ids, "registrations.csv")
+    """
+
+    def __init__(self, http2=True, max_connections=10, client=None):
+        if client is None:
+            if httpx is None:
+                raise ImportError(
+                    "HttpxTransport requires the optional httpx package. Install "
+                    "it with: pip install 'httpx[http2]'"
+                )
+            client = httpx.Client(
+                http2=http2,
+                limits=httpx.Limits(max_connections=max_connections),
+                follow_redirects=True,
+            )
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, method, url, **kwargs):
+        """Sends an HTTP request.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method, e.g. "GET".
+        url : str
+            The URL to send the request to.
+        **kwargs
+            Keyword arguments of `requests` (e.g. `data`, `auth`, `headers`,
+            `timeout`), translated for `httpx`.
+
+        Returns
+        -------
+        requests.Response
+            The response to the request.
+        """
+        # The whole response is read, so a streamed request is sent as any
+        # other.
+        kwargs.pop("stream", None)
+        if "allow_redirects" in kwargs:
+            kwargs["follow_redirects"] = kwargs.pop("allow_redirects")
+        data = kwargs.pop("data", None)
+        if isinstance(data, (str, bytes)):
+            kwargs["content"] = data
+        elif data is not None:
+            kwargs["data"] = data
+        start = time.monotonic()
+        try:
+            resp = self.client.request(method.upper(), url, **kwargs)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # Failures are raised as those of requests, so they are retried
+            # and counted by the circuit breaker like any other.
+            translated = _requests_error(error)
+            if translated is None:
+                raise
+            raise translated from error
+        return _response(
+            url,
+            resp.status_code,
+            resp.reason_phrase,
+            resp.headers,
+            resp.content,
+            time.monotonic() - start,
+        )
+
+    def close(self):
+        """Closes the connections of the client.
+
+        Returns
+        -------
+        None
+        """
+        self.client.close()
+
+
+class MemoryTransport:
+    """Serves responses added to it, without the network, for tests.
+
+    Parameters
+    ----------
+    strict : bool, optional
+        If True (the default), a request without a response raises
+        `LookupError`. If False, it is served a 404 response.
+
+    Attributes
+    ----------
+    requests : list of tuple
+        The (method, url, kwargs) of each request sent, in order.
+
+    Examples
+    --------
+    >>> transport = MemoryTransport()
+    >>> transport.add("GET", gbif_api + "/" + gbif_dataset_uuid, gbif_metadata)
+    >>> with use_transport(transport):
+    ...     _read_gbif_dataset_metadata(gbif_dataset_uuid)
+    """
+
+    def __init__(self, strict=True):
+        self.strict = strict
+        self.requests = []
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def add(self, method, url, body=b"", status_code=200, headers=None):
+        """Adds a response to a request.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method, e.g. "GET".
+        url : str
+            The URL of the request, without query parameters.
+        body : bytes, str, dict, or list, optional
+            The body of the response. A dict or list is served as JSON.
+        status_code : int, optional
+            The status code of the response.
+        headers : dict, optional
+            The headers of the response.
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        Responses added to the same request are served in the order they were
+        added, and then the last of them again, as by `ReplayTransport`.
+        """
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            headers.setdefault("Content-Type", "application/json")
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        with self._lock:
+            self._responses.setdefault((method.upper(), url), []).append(
+                (status_code, headers, body)
+            )
+
+    def send(self, method, url, **kwargs):
+        """Serves the response added to a request.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method, e.g. "GET".
+        url : str
+            The URL of the request.
+        **kwargs
+            Keyword arguments of the request, recorded in `requests`.
+
+        Returns
+        -------
+        requests.Response
+            The response.
+
+        Raises
+        ------
+        LookupError
+            If no response was added to the request, and the transport is
+            strict.
+        """
+        with self._lock:
+            self.requests.append((method.upper(), url, kwargs))
+            responses = self._responses.get((method.upper(), url))
+            if responses:
+                response = responses.pop(0) if len(responses) > 1 else responses[0]
+            elif self.strict:
+                raise LookupError(f"No response was added to {method.upper()} {url}.")
+            else:
+                response = (404, {}, b"")
+        status_code, headers, body = response
+        try:
+            reason = HTTPStatus(status_code).phrase
+        except ValueError:
+            reason = ""
+        return _response(url, status_code, reason, headers, body)
+
+
+class RecordingTransport:
+    """Sends requests with another transport, and records the exchanges to a
+    cassette file for replay with `ReplayTransport`.
+
+    Parameters
+    ----------
+    cassette_file : str or pathlike object
+        Path of the cassette file, replaced when the transport is created.
+        This is a gzip compressed file of JSON lines, one per exchange.
+    transport : object, optional
+        The transport to send requests with. Defaults to `RequestsTransport`.
+
+    Notes
+    -----
+    Each exchange is appended to the cassette, as a gzip member of its own,
+    as soon as it is recorded, so a session that crashes keeps the exchanges
+    recorded before the crash.
+
+    Only the method, URL, and query parameters of a request are recorded, so
+    its credentials (the `auth` argument and request headers) are not.
+    Response headers that carry credentials, i.e. Set-Cookie, Cookie,
+    Authorization, and Proxy-Authorization, are not recorded either.
+
+    Examples
+    --------
+    >>> with RecordingTransport("upload.jsonl.gz") as recorder:
+    ...     with use_transport(recorder):
+    ...         upload_dataset("edi.929.2", "registrations.csv")
+    """
+
+    def __init__(self, cassette_file, transport=None):
+        self.cassette_file = cassette_file
+        self.transport = RequestsTransport() if transport is None else transport
+        self.exchanges = []
+        self._lock = threading.Lock()
+        # Kept open for appending exchanges, until the transport is closed.
+        # pylint: disable-next=consider-using-with
+        self._cassette = open(cassette_file, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, method, url, **kwargs):
+        """Sends an HTTP request, and records the exchange.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method, e.g. "GET".
+        url : str
+            The URL to send the request to.
+        **kwargs
+            Keyword arguments passed on to the transport.
+
+        Returns
+        -------
+        requests.Response
+            The response to the request.
+        """
+        start = time.monotonic()
+        resp = self.transport.send(method, url, **kwargs)
+        elapsed = time.monotonic() - start
+        exchange = {
+            "method": method.upper(),
+            "url": url,
+            "params": kwargs.get("params"),
+            "status_code": resp.status_code,
+            "reason": resp.reason,
+            "headers": {
+                name: value
+                for name, value in resp.headers.items()
+                if name.lower() not in _CREDENTIAL_HEADERS
+            },
+            "elapsed": elapsed,
+        }
+        try:
+            exchange["body"] = resp.content.decode("utf-8")
+            exchange["body_encoding"] = "utf-8"
+        except UnicodeDecodeError:
+            exchange["body"] = base64.b64encode(resp.content).decode("ascii")
+            exchange["body_encoding"] = "base64"
+        line = (json.dumps(exchange) + "\n").encode("utf-8")
+        with self._lock:
+            self.exchanges.append(exchange)
+            self._cassette.write(gzip.compress(line))
+            self._cassette.flush()
+        return resp
+
+    def close(self):
+        """Closes the cassette file.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._cassette.close()
+
+
+class ReplayTransport:
+    """Serves responses recorded by `RecordingTransport`, without the network.
+
+    Requests are matched to recorded exchanges by method, URL, and query
+    parameters. A request made several times (e.g. repeated synchronization
+    checks) is served the recorded responses in the order they were
+    recorded, and then the last of them again.
+
+    Parameters
+    ----------
+    cassette_file : str or pathlike object
+        Path of a cassette file written by `RecordingTransport`.
+    latency_scale : float, optional
+        Each response is delayed by its recorded latency multiplied by this
+        factor. The default, 0, serves responses without delay, to measure the
+        registrar's own overhead. Use 1 to reproduce the recorded latency.
+
+    Raises
+    ------
+    CassetteMissError
+        From `send`, if a request was not recorded.
+
+    Examples
+    --------
+    >>> with use_transport(ReplayTransport("upload.jsonl.gz")):
+    ...     upload_dataset("edi.929.2", "registrations.csv")
+    """
+
+    def __init__(self, cassette_file, latency_scale=0.0):
+        self.latency_scale = latency_scale
+        self._exchanges = {}
+        self._lock = threading.Lock()
+        for exchange in _read_cassette(cassette_file):
+            key = _match_key(exchange["method"], exchange["url"], exchange["params"])
+            self._exchanges.setdefault(key, []).append(exchange)
+
+    def send(self, method, url, **kwargs):
+        """Serves the recorded response to an HTTP request.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method, e.g. "GET".
+        url : str
+            The URL of the request.
+        **kwargs
+            Keyword arguments of the request. Only `params` is used.
+
+        Returns
+        -------
+        requests.Response
+            The recorded response.
+        """
+        key = _match_key(method.upper(), url, kwargs.get("params"))
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                raise CassetteMissError(f"{method.upper()} {url} was not recorded.")
+            exchange = exchanges.pop(0) if len(exchanges) > 1 else exchanges[0]
+        if self.latency_scale > 0:
+            time.sleep(exchange["elapsed"] * self.latency_scale)
+        if exchange["body_encoding"] == "base64":
+            content = base64.b64decode(exchange["body"])
+        else:
+            content = exchange["body"].encode("utf-8")
+        return _response(
+            url,
+            exchange["status_code"],
+            exchange["reason"],
+            exchange["headers"],
+            content,
+            exchange["elapsed"],
+        )
+
+
+def _read_cassette(cassette_file):
+    """Returns the exchanges recorded in a cassette file.
+
+    Parameters
+    ----------
+    cassette_file : str or pathlike object
+        Path of a cassette file written by `RecordingTransport`.
+
+    Returns
+    -------
+    list of dict
+        The exchanges, in the order they were recorded. An exchange that was
+        partially written (by a recording session that crashed mid-write) is
+        left out.
+    """
+    lines = []
+    with gzip.open(cassette_file, "rt", encoding="utf-8") as cassette:
+        try:
+            for line in cassette:
+                lines.append(line)
+        except EOFError:  # The last gzip member is incomplete
+            pass
+    if lines and not lines[-1].endswith("\n"):
+        lines.pop()
+    return [json.loads(line) for line in lines]
+
+
+_transport = RequestsTransport()
+
+
+def get_transport():
+    """Returns the transport requests are sent with.
+
+    Returns
+    -------
+    object
+        The transport set by `use_transport`, or `RequestsTransport`.
+    """
+    return _transport
+
+
+@contextmanager
+def use_transport(transport):
+    """Sends the registrar's requests with a transport within a block.
+
+    The transport is used by all threads, e.g. those of a batch upload.
+
+    Parameters
+    ----------
+    transport : object
+        An object with a `send(method, url, **kwargs)` method returning a
+        `requests.Response`, e.g. an `HttpxTransport`, `MemoryTransport`,
+        `RecordingTransport`, or `ReplayTransport`.
+
+    Yields
+    ------
+    object
+        The transport.
+    """
+    global _transport  # pylint: disable=global-statement
+    previous = _transport
+    _transport = transport
+    try:
+        yield transport
+    finally:
+        _transport = previous
+
+
+def _match_key(method, url, params):
+    """Returns the key by which a request is matched to recorded exchanges."""
+    return (method, url, json.dumps(params, sort_keys=True))
+
+
+def _response(url, status_code, reason, headers, content, elapsed=0.0):
+    """Returns a `requests.Response`, for transports that don't send
+    requests with `requests`."""
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.reason = reason
+    resp.url = url
+    resp.headers.update(headers)
+    resp.elapsed = timedelta(seconds=elapsed)
+    resp.encoding = "utf-8"
+    resp._content = content
+    # The content is read, so closing the response doesn't touch the
+    # connection it would have been streamed from.
+    resp._content_consumed = True
+    return resp
+
+
+def _requests_error(error):
+    """Returns the `requests` exception matching an `httpx` transport error,
+    or None if it isn't one."""
+    if httpx is None:
+        return None
+    if isinstance(error, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(str(error))
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(error))
+    if isinstance(error, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(error))
+    return None
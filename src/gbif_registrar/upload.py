@@ -1,19 +1,43 @@
 """Upload datasets to GBIF."""
 
-from os import environ
-from time import sleep
+from time import monotonic, sleep
+import pandas as pd
+import requests
 from gbif_registrar import _utilities
+from gbif_registrar.configure import _resolve_config
+from gbif_registrar.metrics import _increment, _observe
+from gbif_registrar.profiling import _profiled
+from gbif_registrar.registry import _as_registry
 
 
-def upload_dataset(local_dataset_id, registrations_file):
+@_profiled
+def upload_dataset(
+    local_dataset_id,
+    registrations_file,
+    journal=None,
+    status_buffer=None,
+    config=None,
+):
     """Upload a dataset to GBIF.
 
     Parameters
     ----------
     local_dataset_id : str
         The identifier of a dataset in the EDI repository.
-    registrations_file : str
-        Path of the registrations file.
+    registrations_file : str or Registry
+        Path of the registrations file, or a Registry of it.
+    journal : _Journal, optional
+        The journal of a batch job, to which completed upload stages are
+        recorded. Stages the journal lists as completed are skipped, so an
+        interrupted upload can be resumed. Used by the batch module.
+    status_buffer : _StatusBuffer, optional
+        A buffer through which the synchronization status is written to the
+        registrations file in batches with those of other datasets. If not
+        provided, the status is written immediately. Used by the batch module.
+    config : Config, optional
+        The configuration to use, e.g. to target one of several GBIF
+        environments. Defaults to the environment variables set by the
+        load_configuration function.
 
     Returns
     -------
@@ -29,7 +53,7 @@ def upload_dataset(local_dataset_id, registrations_file):
     Print messages indicate the progress of the upload process.
 
     This function requires authentication with GBIF. Use the load_configuration
-    function from the authenticate module to do this.
+    function from the configure module, or pass a `config`, to do this.
 
     Examples
     --------
@@ -37,14 +61,15 @@ def upload_dataset(local_dataset_id, registrations_file):
     """
     print(f"Uploading {local_dataset_id} to GBIF.")
 
-    # Read the registrations file to obtain information about the
-    # local_dataset_id.
-    with open(registrations_file, "r", encoding="utf-8") as registrations:
-        registrations = _utilities._read_registrations_file(registrations_file)
+    # Read the registrations file once to obtain information about the
+    # local_dataset_id. The registry is reused by the synchronization checks
+    # below.
+    registry = _as_registry(registrations_file)
 
     # A complete registration is required for this function to succeed. Stop
     # if this is not the case.
-    if local_dataset_id not in registrations["local_dataset_id"].values:
+    record = registry.get(local_dataset_id)
+    if record is None:
         print(
             "The local dataset ID is not in the registrations file. "
             "Registration is required first."
@@ -52,16 +77,13 @@ def upload_dataset(local_dataset_id, registrations_file):
         return None
 
     # Assign registration info to variables for easy access in this function.
-    index = registrations.index[
-        registrations["local_dataset_id"] == local_dataset_id
-    ].tolist()[0]
-    local_dataset_endpoint = registrations.loc[index, "local_dataset_endpoint"]
-    gbif_dataset_uuid = registrations.loc[index, "gbif_dataset_uuid"]
-    synchronized = registrations.loc[index, "synchronized"]
+    local_dataset_endpoint = record["local_dataset_endpoint"]
+    gbif_dataset_uuid = record["gbif_dataset_uuid"]
+    synchronized = record["synchronized"]
 
     # Check if the local_dataset_id is already synchronized with GBIF and stop
     # if it is.
-    if synchronized:
+    if not pd.isna(synchronized) and synchronized:
         print(
             f"{local_dataset_id} is already synchronized with GBIF. Skipping"
             f" the upload process."
@@ -72,65 +94,90 @@ def upload_dataset(local_dataset_id, registrations_file):
     # that can result in the _is_synchronized function failing due to string
     # parsing errors. This case is unlikely to occur in contexts outside the
     # upload_dataset function, so we handle it here.
+    # An interrupted upload can also leave the GBIF dataset without endpoints,
+    # which fails the check in the same way, and a new dataset may not be
+    # readable from GBIF yet. Other failures, like throttling that outlasts
+    # the retries, are raised.
     try:
-        synchronized = _utilities._is_synchronized(local_dataset_id, registrations_file)
-    except AttributeError:
+        synchronized = _utilities._is_synchronized(local_dataset_id, registry, config)
+    except (AttributeError, IndexError):
+        synchronized = False
+    except requests.HTTPError as error:
+        if error.response is None or error.response.status_code != 404:
+            raise
         synchronized = False
     if synchronized:
         # Handle the case of a successful upload but timed out synchronization
         # check, which would result in the status being False in the
         # registrations file.
-        index = registrations.index[
-            registrations["local_dataset_id"] == local_dataset_id
-        ].tolist()[0]
-        if not registrations.loc[index, "synchronized"]:
-            registrations.loc[index, "synchronized"] = True
-            registrations.to_csv(registrations_file, index=False, mode="w")
-            print(
-                f"Updated the registrations file with the missing "
-                f"synchronization status of {local_dataset_id}."
-            )
-            return None
+        _record_stage(journal, local_dataset_id, "synchronized")
+        _mark_synchronized(local_dataset_id, registry, status_buffer)
+        print(
+            f"Updated the registrations file with the missing "
+            f"synchronization status of {local_dataset_id}."
+        )
+        return None
+
+    config = _resolve_config(config)
 
     # Clear the list of local endpoints so when the endpoint is added below,
     # it will result in only one being listed on the GBIF dataset landing page.
     # Multiple endpoint listings are confusing to end users.
-    _utilities._delete_local_dataset_endpoints(gbif_dataset_uuid)
-    print("Deleted local dataset endpoints from GBIF.")
+    if _stage_completed(journal, local_dataset_id, "endpoints_deleted"):
+        print("Local dataset endpoints were deleted in a previous run.")
+    else:
+        _utilities._delete_local_dataset_endpoints(gbif_dataset_uuid, config)
+        print("Deleted local dataset endpoints from GBIF.")
+        _record_stage(journal, local_dataset_id, "endpoints_deleted")
 
     # Post the local dataset endpoint to GBIF. This will initiate a crawl of
     # the local dataset landing page metadata on the first post but not on
     # subsequent posts (the case of updated datasets). In the latter case, the
     # local dataset landing page metadata will also need to be posted to update
-    # the GBIF landing page (below).
-    _utilities._post_local_dataset_endpoint(local_dataset_endpoint, gbif_dataset_uuid)
-    print(f"Posted local dataset endpoint {local_dataset_endpoint} to GBIF.")
+    # the GBIF landing page (below). A run interrupted after the endpoints
+    # were deleted leaves the GBIF dataset without any, which is repaired here.
+    if _stage_completed(journal, local_dataset_id, "endpoint_posted"):
+        print("Local dataset endpoint was posted in a previous run.")
+    else:
+        _utilities._post_local_dataset_endpoint(
+            local_dataset_endpoint, gbif_dataset_uuid, config
+        )
+        print(f"Posted local dataset endpoint {local_dataset_endpoint} to GBIF.")
+        _record_stage(journal, local_dataset_id, "endpoint_posted")
 
     # For revised datasets, post a new metadata document in order to update
     # the GBIF landing page. This is necessary because GBIF doesn't "re-crawl"
     # the local dataset metadata when the new local dataset endpoint is
     # updated.
-    _utilities._post_new_metadata_document(local_dataset_id, gbif_dataset_uuid)
-    print(f"Posted new metadata document for {local_dataset_id} to GBIF.")
+    if _stage_completed(journal, local_dataset_id, "metadata_posted"):
+        print("Metadata document was posted in a previous run.")
+    else:
+        _utilities._post_new_metadata_document(
+            local_dataset_id, gbif_dataset_uuid, config
+        )
+        print(f"Posted new metadata document for {local_dataset_id} to GBIF.")
+        _record_stage(journal, local_dataset_id, "metadata_posted")
+    _increment("gbif_registrar_datasets_uploaded_total")
 
     # Run the _is_synchronized function until a True value is returned or the
     # max number of attempts is reached.
     synchronized = False
     max_attempts = 12  # Average synchronization time is 20 seconds
     attempts = 0
+    posted = monotonic()
     while not synchronized and attempts < max_attempts:
         print(f"Checking if {local_dataset_id} is synchronized with GBIF.")
-        synchronized = _utilities._is_synchronized(local_dataset_id, registrations_file)
+        synchronized = _utilities._is_synchronized(local_dataset_id, registry, config)
         attempts += 1
         sleep(5)
 
     # Update the registrations file with the new status
     if synchronized:
+        _increment("gbif_registrar_datasets_synced_total")
+        _observe("gbif_registrar_time_to_sync_seconds", monotonic() - posted)
         print(f"{local_dataset_id} is synchronized with GBIF.")
-        with open(registrations_file, "r", encoding="utf-8") as registrations:
-            registrations = _utilities._read_registrations_file(registrations_file)
-        registrations.loc[index, "synchronized"] = True
-        registrations.to_csv(registrations_file, index=False, mode="w")
+        _record_stage(journal, local_dataset_id, "synchronized")
+        _mark_synchronized(local_dataset_id, registry, status_buffer)
         print(
             f"Updated the registrations file with the new synchronization "
             f"status of {local_dataset_id}."
@@ -138,9 +185,10 @@ def upload_dataset(local_dataset_id, registrations_file):
         print(f"Upload of {local_dataset_id} to GBIF is complete.")
         print(
             "View the dataset on GBIF at:",
-            environ["GBIF_DATASET_BASE_URL"] + "/" + gbif_dataset_uuid,
+            config.gbif_dataset_base_url + "/" + gbif_dataset_uuid,
         )
     else:
+        _increment("gbif_registrar_sync_timeouts_total")
         print(
             f"Checks on the synchronization status of {local_dataset_id} "
             f"with GBIF timed out. Please check the GBIF log page later."
@@ -150,6 +198,74 @@ def upload_dataset(local_dataset_id, registrations_file):
         )
     print(
         f"For more information, see the GBIF log page for " f"{local_dataset_id}:",
-        environ["REGISTRY_BASE_URL"] + "/" + gbif_dataset_uuid,
+        config.registry_base_url + "/" + gbif_dataset_uuid,
     )
     return None
+
+
+def _mark_synchronized(local_dataset_id, registry, status_buffer=None):
+    """Sets the synchronization status of a dataset to True in the
+    registrations file.
+
+    Only the dataset's row is written, so concurrent updates of other rows by
+    other processes are preserved.
+
+    Parameters
+    ----------
+    local_dataset_id : str
+        The identifier of a dataset in the EDI repository.
+    registry : Registry
+        A Registry of the registrations file.
+    status_buffer : _StatusBuffer, optional
+        If provided, the status is buffered for a later batched write.
+
+    Returns
+    -------
+    None
+    """
+    if status_buffer is not None:
+        status_buffer.mark_synchronized(local_dataset_id)
+        return None
+    registry.update(local_dataset_id, synchronized=True)
+    registry.save()
+    return None
+
+
+def _record_stage(journal, local_dataset_id, stage):
+    """Records a completed upload stage to the journal, if there is one.
+
+    Parameters
+    ----------
+    journal : _Journal or None
+        The journal of a batch job.
+    local_dataset_id : str
+        The identifier of a dataset in the EDI repository.
+    stage : str
+        Name of the completed stage.
+
+    Returns
+    -------
+    None
+    """
+    if journal is not None:
+        journal.record(local_dataset_id, stage)
+
+
+def _stage_completed(journal, local_dataset_id, stage):
+    """Returns True if the journal lists an upload stage as completed.
+
+    Parameters
+    ----------
+    journal : _Journal or None
+        The journal of a batch job.
+    local_dataset_id : str
+        The identifier of a dataset in the EDI repository.
+    stage : str
+        Name of the stage.
+
+    Returns
+    -------
+    bool
+        False if there is no journal.
+    """
+    return journal is not None and journal.completed(local_dataset_id, stage)
@@ -1,6 +1,12 @@
 """Validate the dataset registrations file."""
 
-from gbif_registrar.register import _read_registrations_file
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import json
+import os
+import sys
+import pandas as pd
+from gbif_registrar.registry import _as_registry
 from gbif_registrar._utilities import _check_completeness
 from gbif_registrar._utilities import _check_local_dataset_id
 from gbif_registrar._utilities import _check_group_registrations
@@ -8,9 +14,41 @@ from gbif_registrar._utilities import _check_local_endpoints
 from gbif_registrar._utilities import _check_synchronized
 from gbif_registrar._utilities import _check_local_dataset_id_format
 from gbif_registrar._utilities import _check_local_dataset_group_id_format
+from gbif_registrar._utilities import _check_remote_urls
+from gbif_registrar._utilities import _read_partitions
+from gbif_registrar._utilities import _read_registrations_file
+from gbif_registrar._utilities import _report
+from gbif_registrar.profiling import _profiled
 
+# The checks run by validate_registrations, by the rule name they report.
+_RULES = {
+    "completeness": "Registrations have values for all columns except " "synchronized.",
+    "local_dataset_id": "Values of local_dataset_id are unique.",
+    "group_registrations": "local_dataset_group_id and gbif_dataset_uuid have "
+    "one-to-one cardinality.",
+    "local_endpoints": "local_dataset_id and local_dataset_endpoint have "
+    "one-to-one cardinality.",
+    "synchronized": "Registrations are synchronized with GBIF.",
+    "local_dataset_id_format": "local_dataset_id has the format "
+    "scope.identifier.revision.",
+    "local_dataset_group_id_format": "local_dataset_group_id has the format "
+    "scope.identifier, of its local_dataset_id.",
+    "endpoint_reachable": "local_dataset_endpoint URLs can be reached.",
+    "metadata_reachable": "The EDI metadata documents of local_dataset_id "
+    "values can be reached.",
+}
 
-def validate_registrations(registrations_file):
+
+@_profiled
+def validate_registrations(
+    registrations_file,
+    output=None,
+    output_format="jsonl",
+    max_findings=None,
+    max_workers=4,
+    remote=False,
+    config=None,
+):
     """Validates the dataset registrations file.
 
     This function validates the dataset registrations file by checking for
@@ -20,8 +58,34 @@ def validate_registrations(registrations_file):
 
     Parameters
     ----------
-    registrations_file : str or pathlike object
-        Path of the dataset registrations file.
+    registrations_file : str, pathlike object, or Registry
+        Path of the dataset registrations file, or a Registry of it. The path
+        of a partitioned registrations directory (see the partitions module)
+        is validated one partition at a time, in parallel.
+    output : str, pathlike object, or file object, optional
+        Where to write the issues found, one finding per row or value, instead
+        of raising warnings. Use "-" for standard output. Findings are written
+        as each check runs.
+    output_format : str, optional
+        Format of the `output`: "jsonl" for JSON Lines, one finding per line
+        followed by a summary line, or "sarif" for a SARIF 2.1.0 log.
+    max_findings : int, optional
+        Maximum number of findings written for each check. Further findings
+        are only counted in the summary. If not provided, all findings are
+        written.
+    max_workers : int, optional
+        The number of partitions of a partitioned registrations directory
+        read and checked at a time, and of requests sent at a time if
+        `remote` is True.
+    remote : bool, optional
+        If True, also check that the `local_dataset_endpoint` and the EDI
+        metadata document of each registration can be reached, so broken
+        registrations are found before they are uploaded. Each URL is
+        requested once, within the rate limits of its host, and the results
+        are reused for 10 minutes.
+    config : Config, optional
+        The configuration to use for `remote` checks. Defaults to the
+        environment variables set by the load_configuration function.
 
     Returns
     -------
@@ -30,17 +94,220 @@ def validate_registrations(registrations_file):
     Warns
     -----
     UserWarning
-        Warnings are issued if registration issues are found.
+        Warnings are issued if registration issues are found, and `output`
+        isn't provided.
+
+    Notes
+    -----
+    A JSON Lines finding has the keys "rule" (the check, e.g.
+    "local_dataset_id_format"), "message", and either "row" (the row number of
+    the registration, starting at 1) or "value" (e.g. a duplicated
+    `local_dataset_group_id`). The summary line has the key "summary", with
+    the number of findings of each rule, and the number written.
+
+    The findings of a partitioned registrations directory are those of the
+    registrations file it represents (see `combine_partitions`), with rows
+    numbered as in that file. Their SARIF results have no locations.
 
     Examples
     --------
     >>> validate_registrations('registrations.csv')
+    >>> # In continuous integration
+    >>> validate_registrations('registrations.csv', '-', max_findings=100)
+    >>> # Before a batch upload
+    >>> validate_registrations('registrations.csv', remote=True, max_workers=16)
     """
-    registrations = _read_registrations_file(registrations_file)
-    _check_completeness(registrations)
-    _check_local_dataset_id(registrations)
-    _check_group_registrations(registrations)
-    _check_local_endpoints(registrations)
-    _check_synchronized(registrations)
-    _check_local_dataset_id_format(registrations)
-    _check_local_dataset_group_id_format(registrations)
+    if isinstance(registrations_file, (str, os.PathLike)) and os.path.isdir(
+        registrations_file
+    ):
+        artifact = None
+
+        def run_checks(sink):
+            _run_partitioned_checks(registrations_file, sink, max_workers)
+            if remote:
+                cols = ["local_dataset_id", "local_dataset_endpoint"]
+                registrations = _read_registrations_file(registrations_file, cols)
+                _check_remote_urls(registrations, config, max_workers, sink)
+
+    else:
+        registry = _as_registry(registrations_file)
+        artifact = registry.registrations_file
+
+        def run_checks(sink):
+            _run_checks(registry, sink)
+            if remote:
+                _check_remote_urls(
+                    registry.data,
+                    config,
+                    max_workers,
+                    sink,
+                    parsed_ids=registry.parsed_ids,
+                )
+
+    if output is None:
+        run_checks(None)
+        return None
+    if output_format not in ("jsonl", "sarif"):
+        raise ValueError('output_format must be "jsonl" or "sarif".')
+    if output == "-":
+        stream = sys.stdout
+    elif hasattr(output, "write"):
+        stream = output
+    else:
+        stream = open(output, "w", encoding="utf-8")  # pylint: disable=R1732
+    try:
+        writer = _FindingsWriter(stream, output_format, max_findings, artifact)
+        run_checks(writer)
+        writer.close()
+    finally:
+        if stream is not sys.stdout and stream is not output:
+            stream.close()
+    return None
+
+
+def _run_checks(registry, sink):
+    """Runs the registration checks, reporting failures to `sink`, or as
+    warnings if it is None."""
+    registrations = registry.data
+    _check_completeness(registrations, sink=sink)
+    _check_local_dataset_id(registrations, sink=sink)
+    _check_group_registrations(registrations, sink=sink)
+    _check_local_endpoints(registrations, sink=sink)
+    _check_synchronized(registrations, sink=sink)
+    _check_local_dataset_id_format(registrations, registry.parsed_ids, sink=sink)
+    _check_local_dataset_group_id_format(registrations, registry.parsed_ids, sink=sink)
+
+
+def _run_partitioned_checks(directory, sink, max_workers=4):
+    """Runs the registration checks on a partitioned registrations directory,
+    reporting failures to `sink`, or as warnings if it is None.
+
+    The checks of single registrations run on each partition in parallel.
+    The checks of uniqueness across registrations then run once, on the
+    columns they need, as registrations of different partitions can clash.
+    Failures are reported as one report per rule, in the order of
+    `_run_checks`.
+    """
+    partitions = _read_partitions(directory, max_workers=max_workers)
+    with ThreadPoolExecutor(max_workers) as executor:
+        found = list(executor.map(_check_partition, partitions.values()))
+    findings = {}
+    for partition_findings in found:
+        for rule, message, items, key in partition_findings:
+            findings.setdefault(rule, []).append((message, items, key))
+
+    def collect(rule, message, items, key):
+        findings.setdefault(rule, []).append((message, items, key))
+
+    if partitions:
+        cols = ["local_dataset_id", "local_dataset_group_id"]
+        cols += ["local_dataset_endpoint", "gbif_dataset_uuid"]
+        registrations = pd.concat(
+            [partition[cols] for partition in partitions.values()]
+        ).sort_index()
+        _check_local_dataset_id(registrations, sink=collect)
+        _check_group_registrations(registrations, sink=collect)
+        _check_local_endpoints(registrations, sink=collect)
+    for rule in _RULES:
+        if rule not in findings:
+            continue
+        message, _, key = findings[rule][0]
+        items = pd.concat([items for _, items, _ in findings[rule]])
+        if key == "row":
+            items = items.sort_values()
+        _report(rule, message, items, sink, key)
+
+
+def _check_partition(registrations):
+    """Runs the checks of single registrations on a partition, and returns
+    the failures, as the arguments of each report."""
+    found = []
+
+    def collect(*finding):
+        found.append(finding)
+
+    _check_completeness(registrations, sink=collect)
+    _check_synchronized(registrations, sink=collect)
+    _check_local_dataset_id_format(registrations, sink=collect)
+    _check_local_dataset_group_id_format(registrations, sink=collect)
+    return found
+
+
+class _FindingsWriter:
+    """Streams the findings of the registration checks to a file object.
+
+    At most `max_findings` findings of each rule are written, and the rest
+    are only counted, so output stays small however many registrations fail.
+    """
+
+    def __init__(self, stream, output_format, max_findings=None, artifact=None):
+        self.stream = stream
+        self.output_format = output_format
+        self.max_findings = max_findings
+        self.artifact = None if artifact is None else os.fspath(artifact)
+        self.counts = {}
+        self._written = {}
+        self._first = True
+        if output_format == "sarif":
+            rules = [
+                {"id": rule, "shortDescription": {"text": text}}
+                for rule, text in _RULES.items()
+            ]
+            header = {
+                "version": "2.1.0",
+                "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+            }
+            driver = {"name": "gbif_registrar", "rules": rules}
+            # Results are streamed into the open array, and the log closed by
+            # `close`.
+            self.stream.write(json.dumps(header)[:-1] + ', "runs": [{"tool": ')
+            self.stream.write(json.dumps({"driver": driver}) + ', "results": [\n')
+
+    def __call__(self, rule, message, items, key):
+        written = self._written.get(rule, 0)
+        self.counts[rule] = self.counts.get(rule, 0) + len(items)
+        remaining = len(items)
+        if self.max_findings is not None:
+            remaining = max(0, min(remaining, self.max_findings - written))
+        for item in islice(items, remaining):
+            item = item.item() if hasattr(item, "item") else item
+            if self.output_format == "jsonl":
+                finding = {"rule": rule, "message": message, key: item}
+                self.stream.write(json.dumps(finding) + "\n")
+            else:
+                self._write_result(rule, message, item, key)
+        self._written[rule] = written + remaining
+
+    def _write_result(self, rule, message, item, key):
+        """Writes a finding as a SARIF result."""
+        result = {
+            "ruleId": rule,
+            "level": "warning",
+            "message": {"text": f"{message}: {item}"},
+        }
+        if key == "row" and self.artifact is not None:
+            # Line 1 of the file is the header, so row 1 is on line 2.
+            location = {
+                "artifactLocation": {"uri": self.artifact},
+                "region": {"startLine": item + 1},
+            }
+            result["locations"] = [{"physicalLocation": location}]
+        self.stream.write(("" if self._first else ",\n") + json.dumps(result))
+        self._first = False
+
+    def summary(self):
+        """Returns the number of findings, and of those written, by rule."""
+        return {
+            rule: {"findings": count, "written": self._written[rule]}
+            for rule, count in self.counts.items()
+        }
+
+    def close(self):
+        """Writes the summary, and ends the SARIF log."""
+        if self.output_format == "jsonl":
+            self.stream.write(json.dumps({"summary": self.summary()}) + "\n")
+        else:
+            properties = {"summary": self.summary()}
+            self.stream.write("\n], " + json.dumps({"properties": properties})[1:])
+            self.stream.write("]}\n")
+        self.stream.flush()
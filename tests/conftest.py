@@ -1,7 +1,12 @@
 """Configure the test suite."""
 
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import environ
+import threading
+from urllib.parse import parse_qs, urlparse
 import pytest
 from gbif_registrar._utilities import _read_registrations_file
+from gbif_registrar.configure import load_configuration, unload_configuration
 
 
 @pytest.fixture(name="eml")
@@ -97,3 +102,72 @@ def mock_update_dataset_success_fixture(mocker, gbif_dataset_uuid):
 def registrations_fixture():
     """Read the test registrations file into DataFrame fixture."""
     return _read_registrations_file("tests/registrations.csv")
+
+
+class PastaStandIn(ThreadingHTTPServer):
+    """A local stand-in for the PASTA API of the EDI repository.
+
+    Serves the data package change list (/package/changes/eml) from the
+    `changes` attribute, a list of dicts with the keys "packageId", "date",
+    and "action". Changes are filtered by the "fromDate" and "scope" query
+    parameters as PASTA does.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _PastaHandler)
+        self.changes = []
+        self.requests = []
+
+    @property
+    def url(self):
+        """str : The base URL of the stand-in."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _PastaHandler(BaseHTTPRequestHandler):
+    """Handles requests to the PASTA stand-in."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Responds with the data package change list."""
+        url = urlparse(self.path)
+        self.server.requests.append(self.path)
+        if url.path != "/package/changes/eml":
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        from_date = query.get("fromDate", [""])[0]
+        scope = query.get("scope", [None])[0]
+        body = "<dataPackageChanges>"
+        for change in self.server.changes:
+            if change["date"] < from_date:
+                continue
+            if scope is not None and change["packageId"].split(".")[0] != scope:
+                continue
+            body += (
+                f"<dataPackage><packageId>{change['packageId']}</packageId>"
+                f"<date>{change['date']}</date>"
+                f"<action>{change['action']}</action></dataPackage>"
+            )
+        body += "</dataPackageChanges>"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Silences request logging."""
+
+
+@pytest.fixture(name="pasta")
+def pasta_fixture():
+    """Run a local PASTA stand-in, and load a configuration whose
+    PASTA_ENVIRONMENT points at it."""
+    server = PastaStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    load_configuration("tests/test_config.json")
+    environ["PASTA_ENVIRONMENT"] = server.url
+    yield server
+    unload_configuration()
+    server.shutdown()
+    server.server_close()
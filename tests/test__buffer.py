@@ -0,0 +1,67 @@
+"""Test the _buffer.py module."""
+
+import atexit
+import time
+from gbif_registrar._buffer import _StatusBuffer
+from gbif_registrar._utilities import _read_registrations_file
+
+
+def write_unsynchronized(registrations, tmp_path):
+    """Write a registrations file in which no registration is synchronized."""
+    registrations["synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    return tmp_path / "registrations.csv"
+
+
+def test_status_buffer_flushes_on_size(registrations, tmp_path, mocker):
+    """Statuses are written in one batch once flush_size are pending."""
+    file = write_unsynchronized(registrations, tmp_path)
+    buffer = _StatusBuffer(file, flush_size=3)
+    save = mocker.spy(buffer.registry, "save")
+    ids = registrations["local_dataset_id"].tolist()
+    buffer.mark_synchronized(ids[0])
+    buffer.mark_synchronized(ids[1])
+    assert not _read_registrations_file(file)["synchronized"].any()
+    buffer.mark_synchronized(ids[2])
+    assert _read_registrations_file(file)["synchronized"].sum() == 3
+    assert save.call_count == 1
+    buffer.close()
+
+
+def test_status_buffer_flushes_on_interval(registrations, tmp_path, mocker):
+    """Statuses are written once the oldest has waited flush_interval."""
+    file = write_unsynchronized(registrations, tmp_path)
+    clock = mocker.patch("gbif_registrar._buffer.time.monotonic", return_value=0)
+    buffer = _StatusBuffer(file, flush_interval=10)
+    ids = registrations["local_dataset_id"].tolist()
+    buffer.mark_synchronized(ids[0])
+    clock.return_value = 11
+    buffer.mark_synchronized(ids[1])
+    assert _read_registrations_file(file)["synchronized"].sum() == 2
+    buffer.close()
+
+
+def test_status_buffer_flushes_on_timer(registrations, tmp_path):
+    """A pending status is written after flush_interval, even if no other
+    status is buffered."""
+    file = write_unsynchronized(registrations, tmp_path)
+    buffer = _StatusBuffer(file, flush_interval=0.05)
+    buffer.mark_synchronized(registrations["local_dataset_id"].iloc[0])
+    deadline = time.monotonic() + 10
+    while not _read_registrations_file(file)["synchronized"].any():
+        assert time.monotonic() < deadline, "Timed out waiting for the flush."
+        time.sleep(0.01)
+    assert _read_registrations_file(file)["synchronized"].sum() == 1
+    buffer.close()
+
+
+def test_status_buffer_flushes_on_close_and_exit(registrations, tmp_path, mocker):
+    """Pending statuses are written on close, and at interpreter exit if the
+    buffer isn't closed."""
+    file = write_unsynchronized(registrations, tmp_path)
+    register = mocker.spy(atexit, "register")
+    with _StatusBuffer(file) as buffer:
+        buffer.mark_synchronized(registrations["local_dataset_id"].iloc[0])
+        assert not _read_registrations_file(file)["synchronized"].any()
+    assert _read_registrations_file(file)["synchronized"].sum() == 1
+    register.assert_called_once_with(buffer.flush)
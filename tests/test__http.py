@@ -0,0 +1,257 @@
+"""Test the _http.py module."""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import pytest
+import requests
+from gbif_registrar import _http
+from gbif_registrar.configure import Config
+from gbif_registrar._http import (
+    _CircuitOpenError,
+    _SingleFlight,
+    _TokenBucket,
+    _FileTokenBucket,
+    _json,
+    _request,
+    _retry_after,
+)
+
+
+def fake_clock(mocker):
+    """Replace the clock and sleep function of the _http module with a fake
+    clock that advances only when slept on."""
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    mocker.patch("gbif_registrar._http.time.monotonic", side_effect=lambda: now[0])
+    mocker.patch("gbif_registrar._http.time.time", side_effect=lambda: now[0])
+    return mocker.patch("gbif_registrar._http.time.sleep", side_effect=sleep)
+
+
+def test_token_bucket_allows_burst_then_waits(mocker):
+    """A token bucket allows a burst of requests up to its capacity, and then
+    waits for tokens to refill."""
+    sleep = fake_clock(mocker)
+    bucket = _TokenBucket(rate=2, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    sleep.assert_not_called()
+    bucket.acquire()
+    sleep.assert_called_once_with(0.5)
+
+
+def test_token_bucket_block_delays_acquire(mocker):
+    """A blocked bucket waits for the block to expire."""
+    sleep = fake_clock(mocker)
+    bucket = _TokenBucket(rate=2)
+    bucket.block(3)
+    bucket.acquire()
+    sleep.assert_called_once_with(3)
+
+
+def test_file_token_bucket_shares_state(tmp_path, mocker):
+    """Token buckets backed by the same file share a budget, as they would
+    across processes."""
+    sleep = fake_clock(mocker)
+    bucket1 = _FileTokenBucket(tmp_path / "bucket.json", rate=1, capacity=1)
+    bucket2 = _FileTokenBucket(tmp_path / "bucket.json", rate=1, capacity=1)
+    bucket1.acquire()
+    bucket2.acquire()  # The only token was taken by bucket1, so this waits
+    sleep.assert_called_once_with(1)
+
+
+def test_retry_after_parses_seconds_and_dates(mocker):
+    """The Retry-After header is parsed in both of its forms."""
+    resp = mocker.Mock()
+    resp.headers = {"Retry-After": "3"}
+    assert _retry_after(resp) == 3
+    resp.headers = {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    assert _retry_after(resp) == 0  # In the past
+    resp.headers = {}
+    assert _retry_after(resp) is None
+
+
+def test_request_resends_throttled_requests(mocker):
+    """A throttled request is resent after the Retry-After delay, which is
+    applied to the host."""
+    mocker.patch("gbif_registrar._http.time.sleep")
+    _http._rate_limiter.reset()
+    throttled = mocker.Mock(status_code=429, headers={"Retry-After": "2"})
+    success = mocker.Mock(status_code=200)
+    mock_get = mocker.patch("requests.Session.get", side_effect=[throttled, success])
+    block = mocker.spy(_http._rate_limiter, "block")
+    resp = _request("GET", "https://api.gbif-uat.org/v1/dataset", timeout=60)
+    assert resp is success
+    assert mock_get.call_count == 2
+    block.assert_called_once_with("api.gbif-uat.org", 2.0, None)
+    _http._rate_limiter.reset()
+
+
+def test_request_uses_separate_read_and_write_budgets(mocker):
+    """GET requests are counted against the read budget, and POST requests
+    against the write budget."""
+    _http._rate_limiter.reset()
+    mocker.patch("requests.Session.get", return_value=mocker.Mock(status_code=200))
+    mocker.patch("requests.Session.post", return_value=mocker.Mock(status_code=201))
+    acquire = mocker.spy(_http._rate_limiter, "acquire")
+    _request("GET", "https://pasta-s.lternet.edu/package", timeout=60)
+    _request("POST", "https://api.gbif-uat.org/v1/dataset", timeout=60)
+    assert acquire.call_args_list[0].args == ("pasta-s.lternet.edu", "read", None)
+    assert acquire.call_args_list[1].args == ("api.gbif-uat.org", "write", None)
+    _http._rate_limiter.reset()
+
+
+def test_request_retries_idempotent_requests(mocker):
+    """GET requests are resent with backoff after transient failures."""
+    sleep = fake_clock(mocker)
+    _http._circuit_breaker.reset()
+    failure = mocker.Mock(status_code=502, headers={})
+    success = mocker.Mock(status_code=200)
+    mock_get = mocker.patch(
+        "requests.Session.get",
+        side_effect=[requests.exceptions.ConnectionError(), failure, success],
+    )
+    resp = _request("GET", "https://api.gbif-uat.org/v1/dataset", timeout=60)
+    assert resp is success
+    assert mock_get.call_count == 3
+    assert sleep.call_count == 2
+    assert sleep.call_args_list[1].args[0] > sleep.call_args_list[0].args[0] / 2
+
+
+def test_request_guards_post_retries(mocker):
+    """POST requests are only resent when the server didn't process them."""
+    fake_clock(mocker)
+    _http._circuit_breaker.reset()
+    url = "https://api.gbif-uat.org/v1/dataset"
+    # A 502 may have been processed, so it is returned as is
+    failure = mocker.Mock(status_code=502, headers={})
+    mock_post = mocker.patch("requests.Session.post", return_value=failure)
+    assert _request("POST", url, timeout=60) is failure
+    assert mock_post.call_count == 1
+    # A connect timeout means the request was never sent, so it is resent
+    success = mocker.Mock(status_code=201)
+    mock_post = mocker.patch(
+        "requests.Session.post",
+        side_effect=[requests.exceptions.ConnectTimeout(), success],
+    )
+    assert _request("POST", url, timeout=60) is success
+    # Unless the caller declares the POST idempotent, read errors are raised
+    mocker.patch("requests.Session.post", side_effect=requests.exceptions.ReadTimeout())
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        _request("POST", url, timeout=60)
+    mock_post = mocker.patch(
+        "requests.Session.post",
+        side_effect=[requests.exceptions.ReadTimeout(), success],
+    )
+    assert _request("POST", url, idempotent=True, timeout=60) is success
+    _http._circuit_breaker.reset()
+
+
+def test_request_applies_settings_of_config(mocker):
+    """The retry and rate limit settings of a Config apply to its requests,
+    rather than those of the environment."""
+    fake_clock(mocker)
+    _http._circuit_breaker.reset()
+    _http._rate_limiter.reset()
+    settings = Config.from_file("tests/test_config.json").__dict__
+    settings = {key.upper(): value for key, value in settings.items()}
+    settings.update(RETRY_ATTEMPTS="2", RATE_LIMIT_READ="1")
+    config = Config.from_mapping(settings)
+    url = "https://api.gbif-uat.org/v1/dataset"
+    failure = mocker.Mock(status_code=502, headers={})
+    mock_get = mocker.patch("requests.Session.get", return_value=failure)
+    assert _request("GET", url, timeout=60, config=config) is failure
+    assert mock_get.call_count == 2
+    assert _http._rate_limiter._bucket("api.gbif-uat.org", "read", config).rate == 1
+    mock_get.reset_mock()
+    _http._circuit_breaker.reset()
+    assert _request("GET", url, timeout=60) is failure
+    assert mock_get.call_count == 4
+    _http._circuit_breaker.reset()
+    _http._rate_limiter.reset()
+
+
+def test_circuit_breaker_fails_fast_then_recovers(mocker):
+    """Requests to a failing host fail fast until the breaker timeout passes,
+    after which a trial request closes the circuit."""
+    sleep = fake_clock(mocker)
+    _http._circuit_breaker.reset()
+    url = "https://api.gbif-uat.org/v1/dataset"
+    mocker.patch(
+        "requests.Session.get", side_effect=requests.exceptions.ConnectionError()
+    )
+    for _ in range(2):  # 4 attempts each, opening the circuit at 5 failures
+        with pytest.raises(requests.exceptions.ConnectionError):
+            _request("GET", url, timeout=60)
+    mock_get = mocker.patch("requests.Session.get")
+    with pytest.raises(_CircuitOpenError):
+        _request("GET", url, timeout=60)
+    mock_get.assert_not_called()
+    # Other hosts are unaffected
+    _request("GET", "https://pasta-s.lternet.edu/package", timeout=60)
+    # Once the timeout passes, a successful trial request closes the circuit
+    sleep(60)
+    mock_get.return_value = mocker.Mock(status_code=200)
+    _request("GET", url, timeout=60)
+    _request("GET", url, timeout=60)
+    _http._circuit_breaker.reset()
+
+
+def test_request_coalesces_identical_reads_in_flight(mocker):
+    """Concurrent identical GETs share one request and its parsed result, while
+    different GETs and writes are sent separately."""
+    _http._rate_limiter.reset()
+    started = threading.Event()
+    release = threading.Event()
+    sent = []
+
+    def send(method, url, **kwargs):
+        sent.append((method, url, kwargs.get("params")))
+        started.set()
+        release.wait(5)
+        return mocker.Mock(status_code=200, text='{"key": "value"}')
+
+    mocker.patch("gbif_registrar._http._send", side_effect=send)
+    url = "https://api.gbif-uat.org/v1/dataset/1"
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(_request, "GET", url, timeout=60)
+        started.wait(5)
+        followers = [
+            executor.submit(_request, "GET", url, timeout=60) for _ in range(2)
+        ]
+        other = executor.submit(_request, "GET", url, params={"a": 1}, timeout=60)
+        time.sleep(0.1)
+        release.set()
+        responses = [leader.result()] + [f.result() for f in followers]
+        other.result()
+    assert all(resp is responses[0] for resp in responses)
+    assert _json(responses[1]) is _json(responses[2])
+    assert sent.count(("GET", url, None)) == 1
+    assert sent.count(("GET", url, {"a": 1})) == 1
+    # Once the first request returns, the next is sent anew
+    _request("GET", url, timeout=60)
+    assert sent.count(("GET", url, None)) == 2
+    _http._rate_limiter.reset()
+
+
+def test_single_flight_shares_errors():
+    """Callers waiting on a failed call receive its error."""
+    single_flight = _SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise requests.exceptions.ConnectionError("down")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(single_flight.do, "key", fail)
+        time.sleep(0.05)
+        follower = executor.submit(single_flight.do, "key", lambda: "unused")
+        time.sleep(0.05)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                future.result()
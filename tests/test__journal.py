@@ -0,0 +1,36 @@
+"""Test the _journal.py module."""
+
+from gbif_registrar._journal import _Journal
+
+
+def test_journal_records_and_resumes(tmp_path):
+    """Stages recorded to a journal are read back when resuming."""
+    journal = _Journal(tmp_path / "job.jsonl")
+    journal.record("edi.941.3", "endpoints_deleted")
+    journal.record("edi.941.3", "endpoint_posted")
+    assert journal.completed("edi.941.3", "endpoint_posted")
+    resumed = _Journal(tmp_path / "job.jsonl", resume=True)
+    assert resumed.stages("edi.941.3") == {"endpoints_deleted", "endpoint_posted"}
+    assert not resumed.completed("edi.941.4", "endpoints_deleted")
+
+
+def test_journal_ignores_incomplete_entries(tmp_path):
+    """A partially written entry, from a crash mid-write, is ignored, and
+    truncated so that later entries are read back."""
+    journal = _Journal(tmp_path / "job.jsonl")
+    journal.record("edi.941.3", "endpoints_deleted")
+    with open(tmp_path / "job.jsonl", "a", encoding="utf-8") as file:
+        file.write('{"local_dataset_id": "edi.941.3", "sta')
+    resumed = _Journal(tmp_path / "job.jsonl", resume=True)
+    assert resumed.stages("edi.941.3") == {"endpoints_deleted"}
+    resumed.record("edi.941.3", "endpoint_posted")
+    resumed = _Journal(tmp_path / "job.jsonl", resume=True)
+    assert resumed.stages("edi.941.3") == {"endpoints_deleted", "endpoint_posted"}
+
+
+def test_journal_starts_over_without_resume(tmp_path):
+    """A new job clears the journal of a previous job."""
+    journal = _Journal(tmp_path / "job.jsonl")
+    journal.record("edi.941.3", "endpoints_deleted")
+    journal = _Journal(tmp_path / "job.jsonl")
+    assert journal.stages("edi.941.3") == set()
@@ -0,0 +1,22 @@
+"""Test the _prefetch.py module."""
+
+from gbif_registrar._prefetch import _Prefetcher
+from gbif_registrar._utilities import _cache_local_dataset_metadata
+from gbif_registrar.configure import Config
+
+
+def test_prefetcher_reads_ahead_and_drops_uploaded(mocker):
+    """The next datasets are read once each, and the metadata of uploaded
+    datasets is dropped from the cache."""
+    config = Config.from_file("tests/test_config.json")
+    mock_read = mocker.patch("gbif_registrar._prefetch._read_local_dataset_metadata")
+    local_dataset_ids = ["edi.1.1", "edi.2.1", "edi.3.1", "edi.4.1"]
+    with _cache_local_dataset_metadata() as cache:
+        cache.put((config.pasta_environment, "edi.1.1"), "<eml/>")
+        prefetcher = _Prefetcher(local_dataset_ids, 2, cache, config)
+        prefetcher.advance(0)
+        prefetcher.advance(1)
+        prefetcher._executor.shutdown(wait=True)
+        assert (config.pasta_environment, "edi.1.1") not in cache
+    read_ids = sorted(call.args[0] for call in mock_read.call_args_list)
+    assert read_ids == ["edi.2.1", "edi.3.1", "edi.4.1"]
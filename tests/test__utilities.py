@@ -1,13 +1,20 @@
 """Test the _utilities.py module."""
 
 from os import environ
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 import numpy as np
+import pytest
 import pandas as pd
+import requests
 from gbif_registrar._utilities import (
+    _cache_local_dataset_metadata,
     _read_local_dataset_metadata,
     _read_gbif_dataset_metadata,
     _is_synchronized,
+    _latest_revisions,
+    _merge_registration_records,
+    _parse_local_dataset_ids,
     _get_local_dataset_group_id,
     _get_local_dataset_endpoint,
     _get_gbif_dataset_uuid,
@@ -19,7 +26,10 @@ from gbif_registrar._utilities import (
     _check_local_dataset_id_format,
     _check_local_dataset_group_id_format,
     _read_registrations_file,
+    _update_registrations_file,
+    _write_registrations_file,
 )
+from gbif_registrar._cache import _TTLCache
 from gbif_registrar.configure import load_configuration, unload_configuration
 
 
@@ -296,21 +306,51 @@ def test_read_local_dataset_metadata_success(mocker, eml):
     mock_response = mocker.Mock()
     mock_response.status_code = 200
     mock_response.text = eml
-    mocker.patch("requests.get", return_value=mock_response)
+    mocker.patch("requests.Session.get", return_value=mock_response)
     metadata = _read_local_dataset_metadata("knb-lter-ble.20.1")
     assert isinstance(metadata, str)
     unload_configuration()
 
 
+def test_read_local_dataset_metadata_is_cached(mocker, eml):
+    """Within a caching block, each metadata document is read once."""
+    load_configuration("tests/test_config.json")
+    mock_response = mocker.Mock()
+    mock_response.status_code = 200
+    mock_response.text = eml
+    mock_get = mocker.patch("requests.Session.get", return_value=mock_response)
+    with _cache_local_dataset_metadata():
+        assert _read_local_dataset_metadata("knb-lter-ble.20.1") == eml
+        assert _read_local_dataset_metadata("knb-lter-ble.20.1") == eml
+    assert mock_get.call_count == 1
+    _read_local_dataset_metadata("knb-lter-ble.20.1")
+    assert mock_get.call_count == 2
+    unload_configuration()
+
+
+def test_metadata_cache_is_bounded_by_bytes(mocker):
+    """Past its byte budget, the least recently read documents are evicted."""
+    load_configuration("tests/test_config.json")
+    mock_response = mocker.Mock(status_code=200, text="x" * 10)
+    mocker.patch("requests.Session.get", return_value=mock_response)
+    with _cache_local_dataset_metadata(max_bytes=25) as cache:
+        for local_dataset_id in ["edi.1.1", "edi.2.1", "edi.1.1", "edi.3.1"]:
+            _read_local_dataset_metadata(local_dataset_id)
+        assert cache.size == 20
+        assert ("https://pasta-s.lternet.edu", "edi.1.1") in cache
+        assert ("https://pasta-s.lternet.edu", "edi.2.1") not in cache
+    unload_configuration()
+
+
 def test_read_local_dataset_metadata_failure(mocker):
-    """Test that _read_local_dataset_metadata returns None on failure."""
+    """Test that _read_local_dataset_metadata raises on failure."""
     load_configuration("tests/test_config.json")
     mock_response = mocker.Mock()
     mock_response.status_code = 404
     mock_response.reason = "Not Found"
-    mocker.patch("requests.get", return_value=mock_response)
-    metadata = _read_local_dataset_metadata("knb-lter-ble.20.10")
-    assert metadata is None
+    mocker.patch("requests.Session.get", return_value=mock_response)
+    with pytest.raises(requests.HTTPError, match="404 Not Found"):
+        _read_local_dataset_metadata("knb-lter-ble.20.10")
     unload_configuration()
 
 
@@ -320,21 +360,21 @@ def test_read_gbif_dataset_metadata_success(mocker):
     mock_response = mocker.Mock()
     mock_response.status_code = 200
     mock_response.text = """{"title":"This is a title"}"""
-    mocker.patch("requests.get", return_value=mock_response)
+    mocker.patch("requests.Session.get", return_value=mock_response)
     res = _read_gbif_dataset_metadata("cfb3f6d5-ed7d-4fff-9f1b-f032ed1de485")
     assert isinstance(res, dict)
     unload_configuration()
 
 
 def test_read_gbif_dataset_metadata_failure(mocker):
-    """Test that _read_gbif_dataset_metadata returns None on failure."""
+    """Test that _read_gbif_dataset_metadata raises on failure."""
     load_configuration("tests/test_config.json")
     mock_response = mocker.Mock()
     mock_response.status_code = 404
     mock_response.reason = "Not Found"
-    mocker.patch("requests.get", return_value=mock_response)
-    res = _read_gbif_dataset_metadata("cfb3f6d5-ed7d-4fff-9f1b-f032e")
-    assert res is None
+    mocker.patch("requests.Session.get", return_value=mock_response)
+    with pytest.raises(requests.HTTPError, match="404 Not Found"):
+        _read_gbif_dataset_metadata("cfb3f6d5-ed7d-4fff-9f1b-f032e")
     unload_configuration()
 
 
@@ -345,20 +385,149 @@ def test_request_gbif_dataset_uuid_success(mocker):
     mock_response = mocker.Mock()
     mock_response.status_code = 201
     mock_response.json.return_value = "4e70c80e-cf22-49a5-8bf7-280994500324"
-    mocker.patch("requests.post", return_value=mock_response)
+    mocker.patch("requests.Session.post", return_value=mock_response)
     res = _request_gbif_dataset_uuid()
     assert res == "4e70c80e-cf22-49a5-8bf7-280994500324"
     unload_configuration()
 
 
 def test_request_gbif_dataset_uuid_failure(mocker):
-    """Test that the _request_gbif_dataset_uuid function returns None when the
-    HTTP request fails."""
+    """Test that the _request_gbif_dataset_uuid function raises an HTTPError
+    when the HTTP request fails."""
     load_configuration("tests/test_config.json")
     mock_response = mocker.Mock()
     mock_response.status_code = 400
     mock_response.reason = "Bad Request"
-    mocker.patch("requests.post", return_value=mock_response)
-    res = _request_gbif_dataset_uuid()
-    assert res is None
+    mocker.patch("requests.Session.post", return_value=mock_response)
+    with pytest.raises(requests.HTTPError, match="400 Bad Request"):
+        _request_gbif_dataset_uuid()
     unload_configuration()
+
+
+def test_update_registrations_file_merges_rows(registrations, tmp_path):
+    """Records are merged into matching rows, and new records appended,
+    without reverting changes made to other rows since they were read."""
+    file = tmp_path / "registrations.csv"
+    registrations["synchronized"] = False
+    registrations.to_csv(file, index=False)
+    stale = _read_registrations_file(file)
+    # Another process updates the first row in the meantime.
+    first = registrations.iloc[[0]][["local_dataset_id"]].assign(synchronized=True)
+    _update_registrations_file(file, first)
+    # Updates made from the stale copy don't revert the change.
+    last = stale.iloc[[-1]][["local_dataset_id"]].assign(synchronized=True)
+    new = pd.DataFrame({"local_dataset_id": ["edi.929.2"], "synchronized": [False]})
+    _update_registrations_file(file, pd.concat([last, new]))
+    registrations_final = _read_registrations_file(file)
+    assert registrations_final.shape[0] == registrations.shape[0] + 1
+    synchronized = registrations_final["synchronized"]
+    assert synchronized.iloc[0] and synchronized.iloc[-2]
+    assert not synchronized.iloc[1:-2].any() and not synchronized.iloc[-1]
+    assert registrations_final.iloc[:-1, :-1].equals(registrations.iloc[:, :-1])
+
+
+def test_update_registrations_file_is_safe_concurrently(registrations, tmp_path):
+    """Concurrent updates of different rows are all preserved."""
+    file = tmp_path / "registrations.csv"
+    registrations["synchronized"] = False
+    registrations.to_csv(file, index=False)
+
+    def mark_synchronized(local_dataset_id):
+        record = pd.DataFrame({"local_dataset_id": [local_dataset_id]})
+        _update_registrations_file(file, record.assign(synchronized=True))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(mark_synchronized, registrations["local_dataset_id"]))
+    assert _read_registrations_file(file)["synchronized"].all()
+
+
+def test_write_registrations_file_replaces_atomically(registrations, tmp_path):
+    """The registrations file is replaced without leaving temporary files."""
+    file = tmp_path / "registrations.csv"
+    _write_registrations_file(registrations.iloc[0:2], file)
+    _write_registrations_file(registrations, file)
+    assert _read_registrations_file(file).equals(registrations)
+    assert [path.name for path in tmp_path.iterdir()] == ["registrations.csv"]
+
+
+def test_latest_revisions_compares_revisions_as_numbers(registrations):
+    """Revision 10 is newer than revision 9, though it sorts before it as a
+    string."""
+    registrations = registrations.iloc[:2].copy()
+    registrations["local_dataset_id"] = ["edi.193.10", "edi.193.9"]
+    assert _latest_revisions(registrations).tolist() == [True, False]
+
+
+def test_latest_revisions_of_registrations_file(registrations):
+    """The highest revision of each group is the latest."""
+    latest = _latest_revisions(registrations)
+    assert registrations.loc[latest, "local_dataset_id"].tolist() == [
+        "edi.193.5",
+        "edi.356.2",
+        "knb-lter-msp.1.2",
+        "edi.941.3",
+    ]
+
+
+def test_parse_local_dataset_ids():
+    """Identifiers are split into parts, and invalid ones are masked."""
+    ids = pd.Series(["edi.193.10", "knb-lter-msp.1.2", "edi.193", pd.NA])
+    parsed = _parse_local_dataset_ids(ids)
+    assert parsed["scope"].tolist()[:2] == ["edi", "knb-lter-msp"]
+    assert parsed["revision"].tolist()[:2] == ["10", "2"]
+    assert parsed["group"].tolist()[:2] == ["edi.193", "knb-lter-msp.1"]
+    assert parsed["valid"].tolist() == [True, True, False, False]
+    assert parsed["group"].isna().tolist() == [False, False, True, True]
+
+
+def test_read_registrations_file_types_and_projects_columns():
+    """The synchronized column is boolean, and only the listed columns are
+    read."""
+    registrations = _read_registrations_file("tests/registrations.csv")
+    assert registrations["synchronized"].dtype == "boolean"
+    projected = _read_registrations_file(
+        "tests/registrations.csv", usecols=["local_dataset_id", "synchronized"]
+    )
+    assert projected.columns.tolist() == ["local_dataset_id", "synchronized"]
+    assert projected.equals(registrations[["local_dataset_id", "synchronized"]])
+
+
+def test_read_registrations_file_with_pyarrow():
+    """The pyarrow engine reads the same registrations as the default."""
+    pytest.importorskip("pyarrow")
+    registrations = _read_registrations_file("tests/registrations.csv")
+    assert _read_registrations_file("tests/registrations.csv", engine="pyarrow").equals(
+        registrations
+    )
+
+
+def test_ttl_cache_expires_values(mocker):
+    """Values are held for the TTL, and then dropped."""
+    monotonic = mocker.patch("gbif_registrar._cache.time.monotonic", return_value=0)
+    cache = _TTLCache(ttl=10)
+    cache.put("https://pasta.lternet.edu/x", False)
+    monotonic.return_value = 9.9
+    assert cache.get("https://pasta.lternet.edu/x") is False
+    monotonic.return_value = 10
+    assert cache.get("https://pasta.lternet.edu/x") is None
+
+
+def test_merge_registration_records(registrations):
+    """Records update every row of their dataset, the last record of a dataset
+    wins, and records of new datasets are appended."""
+    local_dataset_id = registrations.at[0, "local_dataset_id"]
+    registrations = pd.concat([registrations, registrations.iloc[[0]]])
+    registrations = registrations.reset_index(drop=True)
+    records = pd.DataFrame(
+        {
+            "local_dataset_id": [local_dataset_id, local_dataset_id, "edi.1.1"],
+            "synchronized": [False, True, False],
+        }
+    )
+    merged, added = _merge_registration_records(registrations, records)
+    assert added == 1
+    assert len(merged) == len(registrations) + 1
+    rows = merged["local_dataset_id"] == local_dataset_id
+    assert rows.sum() == 2
+    assert merged.loc[rows, "synchronized"].all()
+    assert merged.iloc[-1]["local_dataset_id"] == "edi.1.1"
@@ -0,0 +1,225 @@
+"""Test the batch.py module."""
+
+import multiprocessing
+import pytest
+from gbif_registrar._journal import _Journal
+from gbif_registrar._utilities import _read_registrations_file
+from gbif_registrar.batch import (
+    _plan_latest,
+    _shard_of,
+    merge_shard_results,
+    upload_datasets,
+    upload_datasets_in_processes,
+    upload_shard,
+)
+from gbif_registrar.configure import load_configuration, unload_configuration
+from gbif_registrar.registry import Registry
+
+
+@pytest.fixture(name="unsynchronized_file")
+def unsynchronized_file_fixture(registrations, tmp_path):
+    """Write a registrations file in which the last two registrations are
+    not yet synchronized."""
+    registrations.loc[registrations.index[-2:], "synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    return tmp_path / "registrations.csv"
+
+
+def test_upload_datasets_journals_stages(unsynchronized_file, tmp_path, mocker):
+    """Each upload stage is recorded to the journal."""
+    load_configuration("tests/test_config.json")
+    mocker.patch("gbif_registrar.upload.sleep")
+    mocker.patch("gbif_registrar._utilities._delete_local_dataset_endpoints")
+    mocker.patch("gbif_registrar._utilities._post_local_dataset_endpoint")
+    mocker.patch("gbif_registrar._utilities._post_new_metadata_document")
+    mocker.patch(
+        "gbif_registrar._utilities._is_synchronized",
+        side_effect=[False, True, False, True],
+    )
+    registrations = _read_registrations_file(unsynchronized_file)
+    local_dataset_ids = registrations["local_dataset_id"].iloc[-2:].tolist()
+    upload_datasets(local_dataset_ids, unsynchronized_file, tmp_path / "job.jsonl")
+    journal = _Journal(tmp_path / "job.jsonl", resume=True)
+    for local_dataset_id in local_dataset_ids:
+        assert journal.stages(local_dataset_id) == {
+            "endpoints_deleted",
+            "endpoint_posted",
+            "metadata_posted",
+            "synchronized",
+        }
+    assert _read_registrations_file(unsynchronized_file)["synchronized"].all()
+    unload_configuration()
+
+
+def test_upload_datasets_resumes_interrupted_batch(
+    unsynchronized_file, tmp_path, mocker, capsys
+):
+    """Resuming skips completed datasets and stages, and repairs a dataset
+    that was left without endpoints."""
+    load_configuration("tests/test_config.json")
+    registrations = _read_registrations_file(unsynchronized_file)
+    done, interrupted = registrations["local_dataset_id"].iloc[-2:].tolist()
+    # Simulate a batch that completed the first dataset and was interrupted
+    # after deleting the endpoints of the second.
+    journal = _Journal(tmp_path / "job.jsonl")
+    for stage in ["endpoints_deleted", "endpoint_posted", "metadata_posted"]:
+        journal.record(done, stage)
+    journal.record(done, "synchronized")
+    journal.record(interrupted, "endpoints_deleted")
+    mocker.patch("gbif_registrar.upload.sleep")
+    delete = mocker.patch("gbif_registrar._utilities._delete_local_dataset_endpoints")
+    post_endpoint = mocker.patch(
+        "gbif_registrar._utilities._post_local_dataset_endpoint"
+    )
+    mocker.patch("gbif_registrar._utilities._post_new_metadata_document")
+    # The GBIF dataset has no endpoints, which fails the first check
+    mocker.patch(
+        "gbif_registrar._utilities._is_synchronized",
+        side_effect=[IndexError(), True],
+    )
+    upload_datasets(
+        [done, interrupted], unsynchronized_file, tmp_path / "job.jsonl", resume=True
+    )
+    captured = capsys.readouterr()
+    assert f"Skipping {done}, uploaded in a previous run." in captured.out
+    delete.assert_not_called()
+    post_endpoint.assert_called_once()
+    journal = _Journal(tmp_path / "job.jsonl", resume=True)
+    assert journal.completed(interrupted, "synchronized")
+    # The status of the completed dataset, which the interrupted run hadn't
+    # written yet, is restored from the journal.
+    assert _read_registrations_file(unsynchronized_file)["synchronized"].all()
+    unload_configuration()
+
+
+def test_upload_datasets_requires_journal_to_resume(unsynchronized_file):
+    """Resuming without a journal is an error."""
+    with pytest.raises(ValueError):
+        upload_datasets(["edi.941.3"], unsynchronized_file, resume=True)
+
+
+def test_shard_of_keeps_groups_together(registrations):
+    """All registrations of a group are assigned to the same shard, and every
+    registration is assigned to exactly one shard."""
+    shards = _shard_of(registrations, 3)
+    assert shards.between(0, 2).all()
+    assert (
+        shards.groupby(registrations["local_dataset_group_id"]).nunique() == 1
+    ).all()
+    assert shards.equals(_shard_of(registrations, 3))  # Deterministic
+
+
+def test_upload_shard_and_merge_results(unsynchronized_file, tmp_path, mocker):
+    """Each shard uploads only its own pending registrations, and the merged
+    results update the registrations file."""
+    uploaded = []
+
+    def fake_upload(
+        local_dataset_id, registrations_file, journal, status_buffer, config
+    ):
+        """Mark the dataset as synchronized without uploading it."""
+        assert registrations_file is status_buffer.registry
+        uploaded.append(local_dataset_id)
+        status_buffer.mark_synchronized(local_dataset_id)
+
+    mocker.patch("gbif_registrar.batch.upload_dataset", side_effect=fake_upload)
+    result_files = [tmp_path / f"shard_{shard}.csv" for shard in range(2)]
+    for shard, result_file in enumerate(result_files):
+        upload_shard(unsynchronized_file, shard, 2, result_file)
+    registrations = _read_registrations_file(unsynchronized_file)
+    assert sorted(uploaded) == sorted(registrations["local_dataset_id"].iloc[-2:])
+    merge_shard_results(unsynchronized_file, result_files[::-1])
+    registrations_final = _read_registrations_file(unsynchronized_file)
+    assert registrations_final["synchronized"].all()
+    assert registrations_final.shape == registrations.shape
+
+
+def test_merge_shard_results_writes_changed_rows_only(registrations, tmp_path, mocker):
+    """Only the registrations a shard changed are written back."""
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    shard = _read_registrations_file(tmp_path / "registrations.csv")
+    shard.loc[shard.index[-1], "synchronized"] = False
+    shard.to_csv(tmp_path / "shard_0.csv", index=False)
+    registry = Registry.load(tmp_path / "registrations.csv")
+    mock_save = mocker.patch.object(registry, "save")
+    merge_shard_results(registry, [tmp_path / "shard_0.csv"])
+    mock_save.assert_called_once()
+    assert registry._dirty == {len(registrations) - 1}  # pylint: disable=W0212
+
+
+def test_merge_shard_results_rejects_overlapping_shards(registrations, tmp_path):
+    """Result files that share registrations are not from one partitioning."""
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    registrations.iloc[0:3].to_csv(tmp_path / "shard_0.csv", index=False)
+    registrations.iloc[2:].to_csv(tmp_path / "shard_1.csv", index=False)
+    with pytest.raises(ValueError):
+        merge_shard_results(
+            tmp_path / "registrations.csv",
+            [tmp_path / "shard_0.csv", tmp_path / "shard_1.csv"],
+        )
+
+
+def test_plan_latest_replaces_superseded_revisions(registrations):
+    """Each dataset is replaced by the latest revision of its group, once."""
+    registry = Registry(registrations)
+    planned, superseded = _plan_latest(
+        ["edi.193.4", "edi.356.1", "edi.193.5", "edi.941.3"], registry
+    )
+    assert planned == ["edi.193.5", "edi.356.2", "edi.941.3"]
+    assert superseded == {"edi.193.4": "edi.193.5", "edi.356.1": "edi.356.2"}
+
+
+def test_upload_datasets_latest_only(unsynchronized_file, mocker):
+    """Only the latest revision is uploaded, and the superseded revision is
+    skipped without changing its synchronization status."""
+    registry = Registry.load(unsynchronized_file)
+    registry.update("edi.356.1", synchronized=False)
+    mock_upload = mocker.patch(
+        "gbif_registrar.batch.upload_dataset",
+        side_effect=lambda local_dataset_id, registry, **kwargs: kwargs[
+            "status_buffer"
+        ].mark_synchronized(local_dataset_id),
+    )
+    upload_datasets(["edi.356.1", "edi.356.2"], registry, latest_only=True)
+    uploaded = [call.args[0] for call in mock_upload.call_args_list]
+    assert uploaded == ["edi.356.2"]
+    assert registry.get("edi.356.2")["synchronized"]
+    assert not registry.get("edi.356.1")["synchronized"]
+    results = _read_registrations_file(unsynchronized_file)
+    assert not results.set_index("local_dataset_id").at["edi.356.1", "synchronized"]
+
+
+def test_upload_datasets_prefetches_metadata(unsynchronized_file, mocker):
+    """The prefetcher is advanced before each upload."""
+    load_configuration("tests/test_config.json")
+    advance = mocker.patch("gbif_registrar.batch._Prefetcher.advance")
+    mock_upload = mocker.patch("gbif_registrar.batch.upload_dataset")
+    registrations = _read_registrations_file(unsynchronized_file)
+    local_dataset_ids = registrations["local_dataset_id"].tolist()
+    upload_datasets(local_dataset_ids, unsynchronized_file, prefetch=2)
+    assert [call.args[0] for call in advance.call_args_list] == list(range(7))
+    assert mock_upload.call_count == 7
+    unload_configuration()
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="Workers inherit the mocks only when forked.",
+)
+def test_upload_datasets_in_processes_writes_worker_statuses(
+    unsynchronized_file, mocker
+):
+    """Statuses set by uploads in worker processes are written to the
+    registrations file by the parent."""
+    load_configuration("tests/test_config.json")
+    mocker.patch("gbif_registrar._utilities._is_synchronized", return_value=True)
+    registrations = _read_registrations_file(unsynchronized_file)
+    local_dataset_ids = registrations["local_dataset_id"].iloc[-2:].tolist()
+    upload_datasets_in_processes(
+        local_dataset_ids,
+        unsynchronized_file,
+        max_workers=2,
+        mp_context=multiprocessing.get_context("fork"),
+    )
+    assert _read_registrations_file(unsynchronized_file)["synchronized"].all()
+    unload_configuration()
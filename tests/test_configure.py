@@ -1,8 +1,14 @@
 """Test the configure.py module"""
 
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
 from json import load
 from os import environ
+import pickle
+import pytest
+from gbif_registrar._utilities import _read_gbif_dataset_metadata
 from gbif_registrar.configure import (
+    Config,
     load_configuration,
     unload_configuration,
     initialize_configuration_file,
@@ -53,3 +59,51 @@ def test_initialize_configuration_file(tmp_path):
         assert "REGISTRY_BASE_URL" in config
         assert "GBIF_DATASET_BASE_URL" in config
         assert "PASTA_ENVIRONMENT" in config
+
+
+def test_config_from_file_is_immutable():
+    """A Config has the keys of the configuration file, can't be changed, and
+    doesn't reveal the password."""
+    config = Config.from_file("tests/test_config.json")
+    assert config.gbif_api == "http://api.gbif-uat.org/v1/dataset"
+    assert config.pasta_environment == "https://pasta-s.lternet.edu"
+    assert not config.options
+    assert "Demo123" not in repr(config)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        config.gbif_api = "https://api.gbif.org/v1/dataset"
+    load_configuration("tests/test_config.json")
+    assert Config.from_environ() == config
+    unload_configuration()
+
+
+def test_configs_target_environments_concurrently(mocker):
+    """Threads using different Configs send requests to their own hosts."""
+    uat = Config.from_file("tests/test_config.json")
+    prod = dataclasses.replace(uat, gbif_api="https://api.gbif.org/v1/dataset")
+    response = mocker.Mock(status_code=200, text="{}")
+    mock_get = mocker.patch("requests.Session.get", return_value=response)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(_read_gbif_dataset_metadata, ["uuid", "uuid"], [uat, prod]))
+    urls = sorted(call.args[0] for call in mock_get.call_args_list)
+    assert urls == [
+        "http://api.gbif-uat.org/v1/dataset/uuid",
+        "https://api.gbif.org/v1/dataset/uuid",
+    ]
+    assert "USER_NAME" not in environ
+
+
+def test_config_can_be_pickled():
+    """A Config can be sent to worker processes, with its options."""
+    settings = Config.from_file("tests/test_config.json").__dict__
+    settings = {key.upper(): value for key, value in settings.items()}
+    settings.update(PASTA_SCOPES="edi,knb-lter-msp", RETRY_ATTEMPTS="2")
+    config = Config.from_mapping(settings)
+    assert dict(config.options) == {
+        "PASTA_SCOPES": "edi,knb-lter-msp",
+        "RETRY_ATTEMPTS": "2",
+    }
+    restored = pickle.loads(pickle.dumps(config))
+    assert restored == config
+    assert restored.options["PASTA_SCOPES"] == "edi,knb-lter-msp"
+    assert restored.option("RETRY_ATTEMPTS") == "2"
+    assert restored.option("RETRY_BACKOFF") == "1"
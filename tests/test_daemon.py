@@ -0,0 +1,171 @@
+"""Test the daemon.py module."""
+
+import json
+import threading
+import time
+import requests
+from gbif_registrar.daemon import Daemon
+from gbif_registrar.registry import Registry
+
+
+def wait_for(condition, timeout=10):
+    """Wait until a condition is true."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for the daemon."
+        time.sleep(0.01)
+
+
+def test_daemon_drains_pending_registrations(registrations, tmp_path, mocker):
+    """Incomplete registrations are completed and unsynchronized datasets are
+    uploaded, and the status is served until the daemon stops."""
+    registrations.loc[registrations.index[-1], "synchronized"] = False
+    registrations.loc[registrations.index[-2], "gbif_dataset_uuid"] = None
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    registry = Registry.load(tmp_path / "registrations.csv")
+    incomplete_id = registry.data.at[registry.data.index[-2], "local_dataset_id"]
+    unsynchronized_id = registry.data.at[registry.data.index[-1], "local_dataset_id"]
+    mock_complete = mocker.patch("gbif_registrar.daemon.complete_registration_records")
+    mock_upload = mocker.patch(
+        "gbif_registrar.daemon.upload_dataset",
+        side_effect=lambda local_dataset_id, registry, config: registry.update(
+            local_dataset_id, synchronized=True
+        ),
+    )
+    daemon = Daemon(registry, interval=0.05, health_port=0)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        wait_for(lambda: daemon.status()["uploaded"] == 1)
+        mock_complete.assert_any_call(registry, incomplete_id, config=None)
+        mock_upload.assert_called_once_with(unsynchronized_id, registry, config=None)
+        response = requests.get(daemon.health_url, timeout=5)
+        assert response.status_code == 200
+        status = json.loads(response.text)
+        assert status["state"] == "running"
+        assert status["pending"] == 0
+        response = requests.get(daemon.health_url[: -len("health")] + "metrics")
+        assert "# TYPE gbif_registrar_datasets_synced_total counter" in response.text
+    finally:
+        daemon.stop()
+        thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert daemon.status()["state"] == "stopped"
+    assert daemon.health_url is None
+
+
+def test_daemon_survives_failing_tasks(registrations, tmp_path, mocker):
+    """A failing upload is recorded in the status and retried on later scans."""
+    registrations.loc[registrations.index[-1], "synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    mock_upload = mocker.patch(
+        "gbif_registrar.daemon.upload_dataset", side_effect=RuntimeError("GBIF down")
+    )
+    daemon = Daemon(tmp_path / "registrations.csv", interval=0.01)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        wait_for(lambda: mock_upload.call_count >= 2)
+    finally:
+        daemon.stop()
+        thread.join(timeout=10)
+    status = daemon.status()
+    assert status["failures"] >= 2
+    assert status["last_error"] == "RuntimeError('GBIF down')"
+    assert status["pending"] == 1
+
+
+def test_daemon_reloads_changed_registrations_file(registrations, tmp_path):
+    """Registrations added to the file by another process are picked up."""
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    daemon = Daemon(tmp_path / "registrations.csv", interval=0.01)
+    other = Registry.load(tmp_path / "registrations.csv")
+    other.add("edi.1.1", synchronized=True)
+    other.save()
+    daemon._mtime = None  # pylint: disable=protected-access
+    daemon._reload_if_changed()  # pylint: disable=protected-access
+    assert "edi.1.1" in daemon.registry
+
+
+def test_daemon_stop_skips_queued_tasks(registrations, tmp_path, mocker):
+    """Stopping the daemon waits for the running task only, not the queue."""
+    registrations["synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    started = threading.Event()
+
+    def slow_upload(local_dataset_id, registry, config):
+        started.set()
+        time.sleep(0.2)
+
+    mock_upload = mocker.patch(
+        "gbif_registrar.daemon.upload_dataset", side_effect=slow_upload
+    )
+    daemon = Daemon(tmp_path / "registrations.csv", interval=60)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    assert started.wait(timeout=10)
+    daemon.stop()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert mock_upload.call_count == 1
+    assert daemon.status()["queued"] == 0
+
+
+def test_daemon_delays_unsuccessful_uploads(registrations, tmp_path, mocker):
+    """A dataset left unsynchronized by its upload isn't uploaded again on the
+    next scan, and is uploaded again once its delay has passed."""
+    registrations.loc[registrations.index[-1], "synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    local_dataset_id = registrations.at[registrations.index[-1], "local_dataset_id"]
+    mocker.patch("gbif_registrar.daemon.upload_dataset")
+    daemon = Daemon(tmp_path / "registrations.csv", interval=60)
+    daemon._upload(local_dataset_id)  # pylint: disable=protected-access
+    daemon._scan()  # pylint: disable=protected-access
+    assert daemon.status()["queued"] == 0
+    attempts, retry_at = daemon._retries[local_dataset_id]  # pylint: disable=W0212
+    assert attempts == 1
+    assert retry_at - time.monotonic() > 60
+    daemon._retries[local_dataset_id] = (
+        attempts,
+        time.monotonic(),
+    )  # pylint: disable=W0212
+    daemon._scan()  # pylint: disable=protected-access
+    assert daemon.status()["queued"] == 1
+
+
+def test_daemon_keeps_registry_after_own_writes(registrations, tmp_path, mocker):
+    """The daemon's own writes to the registrations file don't reload the
+    registry on the next scan, while writes by other processes do."""
+    registrations.loc[registrations.index[-1], "synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    local_dataset_id = registrations.at[registrations.index[-1], "local_dataset_id"]
+
+    def upload(local_dataset_id, registry, config):
+        registry.update(local_dataset_id, synchronized=True)
+        registry.save()
+
+    mocker.patch("gbif_registrar.daemon.upload_dataset", side_effect=upload)
+    daemon = Daemon(tmp_path / "registrations.csv", interval=60)
+    reload = mocker.spy(daemon.registry, "reload")
+    daemon._upload(local_dataset_id)  # pylint: disable=protected-access
+    daemon._reload_if_changed()  # pylint: disable=protected-access
+    reload.assert_not_called()
+    other = Registry.load(tmp_path / "registrations.csv")
+    other.add("edi.1.1", synchronized=True)
+    time.sleep(0.01)  # So the file's modification time changes
+    other.save()
+    daemon._reload_if_changed()  # pylint: disable=protected-access
+    reload.assert_called_once()
+    assert "edi.1.1" in daemon.registry
+
+
+def test_daemon_skips_superseded_revisions(registrations, tmp_path):
+    """Unsynchronized revisions with a newer revision in their group aren't
+    uploaded."""
+    registrations.loc[
+        registrations["local_dataset_id"] == "edi.356.1", "synchronized"
+    ] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    daemon = Daemon(tmp_path / "registrations.csv", interval=60)
+    daemon._scan()  # pylint: disable=protected-access
+    assert daemon.status()["queued"] == 0
@@ -0,0 +1,53 @@
+"""Test the metrics.py module."""
+
+from gbif_registrar import _http
+from gbif_registrar.configure import load_configuration, unload_configuration
+from gbif_registrar.metrics import render_metrics, reset_metrics, write_metrics
+from gbif_registrar.upload import upload_dataset
+
+
+def test_requests_are_counted_by_host_and_status(mocker, tmp_path):
+    """Each request is counted by host, method, and status, and timed, and
+    the metrics are written in the textfile format."""
+    reset_metrics()
+    mocker.patch("requests.Session.get", return_value=mocker.Mock(status_code=404))
+    _http._request("GET", "https://api.gbif-uat.org/v1/dataset/x")
+    _http._request("GET", "https://api.gbif-uat.org/v1/dataset/y")
+    write_metrics(tmp_path / "gbif_registrar.prom")
+    with open(tmp_path / "gbif_registrar.prom", "r", encoding="utf-8") as metrics:
+        text = metrics.read()
+    assert (
+        'gbif_registrar_http_requests_total{host="api.gbif-uat.org",'
+        'method="GET",status="404"} 2'
+    ) in text
+    assert (
+        'gbif_registrar_http_request_duration_seconds_bucket{host="api.gbif-uat.org",'
+        'le="+Inf"} 2'
+    ) in text
+    assert [path.name for path in tmp_path.iterdir()] == ["gbif_registrar.prom"]
+    reset_metrics()
+
+
+def test_upload_counts_uploads_and_time_to_sync(registrations, tmp_path, mocker):
+    """An upload is counted, and the time until it synchronized is recorded."""
+    reset_metrics()
+    load_configuration("tests/test_config.json")
+    registrations.loc[0, "synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    mocker.patch("gbif_registrar.upload.sleep")
+    mocker.patch("gbif_registrar._utilities._delete_local_dataset_endpoints")
+    mocker.patch("gbif_registrar._utilities._post_local_dataset_endpoint")
+    mocker.patch("gbif_registrar._utilities._post_new_metadata_document")
+    mocker.patch(
+        "gbif_registrar._utilities._is_synchronized", side_effect=[False, False, True]
+    )
+    upload_dataset(
+        registrations.loc[0, "local_dataset_id"], tmp_path / "registrations.csv"
+    )
+    text = render_metrics()
+    assert "gbif_registrar_datasets_uploaded_total 1" in text
+    assert "gbif_registrar_datasets_synced_total 1" in text
+    assert "gbif_registrar_time_to_sync_seconds_count 1" in text
+    assert "gbif_registrar_sync_timeouts_total 1" not in text
+    unload_configuration()
+    reset_metrics()
@@ -0,0 +1,52 @@
+"""Test the partitions.py module."""
+
+import os
+import pandas as pd
+import pytest
+from gbif_registrar._utilities import _read_registrations_file
+from gbif_registrar.partitions import combine_partitions, partition_registrations
+from gbif_registrar.registry import Registry
+
+
+@pytest.mark.parametrize("partition_by", ["scope", "bucket"])
+def test_partitioning_is_lossless(partition_by, tmp_path):
+    """Combining the partitions writes back the registrations file, with
+    registrations of interleaved partitions in their original order."""
+    partition_registrations(
+        "tests/registrations.csv", tmp_path / "registrations", partition_by, 4
+    )
+    assert "manifest.json" in os.listdir(tmp_path / "registrations")
+    combine_partitions(tmp_path / "registrations", tmp_path / "registrations.csv")
+    pd.testing.assert_frame_equal(
+        _read_registrations_file(tmp_path / "registrations.csv"),
+        _read_registrations_file("tests/registrations.csv"),
+    )
+    with pytest.raises(ValueError):
+        partition_registrations("tests/registrations.csv", tmp_path / "registrations")
+
+
+def test_registry_reads_and_writes_only_needed_partitions(tmp_path):
+    """A registry loaded for some datasets reads only their partitions, and
+    saving it rewrites only the partitions it changed."""
+    directory = tmp_path / "registrations"
+    partition_registrations("tests/registrations.csv", directory)
+    untouched = os.stat(directory / "edi.csv")
+    registry = Registry.load(directory, local_dataset_ids=["knb-lter-msp.1.2"])
+    assert registry.partitions == ["knb-lter-msp"]
+    assert registry.data["local_dataset_id"].tolist() == [
+        "knb-lter-msp.1.1",
+        "knb-lter-msp.1.2",
+    ]
+    registry.update("knb-lter-msp.1.2", synchronized=False)
+    registry.add("knb-lter-msp.1.3", local_dataset_group_id="knb-lter-msp.1")
+    registry.add("knb-lter-sbc.1.1", local_dataset_group_id="knb-lter-sbc.1")
+    registry.save()
+    assert os.stat(directory / "edi.csv").st_ino == untouched.st_ino
+    registrations = _read_registrations_file(directory)
+    assert registrations["local_dataset_id"].tolist()[-3:] == [
+        "edi.941.3",
+        "knb-lter-msp.1.3",
+        "knb-lter-sbc.1.1",
+    ]
+    assert not registrations.loc[5, "synchronized"]
+    assert len(_read_registrations_file(directory / "knb-lter-sbc.csv")) == 1
@@ -0,0 +1,82 @@
+"""Test the planner.py module."""
+
+from gbif_registrar.planner import execute_plan, plan_batch
+from gbif_registrar.registry import Registry
+
+
+def test_plan_batch_orders_and_dedupes_operations(registrations):
+    """New datasets are registered before upload, uploads of a group run in
+    order, and a new group's UUID is requested once."""
+    registrations.loc[registrations.index[-1], "synchronized"] = False
+    registry = Registry(registrations)
+    plan = plan_batch(["edi.941.3", "edi.941.4", "edi.5.1", "edi.5.2"], registry)
+    tasks = [(task["task"], task["local_dataset_id"]) for task in plan.tasks]
+    assert tasks == [
+        ("upload", "edi.941.3"),
+        ("register", "edi.941.4"),
+        ("upload", "edi.941.4"),
+        ("register", "edi.5.1"),
+        ("upload", "edi.5.1"),
+        ("register", "edi.5.2"),
+        ("upload", "edi.5.2"),
+    ]
+    assert plan.tasks[2]["requires"] == [
+        ("register", "edi.941.4"),
+        ("upload", "edi.941.3"),
+    ]
+    assert plan.tasks[4]["requires"] == [("register", "edi.5.1")]
+    assert [key for key in plan.operations if key[2] == "dataset edi.5"] == [
+        ("GBIF", "POST", "dataset edi.5")
+    ]
+    # One metadata read per upload, though each upload uses it twice.
+    assert plan.estimate()[("PASTA", "GET")] == 4
+    assert plan.estimate(maximum=True)[("PASTA", "GET")] == 4
+    # Each upload lists its endpoints once, and checks synchronization 2 to
+    # 13 times.
+    assert plan.estimate()[("GBIF", "GET")] == 4 * (1 + 2)
+    assert plan.estimate(maximum=True)[("GBIF", "GET")] == 4 * (1 + 13)
+    assert "GBIF GET: 12 to 56 requests" in str(plan)
+    assert "1 duplicate operations removed" in str(plan)
+
+
+def test_plan_batch_skips_synchronized_datasets(registrations):
+    """Synchronized datasets have nothing to do."""
+    plan = plan_batch(
+        registrations["local_dataset_id"].tolist(), Registry(registrations)
+    )
+    assert not plan.tasks
+    assert not plan.estimate()
+
+
+def test_execute_plan(registrations, mocker):
+    """Registrations run first, and a dry run runs nothing."""
+    registry = Registry(registrations)
+    calls = []
+    mocker.patch(
+        "gbif_registrar.planner.register_dataset",
+        side_effect=lambda local_dataset_id, registry, config: calls.append(
+            ("register", local_dataset_id)
+        ),
+    )
+    mocker.patch(
+        "gbif_registrar.planner.upload_dataset",
+        side_effect=lambda local_dataset_id, registry, status_buffer, config: calls.append(
+            ("upload", local_dataset_id)
+        ),
+    )
+    plan = plan_batch(["edi.5.1", "edi.5.2", "edi.6.1"], registry)
+    execute_plan(plan, dry_run=True)
+    assert not calls
+    execute_plan(plan, max_workers=2)
+    assert calls[:3] == [
+        ("register", "edi.5.1"),
+        ("register", "edi.5.2"),
+        ("register", "edi.6.1"),
+    ]
+    uploads = [call for call in calls if call[0] == "upload"]
+    assert sorted(uploads) == [
+        ("upload", "edi.5.1"),
+        ("upload", "edi.5.2"),
+        ("upload", "edi.6.1"),
+    ]
+    assert uploads.index(("upload", "edi.5.1")) < uploads.index(("upload", "edi.5.2"))
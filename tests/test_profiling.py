@@ -0,0 +1,41 @@
+"""Test the profiling.py module."""
+
+import json
+import pytest
+from gbif_registrar import profiling
+from gbif_registrar.profiling import profile_memory
+from gbif_registrar.validate import validate_registrations
+
+
+def test_profile_memory_records_operations_and_checks(tmp_path):
+    """Validating within profile_memory records the validation and each of
+    its checks, passes each record to the hooks, and writes the report."""
+    hooked = []
+    with profile_memory(tmp_path / "memory.json", top=5, hooks=[hooked.append]) as (
+        profile
+    ):
+        validate_registrations("tests/registrations.csv")
+    operations = [record["operation"] for record in profile.records]
+    assert operations[-1] == "validate_registrations"
+    assert "_check_completeness" in operations
+    assert "_check_local_dataset_group_id_format" in operations
+    assert hooked == profile.records
+    for record in profile.records:
+        assert record["peak_bytes"] >= max(record["net_bytes"], 0)
+        assert len(record["top_lines"]) <= 5
+    # The validation's peak includes those of its checks.
+    peaks = profile.peaks()
+    assert peaks["validate_registrations"] >= peaks["_check_completeness"]
+    with open(tmp_path / "memory.json", "r", encoding="utf-8") as report:
+        assert json.load(report) == profile.records
+    assert profiling._profile is None
+
+
+def test_profile_memory_is_not_reentrant():
+    """Operations are only profiled in a block, and blocks can't be nested."""
+    with profile_memory(top=0) as profile:
+        with pytest.raises(RuntimeError):
+            with profile_memory():
+                pass
+    validate_registrations("tests/registrations.csv")
+    assert not profile.records
@@ -0,0 +1,125 @@
+"""Test the registry.py module."""
+
+import warnings
+import pandas as pd
+import pytest
+from gbif_registrar._utilities import _read_registrations_file
+from gbif_registrar.configure import load_configuration, unload_configuration
+from gbif_registrar.register import register_dataset
+from gbif_registrar.registry import Registry
+from gbif_registrar.validate import validate_registrations
+
+
+@pytest.fixture(name="registrations_file")
+def registrations_file_fixture(registrations, tmp_path):
+    """Write a copy of the test registrations file for tests to modify."""
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    return tmp_path / "registrations.csv"
+
+
+def test_registry_looks_up_datasets_and_groups(registrations_file):
+    """Registrations are found by local_dataset_id and local_dataset_group_id."""
+    registry = Registry.load(registrations_file)
+    assert len(registry) == 7
+    assert "edi.193.5" in registry
+    assert "edi.193.6" not in registry
+    assert registry.get("edi.193.5")["local_dataset_group_id"] == "edi.193"
+    assert registry.get("edi.193.6") is None
+    assert registry.group("edi.193")["local_dataset_id"].tolist() == [
+        "edi.193.4",
+        "edi.193.5",
+    ]
+    uuid = "e44c5367-9d09-4328-9a5a-d0f41fb22d61"
+    assert registry.gbif_dataset_uuid_of("edi.193") == uuid
+    assert registry.gbif_dataset_uuid_of("edi.929") is None
+
+
+def test_registry_add_and_update_maintain_indexes(registrations_file):
+    """Added and updated registrations are reflected in the indexes."""
+    registry = Registry.load(registrations_file)
+    registry.add("edi.929.1", synchronized=False)
+    assert registry.incomplete() == ["edi.929.1"]
+    registry.update("edi.929.1", local_dataset_group_id="edi.929")
+    registry.update("edi.929.1", gbif_dataset_uuid="a_new_uuid")
+    assert registry.gbif_dataset_uuid_of("edi.929") == "a_new_uuid"
+    with pytest.raises(ValueError):
+        registry.add("edi.929.1")
+    with pytest.raises(KeyError):
+        registry.update("edi.929.2", synchronized=True)
+
+
+def test_registry_update_keeps_local_dataset_id(registrations_file):
+    """The local_dataset_id of a registration can't be changed by an update,
+    which would leave it indexed under the old one."""
+    registry = Registry.load(registrations_file)
+    registry.update("edi.193.5", local_dataset_id="edi.193.5", synchronized=False)
+    with pytest.raises(ValueError):
+        registry.update("edi.193.5", local_dataset_id="edi.193.6")
+    assert registry.get("edi.193.5")["local_dataset_id"] == "edi.193.5"
+    assert "edi.193.6" not in registry
+
+
+def test_registry_save_writes_only_changed_rows(registrations_file):
+    """Saving merges only changed rows, preserving other changes to the file."""
+    registry = Registry.load(registrations_file)
+    registry.update("edi.193.4", synchronized=False)
+    # Another process changes a different row in the meantime
+    registrations = _read_registrations_file(registrations_file)
+    registrations.loc[6, "synchronized"] = False
+    registrations.to_csv(registrations_file, index=False)
+    registry.save()
+    synchronized = _read_registrations_file(registrations_file)["synchronized"]
+    assert synchronized.tolist() == [False, True, True, True, True, True, False]
+
+
+def test_registry_in_memory_only(registrations):
+    """A registry without a registrations file is not saved anywhere."""
+    registry = Registry(registrations)
+    registry.update("edi.193.4", synchronized=False)
+    registry.save()
+    assert not registry.get("edi.193.4")["synchronized"]
+
+
+def test_public_functions_accept_a_registry(registrations_file, mocker):
+    """Functions accepting a registrations file path also accept a Registry,
+    and then don't read the file again."""
+    load_configuration("tests/test_config.json")
+    registry = Registry.load(registrations_file)
+    read = mocker.patch("gbif_registrar.registry._read_registrations_file")
+    mocker.patch(
+        "gbif_registrar.register._get_gbif_dataset_uuid", return_value="a_new_uuid"
+    )
+    register_dataset("edi.929.2", registry)
+    assert registry.get("edi.929.2")["gbif_dataset_uuid"] == "a_new_uuid"
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter("always")
+        validate_registrations(registry)
+        assert "Unsynchronized registrations in rows: 8" in str(warns[0].message)
+    read.assert_not_called()
+    registrations_final = _read_registrations_file(registrations_file)
+    assert registrations_final.iloc[-1]["local_dataset_id"] == "edi.929.2"
+    assert isinstance(registry.data, pd.DataFrame)
+    unload_configuration()
+
+
+def test_reload_reads_changes_by_other_processes(tmp_path, registrations):
+    """Reloading picks up rows written to the file by another registry."""
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    registry = Registry.load(tmp_path / "registrations.csv")
+    other = Registry.load(tmp_path / "registrations.csv")
+    other.add("edi.1.1", local_dataset_group_id="edi.1", synchronized=False)
+    other.save()
+    assert "edi.1.1" not in registry
+    registry.reload()
+    assert "edi.1.1" in registry
+    assert registry.group("edi.1")["local_dataset_id"].tolist() == ["edi.1.1"]
+
+
+def test_parsed_ids_follow_added_registrations(registrations):
+    """Identifiers are parsed once, and again after a registration is added."""
+    registry = Registry(registrations)
+    parsed = registry.parsed_ids
+    assert registry.parsed_ids is parsed
+    assert parsed["valid"].all()
+    registry.add("edi.999")
+    assert registry.parsed_ids["valid"].tolist() == [True] * 7 + [False]
@@ -0,0 +1,82 @@
+"""Test the reservations.py module."""
+
+import dataclasses
+import json
+import pytest
+import requests
+from gbif_registrar.configure import Config
+from gbif_registrar.register import register_dataset
+from gbif_registrar.registry import Registry
+from gbif_registrar.reservations import UuidPool
+
+
+@pytest.fixture(name="config")
+def config_fixture():
+    """The test configuration."""
+    return Config.from_file("tests/test_config.json")
+
+
+def test_pool_fills_hands_out_and_reaps(tmp_path, mocker, config):
+    """The pool is filled to its depth, hands out the oldest UUID, and
+    deletes expired reservations from GBIF."""
+    uuids = iter(["uuid-1", "uuid-2", "uuid-3"])
+    mocker.patch(
+        "gbif_registrar.reservations._request_gbif_dataset_uuid",
+        side_effect=lambda config: next(uuids),
+    )
+    mock_delete = mocker.patch("gbif_registrar.reservations._delete_gbif_dataset")
+    pool = UuidPool(tmp_path / "pool.json", depth=2, config=config)
+    assert pool.fill() == 2
+    assert pool.take() == "uuid-1"
+    assert pool.fill() == 1
+    # The reservations are kept in the pool file for other processes.
+    assert len(UuidPool(tmp_path / "pool.json", config=config)) == 2
+    assert pool.reap(max_age=0) == ["uuid-2", "uuid-3"]
+    mock_delete.assert_any_call("uuid-2", config)
+    assert pool.take() is None
+    with open(tmp_path / "pool.json", "r", encoding="utf-8") as pool_file:
+        assert json.load(pool_file)["gbif_api"] == config.gbif_api
+
+
+def test_register_dataset_takes_uuid_from_pool(tmp_path, mocker, config):
+    """A new dataset group is assigned a reserved UUID without a request to
+    GBIF, and GBIF is asked when the pool is empty."""
+    mocker.patch(
+        "gbif_registrar.reservations._request_gbif_dataset_uuid",
+        return_value="reserved",
+    )
+    mock_request = mocker.patch(
+        "gbif_registrar._utilities._request_gbif_dataset_uuid",
+        return_value="requested",
+    )
+    pool = UuidPool(tmp_path / "pool.json", depth=1, config=config)
+    pool.fill()
+    registry = Registry(Registry.load("tests/registrations.csv").data)
+    register_dataset("edi.1.1", registry, config, uuid_pool=pool)
+    register_dataset("edi.2.1", registry, config, uuid_pool=pool)
+    assert registry.get("edi.1.1")["gbif_dataset_uuid"] == "reserved"
+    assert registry.get("edi.2.1")["gbif_dataset_uuid"] == "requested"
+    mock_request.assert_called_once()
+
+
+def test_pool_rejects_another_environment(tmp_path, mocker, config):
+    """A pool file of one GBIF environment can't be used with another."""
+    mocker.patch(
+        "gbif_registrar.reservations._request_gbif_dataset_uuid",
+        return_value="uuid-1",
+    )
+    UuidPool(tmp_path / "pool.json", depth=1, config=config).fill()
+    prod = dataclasses.replace(config, gbif_api="https://api.gbif.org/v1/dataset")
+    with pytest.raises(ValueError):
+        UuidPool(tmp_path / "pool.json", config=prod)
+
+
+def test_pool_fill_stops_when_gbif_fails(tmp_path, mocker, config):
+    """A failed request ends the fill, keeping the UUIDs already added."""
+    mocker.patch(
+        "gbif_registrar.reservations._request_gbif_dataset_uuid",
+        side_effect=["uuid-1", requests.HTTPError("500 Server Error")],
+    )
+    pool = UuidPool(tmp_path / "pool.json", depth=3, config=config)
+    assert pool.fill() == 1
+    assert pool.take() == "uuid-1"
@@ -0,0 +1,56 @@
+"""Test the snapshot.py module."""
+
+import queue
+import pandas as pd
+import pytest
+from gbif_registrar._utilities import _read_registrations_file
+from gbif_registrar.registry import Registry
+from gbif_registrar.snapshot import (
+    RegistrySnapshot,
+    apply_status_changes,
+    publish_snapshot,
+)
+
+
+def test_snapshot_lookups_match_registry(registrations, tmp_path):
+    """Every registration is found in the snapshot as it is in the registry,
+    including missing values and unicode."""
+    registrations.loc[0, "gbif_dataset_uuid"] = None
+    registrations.loc[1, "local_dataset_endpoint"] = "https://example.org/é"
+    registrations.loc[2, "synchronized"] = pd.NA
+    registry = Registry(registrations)
+    publish_snapshot(registry, tmp_path / "registrations.snapshot")
+    with RegistrySnapshot(tmp_path / "registrations.snapshot") as snapshot:
+        assert len(snapshot) == len(registry)
+        for local_dataset_id in registrations["local_dataset_id"]:
+            expected = {
+                col: None if pd.isna(value) else value
+                for col, value in registry.get(local_dataset_id).items()
+            }
+            assert snapshot.get(local_dataset_id) == expected
+        assert snapshot.get("edi.0.1") is None
+        assert "edi.0.1" not in snapshot
+    with pytest.raises(ValueError):
+        RegistrySnapshot("tests/registrations.csv")
+
+
+def test_snapshot_changes_are_applied_by_parent(registrations, tmp_path):
+    """Changes made through a snapshot are seen by it, sent on the queue,
+    and written to the registrations file by apply_status_changes."""
+    registrations["synchronized"] = False
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    publish_snapshot(tmp_path / "registrations.csv", tmp_path / "snapshot")
+    status_queue = queue.Queue()
+    local_dataset_id = registrations["local_dataset_id"].iloc[-1]
+    with RegistrySnapshot(tmp_path / "snapshot", status_queue) as snapshot:
+        snapshot.update(local_dataset_id, synchronized=True)
+        snapshot.save()
+        assert snapshot.get(local_dataset_id)["synchronized"] is True
+        with pytest.raises(KeyError):
+            snapshot.update("edi.0.1", synchronized=True)
+    assert apply_status_changes(status_queue, tmp_path / "registrations.csv") == 1
+    assert apply_status_changes(status_queue, tmp_path / "registrations.csv") == 0
+    synchronized = _read_registrations_file(tmp_path / "registrations.csv")[
+        "synchronized"
+    ]
+    assert synchronized.tolist() == [False] * (len(registrations) - 1) + [True]
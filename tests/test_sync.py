@@ -0,0 +1,169 @@
+"""Test the sync.py module."""
+
+import json
+import os
+from os import environ
+import pytest
+import requests
+from gbif_registrar._utilities import _get_changed_local_datasets
+from gbif_registrar.configure import Config
+from gbif_registrar.registry import Registry
+from gbif_registrar.sync import sync_from_source
+
+
+@pytest.fixture(name="registrations_file")
+def registrations_file_fixture(registrations, tmp_path):
+    """Write a copy of the test registrations file."""
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    return tmp_path / "registrations.csv"
+
+
+@pytest.fixture(name="mock_register_and_upload")
+def mock_register_and_upload_fixture(mocker):
+    """Register datasets in the registry only, and don't upload them."""
+
+    def register(local_dataset_id, registry, config):
+        registry.add(local_dataset_id, synchronized=False)
+
+    mocker.patch("gbif_registrar.sync.register_dataset", side_effect=register)
+    return mocker.patch("gbif_registrar.sync.upload_datasets")
+
+
+def test_get_changed_local_datasets_skips_deletions(pasta):
+    """Created and revised datasets are listed in order of change, and deleted
+    datasets are not."""
+    pasta.changes = [
+        {
+            "packageId": "edi.2.1",
+            "date": "2023-06-02T00:00:00",
+            "action": "createDataPackage",
+        },
+        {
+            "packageId": "edi.1.2",
+            "date": "2023-06-01T00:00:00",
+            "action": "updateDataPackage",
+        },
+        {
+            "packageId": "edi.3.1",
+            "date": "2023-06-03T00:00:00",
+            "action": "deleteDataPackage",
+        },
+    ]
+    changes = _get_changed_local_datasets("edi", "2023-01-01T00:00:00")
+    assert changes == [
+        ("edi.1.2", "2023-06-01T00:00:00"),
+        ("edi.2.1", "2023-06-02T00:00:00"),
+    ]
+
+
+def test_sync_from_source_processes_only_new_datasets(
+    pasta, registrations_file, mock_register_and_upload
+):
+    """Registered datasets are skipped, and the watermark is advanced so the
+    next sync only lists newer changes."""
+    pasta.changes = [
+        {
+            "packageId": "edi.193.5",
+            "date": "2023-06-01T00:00:00",
+            "action": "updateDataPackage",
+        },
+        {
+            "packageId": "edi.193.6",
+            "date": "2023-06-02T00:00:00",
+            "action": "updateDataPackage",
+        },
+    ]
+    registry = Registry.load(registrations_file)
+    new_ids = sync_from_source(registry, ["edi"], since="2023-01-01T00:00:00")
+    assert new_ids == ["edi.193.6"]
+    assert "edi.193.6" in registry
+    mock_register_and_upload.assert_called_once_with(
+        ["edi.193.6"], registry, None, config=Config.from_environ()
+    )
+    with open(f"{registrations_file}.watermark", "r", encoding="utf-8") as file:
+        assert json.load(file) == {"edi": "2023-06-02T00:00:00"}
+
+    # The next sync starts from the watermark and finds nothing new.
+    pasta.requests.clear()
+    assert sync_from_source(registry, ["edi"]) == []
+    assert "fromDate=2023-06-02T00%3A00%3A00" in pasta.requests[0]
+
+
+def test_sync_from_source_requires_starting_point(pasta, registrations_file):
+    """A scope without a watermark requires a starting date."""
+    with pytest.raises(ValueError):
+        sync_from_source(registrations_file, ["edi"])
+    assert not pasta.requests
+
+
+def test_sync_from_source_uploads_unsynchronized_datasets(
+    pasta, registrations_file, mock_register_and_upload
+):
+    """Listed datasets that were registered, but whose upload failed, are
+    uploaded again rather than skipped."""
+    pasta.changes = [
+        {
+            "packageId": "edi.193.5",
+            "date": "2023-06-01T00:00:00",
+            "action": "updateDataPackage",
+        },
+        {
+            "packageId": "edi.193.6",
+            "date": "2023-06-02T00:00:00",
+            "action": "updateDataPackage",
+        },
+    ]
+    registry = Registry.load(registrations_file)
+    registry.update("edi.193.5", synchronized=False)
+    new_ids = sync_from_source(registry, ["edi"], since="2023-01-01T00:00:00")
+    assert new_ids == ["edi.193.6"]
+    mock_register_and_upload.assert_called_once_with(
+        ["edi.193.5", "edi.193.6"], registry, None, config=Config.from_environ()
+    )
+
+
+def test_sync_from_source_keeps_watermark_of_unsynchronized(
+    pasta, registrations_file, mocker
+):
+    """The watermark isn't advanced past a dataset whose upload didn't
+    synchronize it, so the next sync lists and uploads it again."""
+    pasta.changes = [
+        {
+            "packageId": f"edi.{number}.1",
+            "date": f"2023-06-0{number}T00:00:00",
+            "action": "createDataPackage",
+        }
+        for number in (1, 2, 3)
+    ]
+    mocker.patch(
+        "gbif_registrar.sync.register_dataset",
+        side_effect=lambda local_dataset_id, registry, config: registry.add(
+            local_dataset_id, synchronized=False
+        ),
+    )
+    mock_upload = mocker.patch(
+        "gbif_registrar.sync.upload_datasets",
+        side_effect=lambda local_dataset_ids, registry, *args, **kwargs: [
+            registry.update(local_dataset_id, synchronized=True)
+            for local_dataset_id in local_dataset_ids
+            # The upload of edi.2.1 times out in the first sync only.
+            if local_dataset_id != "edi.2.1" or len(local_dataset_ids) == 1
+        ],
+    )
+    registry = Registry.load(registrations_file)
+    sync_from_source(registry, ["edi"], since="2023-01-01T00:00:00")
+    with open(f"{registrations_file}.watermark", "r", encoding="utf-8") as file:
+        assert json.load(file) == {"edi": "2023-06-02T00:00:00"}
+    assert sync_from_source(registry, ["edi"]) == []
+    assert mock_upload.call_args.args[0] == ["edi.2.1"]
+    with open(f"{registrations_file}.watermark", "r", encoding="utf-8") as file:
+        assert json.load(file) == {"edi": "2023-06-03T00:00:00"}
+
+
+def test_sync_from_source_raises_when_changes_fail(pasta, registrations_file):
+    """A failed change list raises, and leaves the watermark unwritten."""
+    pasta.changes = []
+    environ["PASTA_ENVIRONMENT"] = pasta.url + "/missing"
+    with pytest.raises(requests.HTTPError):
+        sync_from_source(registrations_file, ["edi"], since="2023-01-01T00:00:00")
+    assert not os.path.exists(f"{registrations_file}.watermark")
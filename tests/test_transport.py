@@ -0,0 +1,219 @@
+"""Test the transport.py module."""
+
+import gzip
+import json
+import pytest
+import requests
+from gbif_registrar._http import _request
+from gbif_registrar._utilities import _read_gbif_dataset_metadata
+from gbif_registrar.configure import load_configuration, unload_configuration
+from gbif_registrar import transport
+from gbif_registrar.transport import (
+    CassetteMissError,
+    HttpxTransport,
+    MemoryTransport,
+    RecordingTransport,
+    ReplayTransport,
+    RequestsTransport,
+    get_transport,
+    use_transport,
+)
+
+
+class StubTransport:
+    """Serve canned responses in order, in place of the network."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def send(self, method, url, **kwargs):
+        """Return the next canned response."""
+        self.requests.append((method, url, kwargs))
+        status_code, body = self.responses.pop(0)
+        resp = requests.Response()
+        resp.status_code = status_code
+        resp.reason = "OK"
+        resp.headers["Content-Type"] = "application/json"
+        resp.headers["Set-Cookie"] = "session=secret-session"
+        resp._content = body
+        return resp
+
+
+def test_record_and_replay(tmp_path, gbif_dataset_uuid):
+    """Recorded exchanges are replayed without the network, and repeated
+    requests get the recorded responses in order."""
+    load_configuration("tests/test_config.json")
+    cassette_file = tmp_path / "cassette.jsonl.gz"
+    stub = StubTransport(
+        (200, b'{"pubDate": "2019-08-01"}'),
+        (200, b'{"pubDate": "2020-01-01"}'),
+        (200, b"\xff\xfe"),
+    )
+    with RecordingTransport(cassette_file, stub) as recorder:
+        with use_transport(recorder):
+            first = _read_gbif_dataset_metadata(gbif_dataset_uuid)
+            second = _read_gbif_dataset_metadata(gbif_dataset_uuid)
+            _request("GET", "https://pasta-s.lternet.edu/binary", auth=("u", "p"))
+    assert get_transport() is not recorder
+    with gzip.open(cassette_file, "rt", encoding="utf-8") as cassette:
+        content = cassette.read()
+    assert "Demo123" not in content
+    assert "secret-session" not in content
+
+    with use_transport(ReplayTransport(cassette_file)):
+        assert _read_gbif_dataset_metadata(gbif_dataset_uuid) == first
+        assert _read_gbif_dataset_metadata(gbif_dataset_uuid) == second
+        assert _read_gbif_dataset_metadata(gbif_dataset_uuid) == second
+        resp = _request("GET", "https://pasta-s.lternet.edu/binary")
+        assert resp.content == b"\xff\xfe"
+        with pytest.raises(CassetteMissError):
+            _request("GET", "https://pasta-s.lternet.edu/unrecorded")
+    unload_configuration()
+
+
+def test_recording_survives_a_crash(tmp_path):
+    """Exchanges are in the cassette as soon as they are recorded, and a
+    partially written last exchange is left out on replay."""
+    cassette_file = tmp_path / "cassette.jsonl.gz"
+    stub = StubTransport((200, b'{"key": "first"}'), (200, b'{"key": "second"}'))
+    recorder = RecordingTransport(cassette_file, stub)
+    recorder.send("GET", "https://api.gbif-uat.org/v1/dataset/a")
+    recorder.send("GET", "https://api.gbif-uat.org/v1/dataset/b")
+    # The recording session crashes mid-write, without closing the recorder
+    content = cassette_file.read_bytes()
+    cassette_file.write_bytes(content[: len(content) - 10])
+    replay = ReplayTransport(cassette_file)
+    resp = replay.send("GET", "https://api.gbif-uat.org/v1/dataset/a")
+    assert resp.json() == {"key": "first"}
+    with pytest.raises(CassetteMissError):
+        replay.send("GET", "https://api.gbif-uat.org/v1/dataset/b")
+    recorder.close()
+
+
+def test_replay_scales_recorded_latency(tmp_path, mocker):
+    """Replayed responses are delayed by the scaled recorded latency."""
+    cassette_file = tmp_path / "cassette.jsonl.gz"
+    exchange = {
+        "method": "GET",
+        "url": "https://api.gbif-uat.org/v1/dataset",
+        "params": None,
+        "status_code": 200,
+        "reason": "OK",
+        "headers": {},
+        "elapsed": 0.5,
+        "body": json.dumps({"key": "value"}),
+        "body_encoding": "utf-8",
+    }
+    with gzip.open(cassette_file, "wt", encoding="utf-8") as cassette:
+        cassette.write(json.dumps(exchange) + "\n")
+    sleep = mocker.patch("gbif_registrar.transport.time.sleep")
+    ReplayTransport(cassette_file).send("GET", exchange["url"])
+    sleep.assert_not_called()
+    resp = ReplayTransport(cassette_file, latency_scale=2).send("GET", exchange["url"])
+    sleep.assert_called_once_with(1.0)
+    assert resp.json() == {"key": "value"}
+    assert resp.elapsed.total_seconds() == 0.5
+
+
+def test_memory_transport_serves_added_responses(gbif_dataset_uuid):
+    """Responses added to a request are served in order, then the last
+    again, and requests without responses fail or get a 404."""
+    load_configuration("tests/test_config.json")
+    url = "http://api.gbif-uat.org/v1/dataset/" + gbif_dataset_uuid
+    memory = MemoryTransport()
+    memory.add("GET", url, {"pubDate": "2019-08-01"})
+    memory.add("GET", url, {"pubDate": "2020-01-01"})
+    with use_transport(memory):
+        assert _read_gbif_dataset_metadata(gbif_dataset_uuid)["pubDate"] == (
+            "2019-08-01"
+        )
+        for _ in range(2):
+            assert _read_gbif_dataset_metadata(gbif_dataset_uuid)["pubDate"] == (
+                "2020-01-01"
+            )
+        with pytest.raises(LookupError):
+            _request("GET", "https://pasta-s.lternet.edu/missing")
+    assert [request[:2] for request in memory.requests[:3]] == [("GET", url)] * 3
+    with use_transport(MemoryTransport(strict=False)):
+        resp = _request("GET", "https://pasta-s.lternet.edu/missing")
+        assert (resp.status_code, resp.reason) == (404, "Not Found")
+    unload_configuration()
+
+
+def test_requests_transport_reuses_its_session(mocker):
+    """Requests are sent with the one session of the transport, so its
+    connections are reused."""
+    session = mocker.Mock()
+    with RequestsTransport(session=session) as http1:
+        http1.send("GET", "https://api.gbif-uat.org/v1/dataset/a", timeout=60)
+        http1.send("POST", "https://api.gbif-uat.org/v1/dataset", data="{}")
+    session.get.assert_called_once_with(
+        "https://api.gbif-uat.org/v1/dataset/a", timeout=60
+    )
+    session.post.assert_called_once_with(
+        "https://api.gbif-uat.org/v1/dataset", data="{}"
+    )
+    session.close.assert_called_once()
+    assert isinstance(RequestsTransport().session, requests.Session)
+
+
+def test_httpx_transport_translates_requests(mocker, monkeypatch):
+    """Request bodies are sent as httpx content, and httpx responses are
+    returned as requests responses."""
+    client = mocker.Mock()
+    client.request.return_value = mocker.Mock(
+        status_code=201,
+        reason_phrase="Created",
+        headers={"Content-Type": "application/json"},
+        content=b'"4e70c80e"',
+    )
+    with HttpxTransport(client=client) as http2:
+        resp = http2.send(
+            "post", "https://api.gbif-uat.org/v1/dataset", data="{}", timeout=60
+        )
+    client.request.assert_called_once_with(
+        "POST", "https://api.gbif-uat.org/v1/dataset", content="{}", timeout=60
+    )
+    client.close.assert_called_once()
+    assert isinstance(resp, requests.Response)
+    assert (resp.status_code, resp.reason, resp.json()) == (201, "Created", "4e70c80e")
+    monkeypatch.setattr(transport, "httpx", None)
+    with pytest.raises(ImportError):
+        HttpxTransport()
+
+
+def test_httpx_transport_raises_requests_errors(mocker, monkeypatch):
+    """httpx transport errors are raised as the matching requests errors,
+    so they are retried like those of the default transport."""
+
+    class TransportError(Exception):
+        """Stands in for httpx.TransportError."""
+
+    class TimeoutException(TransportError):
+        """Stands in for httpx.TimeoutException."""
+
+    class ConnectTimeout(TimeoutException):
+        """Stands in for httpx.ConnectTimeout."""
+
+    fake_httpx = mocker.Mock(
+        TransportError=TransportError,
+        TimeoutException=TimeoutException,
+        ConnectTimeout=ConnectTimeout,
+    )
+    monkeypatch.setattr(transport, "httpx", fake_httpx)
+    client = mocker.Mock()
+    http2 = HttpxTransport(client=client)
+    url = "https://api.gbif-uat.org/v1/dataset"
+    for error, expected in (
+        (ConnectTimeout("connect"), requests.exceptions.ConnectTimeout),
+        (TimeoutException("read"), requests.exceptions.Timeout),
+        (TransportError("refused"), requests.exceptions.ConnectionError),
+    ):
+        client.request.side_effect = error
+        with pytest.raises(expected) as raised:
+            http2.send("GET", url)
+        assert raised.value.__cause__ is error
+    client.request.side_effect = ValueError("not a transport error")
+    with pytest.raises(ValueError):
+        http2.send("GET", url)
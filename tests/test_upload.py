@@ -2,6 +2,7 @@
 
 from re import search
 import pytest
+import requests
 from gbif_registrar._utilities import (
     _read_registrations_file,
 )
@@ -174,3 +175,23 @@ def test_upload_dataset_already_synchronized_but_not_listed(
     assert registrations_final.loc[index, "synchronized"]
     assert registrations_final.shape == registrations.shape
     assert "Deleted local dataset endpoints" not in captured.out  # Never made it here
+
+
+def test_upload_dataset_raises_when_check_fails(registrations, tmp_path, mocker):
+    """Test that the upload_dataset function raises when the synchronization
+    check fails for a reason other than a missing dataset, instead of
+    uploading the dataset again."""
+    registrations.loc[registrations.index[-1], "synchronized"] = False
+    local_dataset_id = registrations.loc[registrations.index[-1], "local_dataset_id"]
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    response = mocker.Mock(status_code=503, reason="Service Unavailable")
+    mocker.patch(
+        "gbif_registrar._utilities._is_synchronized",
+        side_effect=requests.HTTPError("503 Service Unavailable", response=response),
+    )
+    mock_delete = mocker.patch(
+        "gbif_registrar._utilities._delete_local_dataset_endpoints"
+    )
+    with pytest.raises(requests.HTTPError):
+        upload_dataset(local_dataset_id, tmp_path / "registrations.csv")
+    mock_delete.assert_not_called()
@@ -0,0 +1,110 @@
+"""Test the validate.py module."""
+
+import io
+import json
+import warnings
+from gbif_registrar import _utilities
+from gbif_registrar.configure import Config
+from gbif_registrar.partitions import partition_registrations
+from gbif_registrar.registry import Registry
+from gbif_registrar.transport import MemoryTransport, use_transport
+from gbif_registrar.validate import validate_registrations
+
+
+def test_validate_registrations_streams_capped_jsonl(registrations, tmp_path):
+    """Findings are written one per line, up to the cap of each rule, and
+    counted in the summary, instead of being warned."""
+    registrations["synchronized"] = False
+    registrations.loc[0, "local_dataset_id"] = "edi"
+    output = tmp_path / "findings.jsonl"
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter("always")
+        validate_registrations(Registry(registrations), output, max_findings=2)
+        assert len(warns) == 0
+    with open(output, "r", encoding="utf-8") as findings:
+        lines = [json.loads(line) for line in findings]
+    assert lines[0] == {
+        "rule": "synchronized",
+        "message": "Unsynchronized registrations in rows",
+        "row": 1,
+    }
+    assert [line["rule"] for line in lines[:-1]].count("synchronized") == 2
+    assert lines[-1]["summary"]["synchronized"] == {"findings": 7, "written": 2}
+    assert lines[-1]["summary"]["local_dataset_id_format"]["findings"] == 1
+
+
+def test_validate_registrations_writes_sarif(registrations, tmp_path):
+    """Findings about rows point to their lines in the registrations file."""
+    registrations.loc[2, "local_dataset_id"] = "edi.356"
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    output = io.StringIO()
+    validate_registrations(tmp_path / "registrations.csv", output, "sarif")
+    run = json.loads(output.getvalue())["runs"][0]
+    assert run["tool"]["driver"]["name"] == "gbif_registrar"
+    result = run["results"][0]
+    assert result["ruleId"] == "local_dataset_id_format"
+    region = result["locations"][0]["physicalLocation"]["region"]
+    assert region == {"startLine": 4}
+
+
+def test_validate_partitioned_registrations_like_file(registrations, tmp_path):
+    """A partitioned directory has the findings of its registrations file,
+    including clashes between registrations of different partitions."""
+    registrations.loc[1, "synchronized"] = False
+    registrations.loc[2, "local_dataset_id"] = "edi.356"
+    registrations.loc[5, "gbif_dataset_uuid"] = registrations.loc[
+        0, "gbif_dataset_uuid"
+    ]
+    registrations.loc[6, "local_dataset_endpoint"] = None
+    registrations.to_csv(tmp_path / "registrations.csv", index=False)
+    partition_registrations(tmp_path / "registrations.csv", tmp_path / "partitions")
+    expected = io.StringIO()
+    validate_registrations(tmp_path / "registrations.csv", expected)
+    output = io.StringIO()
+    validate_registrations(tmp_path / "partitions", output, max_workers=2)
+    assert output.getvalue() == expected.getvalue()
+    assert '"value": "knb-lter-msp.1"' in output.getvalue()
+
+
+def test_validate_registrations_remote_reports_unreachable_rows(registrations):
+    """Unreachable endpoints and metadata documents are reported by row, each
+    URL is requested once, and results are reused by later validations."""
+    _utilities._reachability_cache.clear()
+    config = Config.from_file("tests/test_config.json")
+    # An endpoint is gone, a server doesn't support HEAD, and a metadata
+    # document is missing.
+    status_codes = {
+        registrations.loc[1, "local_dataset_endpoint"]: 404,
+        registrations.loc[2, "local_dataset_endpoint"]: 405,
+        _utilities._get_local_dataset_metadata_url("knb-lter-msp.1.2", config): 404,
+    }
+    memory = MemoryTransport()
+    for local_dataset_id, endpoint in zip(
+        registrations["local_dataset_id"], registrations["local_dataset_endpoint"]
+    ):
+        url = _utilities._get_local_dataset_metadata_url(local_dataset_id, config)
+        for head_url in (endpoint, url):
+            memory.add("HEAD", head_url, status_code=status_codes.get(head_url, 200))
+    memory.add("GET", registrations.loc[2, "local_dataset_endpoint"], status_code=206)
+    registry = Registry(registrations)
+    with use_transport(memory):
+        output = io.StringIO()
+        validate_registrations(registry, output, remote=True, config=config)
+        sent = len(memory.requests)
+        validate_registrations(registry, io.StringIO(), remote=True, config=config)
+    assert sent == 2 * len(registrations) + 1
+    assert len(memory.requests) == sent
+    findings = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert findings[:-1] == [
+        {
+            "rule": "endpoint_reachable",
+            "message": "Unreachable local_dataset_endpoint in rows",
+            "row": 2,
+        },
+        {
+            "rule": "metadata_reachable",
+            "message": "Unreachable metadata documents in rows",
+            "row": 6,
+        },
+    ]
+    _utilities._reachability_cache.clear()